@@ -0,0 +1,288 @@
+import os
+import io
+import re
+import sys
+import json
+import math
+import time
+import platform
+import argparse
+import tempfile
+import resource
+import subprocess
+import contextlib
+from datetime import datetime, timezone
+
+BUNDLED_MODELS = ["Duplex_A.ifc", "MAD_SCIENTIST_21.ifc"]
+DEFAULT_SCALES = [10, 100, 1000]
+SYNTHETIC_DIR = "benchmark_models"
+RESULTS_DIR = "benchmark_results"
+REGRESSION_THRESHOLD = 0.10
+# Entities kept once in a scaled model; everything below the building is replicated
+SHARED_ROOT_TYPES = ["IfcProject", "IfcSite", "IfcBuilding", "IfcOwnerHistory",
+                     "IfcGeometricRepresentationContext", "IfcUnitAssignment"]
+GUID_PATTERN = re.compile(r"^(#\d+\s*=\s*\w+\s*\(\s*')([^']{22})'")
+REFERENCE_PATTERN = re.compile(r"#(\d+)")
+
+def peak_rss_mb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return usage / (1024 * 1024) if sys.platform == "darwin" else usage / 1024
+
+def shared_entity_ids(ifc_file):
+    import ifcopenshell
+    shared = set()
+    for type_name in SHARED_ROOT_TYPES:
+        for entity in ifc_file.by_type(type_name):
+            shared.update(e.id() for e in ifc_file.traverse(entity))
+    # Relationships that only attach things to shared entities (e.g. building psets) stay shared too
+    for relationship in ifc_file.by_type("IfcRelationship"):
+        related = []
+        for name, value in relationship.get_info(recursive=False).items():
+            if name.startswith("Related"):
+                values = value if isinstance(value, (list, tuple)) else [value]
+                related.extend(v for v in values if isinstance(v, ifcopenshell.entity_instance))
+        if related and all(r.id() in shared for r in related):
+            shared.update(e.id() for e in ifc_file.traverse(relationship))
+    return shared
+
+def iter_statements(lines):
+    statement = []
+    for line in lines:
+        statement.append(line.rstrip("\r\n"))
+        if line.rstrip().endswith(";"):
+            yield "".join(statement)
+            statement = []
+    if statement:
+        yield "".join(statement)
+
+def offset_references(statement, offset, shared):
+    # Splitting on quotes alternates between code and string literals, so '#12' inside names is left alone
+    parts = statement.split("'")
+    for i in range(0, len(parts), 2):
+        parts[i] = REFERENCE_PATTERN.sub(
+            lambda m: m.group(0) if int(m.group(1)) in shared else f"#{int(m.group(1)) + offset}", parts[i])
+    return "'".join(parts)
+
+def write_scaled_model(source_path, scale, output_path):
+    import ifcopenshell
+    import ifcopenshell.guid
+    source = ifcopenshell.open(source_path)
+    shared = shared_entity_ids(source)
+    root_ids = {entity.id() for entity in source.by_type("IfcRoot")}
+    del source
+    with open(source_path, encoding="utf-8", errors="surrogateescape") as f:
+        text = f.read()
+    header, rest = text.split("DATA;", 1)
+    data, footer = rest.rsplit("ENDSEC;", 1)
+    statements = [s for s in iter_statements(data.splitlines(keepends=True)) if s.strip()]
+    max_id = max(int(REFERENCE_PATTERN.match(s.strip()).group(1)) for s in statements)
+    replicated = []
+    for statement in statements:
+        entity_id = int(REFERENCE_PATTERN.match(statement.strip()).group(1))
+        if entity_id not in shared:
+            replicated.append((statement.strip(), entity_id in root_ids))
+
+    with open(output_path, "w", encoding="utf-8", errors="surrogateescape") as out:
+        out.write(header + "DATA;\n")
+        for statement in statements:
+            out.write(statement.strip() + "\n")
+        for copy in range(1, scale):
+            offset = copy * max_id
+            for statement, is_root in replicated:
+                statement = offset_references(statement, offset, shared)
+                if is_root:
+                    statement = GUID_PATTERN.sub(lambda m: f"{m.group(1)}{ifcopenshell.guid.new()}'", statement)
+                out.write(statement + "\n")
+        out.write("ENDSEC;" + footer)
+    return output_path
+
+def synthetic_model_path(source_path, scale):
+    base = os.path.splitext(os.path.basename(source_path))[0]
+    return os.path.join(SYNTHETIC_DIR, f"{base}_x{scale}.ifc")
+
+def ensure_synthetic_model(source_path, scale):
+    path = synthetic_model_path(source_path, scale)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(source_path):
+        os.makedirs(SYNTHETIC_DIR, exist_ok=True)
+        print(f"Generating {path} ...")
+        write_scaled_model(source_path, scale, path)
+    return path
+
+def timed(results, name, func, items=None):
+    started = time.perf_counter()
+    value = func()
+    seconds = time.perf_counter() - started
+    entry = {"seconds": round(seconds, 6)}
+    if items is not None:
+        entry["items"] = items
+        entry["items_per_second"] = round(items / seconds, 1) if seconds > 0 else None
+    results[name] = entry
+    return value
+
+def benchmark_model(path):
+    import ifcopenshell
+    from command_line_ifc_viewer_editor import IFCViewerEditor, export_to_csv
+
+    results = {}
+    size_mb = os.path.getsize(path) / (1024 * 1024)
+    ifc_file = timed(results, "open", lambda: ifcopenshell.open(path))
+    results["open"]["megabytes_per_second"] = round(size_mb / results["open"]["seconds"], 2)
+    viewer_editor = IFCViewerEditor(path, ifc_file)
+    entity_count = len(list(ifc_file))
+    products = ifc_file.by_type("IfcProduct")
+
+    element_types = timed(results, "list_all_element_types", viewer_editor.list_all_element_types, entity_count)
+    timed(results, "find_close_matches", lambda: viewer_editor.find_close_matches("wall"), entity_count)
+    timed(results, "count_elements_by_type", lambda: [viewer_editor.count_elements_by_type(t) for t in element_types], len(element_types))
+    properties = timed(results, "get_element_properties", lambda: [viewer_editor.get_element_properties(p) for p in products], len(products))
+
+    def extract_layers():
+        layers = []
+        for product, element_properties in zip(products, properties):
+            for i in range(element_properties.get("NumberOfLayers", 0) if element_properties.get("HasLayers") else 0):
+                layer = viewer_editor.select_layer(i, product)
+                if layer:
+                    layers.append(viewer_editor.get_layer_properties(layer))
+        return layers
+    layers = timed(results, "layer_extraction", extract_layers)
+    results["layer_extraction"]["items"] = len(layers)
+
+    with tempfile.TemporaryDirectory(prefix="ifc_benchmark_") as workdir, contextlib.redirect_stdout(io.StringIO()):
+        csv_path = os.path.join(workdir, "collective_properties.csv")
+        timed(results, "export_to_csv", lambda: export_to_csv(csv_path, properties), len(properties))
+        viewer_editor.ifc_file_path = os.path.join(workdir, "saved.ifc")
+        timed(results, "save_ifc_file", viewer_editor.save_ifc_file)
+        # save_ifc_file writes a backup and the file itself
+        results["save_ifc_file"]["megabytes_per_second"] = round(2 * size_mb / results["save_ifc_file"]["seconds"], 2)
+
+    return {
+        "path": path,
+        "size_mb": round(size_mb, 2),
+        "schema": ifc_file.schema,
+        "entities": entity_count,
+        "products": len(products),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "operations": results
+    }
+
+def run_isolated(path):
+    # A fresh interpreter per model keeps peak RSS figures independent
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", path],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def scaling_exponent(points):
+    # Slope of log(time) against log(size); 1.0 means linear scaling
+    points = [(x, y) for x, y in points if x > 0 and y > 0]
+    if len(points) < 2:
+        return None
+    xs = [math.log(x) for x, _ in points]
+    ys = [math.log(y) for _, y in points]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    if variance == 0:
+        return None
+    return round(sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance, 3)
+
+def scaling_curves(runs):
+    curves = {}
+    for source in {run["source"] for run in runs}:
+        series = sorted((r for r in runs if r["source"] == source), key=lambda r: r["scale"])
+        curves[source] = {}
+        for operation in series[0]["operations"]:
+            points = [(r["entities"], r["operations"][operation]["seconds"]) for r in series]
+            curves[source][operation] = {
+                "points": [{"scale": r["scale"], "entities": x, "seconds": y} for r, (x, y) in zip(series, points)],
+                "exponent": scaling_exponent(points)
+            }
+    return curves
+
+def print_report(report):
+    from tabulate import tabulate
+    rows = []
+    for run in report["runs"]:
+        for operation, entry in run["operations"].items():
+            rows.append([os.path.basename(run["path"]), run["scale"], operation, entry["seconds"],
+                         entry.get("items_per_second", ""), run["peak_rss_mb"]])
+    print(tabulate(rows, headers=["Model", "Scale", "Operation", "Seconds", "Items/s", "Peak RSS MB"], tablefmt="grid"))
+    curve_rows = []
+    for source, operations in report["scaling"].items():
+        for operation, curve in operations.items():
+            curve_rows.append([source, operation, " ".join(f"{p['seconds']:.3f}" for p in curve["points"]), curve["exponent"]])
+    print("\nScaling (seconds per scale, log-log exponent):")
+    print(tabulate(curve_rows, headers=["Model", "Operation", "Seconds", "Exponent"], tablefmt="grid"))
+
+def compare_reports(baseline, current, threshold=REGRESSION_THRESHOLD):
+    baseline_runs = {(r["source"], r["scale"]): r for r in baseline["runs"]}
+    regressions = []
+    for run in current["runs"]:
+        previous = baseline_runs.get((run["source"], run["scale"]))
+        if previous is None:
+            continue
+        for operation, entry in run["operations"].items():
+            before = previous["operations"].get(operation, {}).get("seconds")
+            if before and entry["seconds"] > before * (1 + threshold):
+                regressions.append([run["source"], run["scale"], operation, before, entry["seconds"],
+                                    f"{(entry['seconds'] / before - 1) * 100:.1f}%"])
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark IFCViewerEditor operations.")
+    parser.add_argument("--models", nargs="*", default=BUNDLED_MODELS)
+    parser.add_argument("--scales", nargs="*", type=int, default=DEFAULT_SCALES,
+                        help="Synthetic model sizes as multiples of each model's storeys")
+    parser.add_argument("--output", help="Where to store the JSON results (default: benchmark_results/<commit>.json)")
+    parser.add_argument("--compare", help="Earlier results file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(benchmark_model(args.worker)))
+        return 0
+
+    runs = []
+    for source in args.models:
+        for scale in [1] + [s for s in args.scales if s > 1]:
+            path = source if scale == 1 else ensure_synthetic_model(source, scale)
+            print(f"Benchmarking {path} ...")
+            run = run_isolated(path)
+            run.update({"source": os.path.basename(source), "scale": scale})
+            runs.append(run)
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "runs": runs,
+        "scaling": scaling_curves(runs)
+    }
+    print_report(report)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare_reports(json.load(f), report, args.threshold)
+        if regressions:
+            from tabulate import tabulate
+            print("\nRegressions:")
+            print(tabulate(regressions, headers=["Model", "Scale", "Operation", "Before", "After", "Change"], tablefmt="grid"))
+            return 1
+        print("No regressions found.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
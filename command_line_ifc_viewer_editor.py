@@ -1,14 +1,53 @@
 import os
+import sys
 import csv
 import re
+import time
+import argparse
+import sqlite3
+from collections.abc import Mapping
+
+if __name__ == "__main__" and any(arg.split('=')[0] == '--connect' for arg in sys.argv[1:]):
+    # Thin client of a warm model server: none of the modelling stack below is imported
+    from ifc_cli_client import main as client_main
+    sys.exit(client_main(sys.argv[1:]))
+
 import ifcopenshell
 from ifcopenshell.util import element, placement
+from ifc_compact_records import PropertyTable
+from ifc_spatial_index import SpatialIndex
+from ifc_relationship_index import RelationshipIndex
+from ifc_compaction import compact_in_place
+from ifc_watch import FileWatcher, apply_file_changes, edited_ids
+from ifc_journal import Journal, JournalError
+from ifc_changeset import ChangeTracker, ChangesetError, edit_targets, apply_edit, convert_value, set_property_value, load_changeset, write_changeset
 from tabulate import tabulate
+from ifc_profiling import enable, get_metrics, instrument_class, instrument_function, profiled
 
 class IFCViewerEditor:
-    def __init__(self, ifc_file_path):
+    def __init__(self, ifc_file_path, ifc_file=None, fingerprint=None, processes=None):
         self.ifc_file_path = ifc_file_path
-        self.ifc_file = ifcopenshell.open(ifc_file_path)
+        self.ifc_file = ifc_file if ifc_file is not None else ifcopenshell.open(ifc_file_path)
+        # Worker processes for geometry, validation and partitioning; None uses every core. Pass
+        # 1 from threaded hosts, where forking while other threads hold locks is unsafe.
+        self.processes = processes
+        # Properties are kept column-wise once computed; get_element_properties returns read-only views
+        self.property_table = PropertyTable()
+        # Bumped on every edit; results derived from the model are cached against it
+        self.model_version = 0
+        self._spatial_index = None
+        self._relationship_index = None
+        self._geometry_index = None
+        self._quantity_engine = None
+        self._aggregation = None
+        self.changes = ChangeTracker(self.ifc_file, ifc_file_path if ifc_file is None else None, fingerprint)
+        # Undo and redo; persisted next to files opened from disk so a crashed session can be recovered
+        self.journal = Journal(self.ifc_file, self.changes, ifc_file_path if ifc_file is None else None)
+        # Set by watch(); refresh_from_disk then re-reads only what changed in the file
+        self.watcher = None
+        self.saved_version = 0
+        # Merge duplicate value entities and drop orphans whenever the model is saved
+        self.compact_on_save = False
         self.selected_elements = []
         self.selected_layer = None
 
@@ -88,6 +127,25 @@ class IFCViewerEditor:
     def get_element_properties(self, element):
         if element is None:
             return {}
+        properties = self.property_table.get(element.id())
+        if properties is None:
+            get_metrics().count("cache.properties.miss")
+            properties = self.property_table.add(element.id(), self._compute_element_properties(element))
+        else:
+            get_metrics().count("cache.properties.hit")
+        return properties
+
+    def invalidate_properties(self, elements=None):
+        self.model_version += 1
+        if elements is not None:
+            self.journal.touched(elements)
+        if elements is None:
+            self.property_table.clear()
+            return
+        for element in elements:
+            self.property_table.discard(element.id())
+
+    def _compute_element_properties(self, element):
         properties = {
             "Name": element.Name,
             "Type": element.is_a(),
@@ -115,6 +173,10 @@ class IFCViewerEditor:
         for qto_name, qto_data in quantities.items():
             for quantity_name, quantity_value in qto_data.items():
                 properties[f"{qto_name}.{quantity_name}"] = quantity_value
+        if not quantities and self._quantity_engine is not None:
+            # Derived from the geometry when the exporter wrote no quantity sets, for elements
+            # passed to derive_quantities first
+            properties.update(self._quantity_engine.quantities(element))
 
         # Add material information
         materials = ifcopenshell.util.element.get_materials(element)
@@ -133,19 +195,6 @@ class IFCViewerEditor:
                             'Thickness': layer.LayerThickness,
                             'IsVentilated': layer.IsVentilated
                         }
-                        
-                        # Calculate area and volume if possible
-                        if element.is_a('IfcWall') or element.is_a('IfcSlab'):
-                            quantity_set = ifcopenshell.util.element.get_psets(element, qtos_only=True)
-                            if 'Qto_WallBaseQuantities' in quantity_set:
-                                area = quantity_set['Qto_WallBaseQuantities'].get('GrossFootprintArea', 0)
-                                layer_info['Area'] = area
-                                layer_info['Volume'] = area * layer.LayerThickness
-                            elif 'Qto_SlabBaseQuantities' in quantity_set:
-                                area = quantity_set['Qto_SlabBaseQuantities'].get('GrossArea', 0)
-                                layer_info['Area'] = area
-                                layer_info['Volume'] = area * layer.LayerThickness
-                        
                         properties['MaterialLayers'].append(layer_info)
                 elif materials.is_a('IfcMaterialList'):
                     properties['MaterialList'] = [m.Name for m in materials.Materials]
@@ -167,37 +216,242 @@ class IFCViewerEditor:
     def update_element_property(self, elements, property_name, new_value):
         if not elements:
             return False
+        with self.journal.transaction(f"Set {property_name} on {len(elements)} element(s)"):
+            return self._update_element_property(elements, property_name, new_value)
+
+    def _update_element_property(self, elements, property_name, new_value):
         success = False
         for element in elements:
             if property_name == "Name":
+                self.journal.track(element)
                 element.Name = new_value
+                self.changes.record({'op': 'set_attribute', 'global_id': element.GlobalId, 'attribute': 'Name', 'value': new_value}, element)
+                self.invalidate_properties([element])
                 success = True
             else:
                 for definition in element.IsDefinedBy:
                     if definition.is_a('IfcRelDefinesByProperties'):
                         property_set = definition.RelatingPropertyDefinition
+                        if not property_set.is_a('IfcPropertySet'):
+                            continue
                         for property in property_set.HasProperties:
                             if property.Name == property_name:
                                 if hasattr(property, 'NominalValue'):
-                                    property.NominalValue.wrappedValue = new_value
-                                    success = True
+                                    try:
+                                        value_type, value = convert_value(property.NominalValue, new_value)
+                                    except ValueError:
+                                        continue
                                 elif hasattr(property, 'Value'):
-                                    property.Value = new_value
-                                    success = True
+                                    value_type, value = None, new_value
+                                else:
+                                    continue
+                                self.journal.track(property)
+                                set_property_value(self.ifc_file, property, value, value_type)
+                                self.changes.record({'op': 'set_property', 'global_id': element.GlobalId, 'pset': property_set.Name,
+                                                     'property': property_name, 'value': value, 'value_type': value_type}, property)
+                                success = True
+                                # The property set may be shared by several elements
+                                self.invalidate_properties(definition.RelatedObjects)
         return success
 
-    def save_ifc_file(self):
+    def apply_changeset(self, changeset):
+        skipped = []
+        with self.journal.transaction(f"Apply changeset of {len(changeset['edits'])} edit(s)"):
+            for edit in changeset['edits']:
+                try:
+                    self.journal.track(*edit_targets(self.ifc_file, edit))
+                    self.changes.record(edit, *apply_edit(self.ifc_file, edit))
+                except ChangesetError as e:
+                    skipped.append(str(e))
+        self.invalidate_properties()
+        return skipped
+
+    def save_ifc_file(self, compact=None):
         try:
             backup_path = self.ifc_file_path + '.bak'
             self.ifc_file.write(backup_path)
             print(f"Backup created: {backup_path}")
             self.ifc_file.write(self.ifc_file_path)
+            compact = self.compact_on_save if compact is None else compact
+            if compact:
+                print(compact_in_place(self.ifc_file_path).summary())
+                self._reload_compacted()
+            else:
+                self.journal.rebase()
+            if self.watcher is not None:
+                self.watcher.rescan()
+            self.saved_version = self.model_version
             print("Changes saved successfully.")
             return True
         except Exception as e:
             print(f"Error saving file: {e}")
             return False
 
+    def undo(self):
+        transaction = self.journal.undo()
+        if transaction is not None:
+            self._invalidate_transaction(transaction)
+        return transaction
+
+    def redo(self):
+        transaction = self.journal.redo()
+        if transaction is not None:
+            self._invalidate_transaction(transaction)
+        return transaction
+
+    def _invalidate_transaction(self, transaction):
+        if transaction.elements:
+            self.invalidate_properties([self.ifc_file.by_id(element_id) for element_id in transaction.elements])
+        else:
+            self.invalidate_properties()
+
+    def recover_journal(self, replay=True):
+        # Reapplies the edits of a session that ended without saving; without replay only the
+        # undo history of the last save is restored
+        applied = self.journal.recover(replay)
+        if applied:
+            self.invalidate_properties()
+        return applied
+
+    def has_unsaved_changes(self):
+        return self.model_version != self.saved_version
+
+    def watch(self):
+        # Remembers the file as it is now; refresh_from_disk applies later versions of it
+        if self.watcher is None:
+            self.watcher = FileWatcher(self.ifc_file_path)
+        return self.watcher
+
+    def refresh_from_disk(self):
+        # Brings the model in line with a newer version of its file, re-reading only the entity
+        # lines that differ; unsaved edits give way to the file. None if the file is unchanged.
+        if self.watcher is None:
+            return None
+        started = time.perf_counter()
+        selected_ids = [e.id() for e in self.selected_elements]
+        changes = self.watcher.poll(edited_ids(self.changes, self.ifc_file))
+        if changes is None:
+            return None
+        if changes.full:
+            self._reload_file()
+        else:
+            self._reindex(*apply_file_changes(self.ifc_file, changes))
+        self.watcher.accept(changes)
+        # The undo history and change log were relative to the old file
+        self.journal.discard()
+        self.changes = ChangeTracker(self.ifc_file, self.ifc_file_path)
+        self.journal = Journal(self.ifc_file, self.changes, self.ifc_file_path)
+        self.saved_version = self.model_version
+        self.selected_elements = [e for e in map(self._find, selected_ids) if e is not None]
+        self.selected_layer = None
+        changes.seconds = time.perf_counter() - started
+        return changes
+
+    def _reindex(self, element_ids, geometric_ids, structural):
+        # Types are indexed by ifcopenshell itself and relationships per model version; the rest
+        # only forget the elements that changed
+        self.model_version += 1
+        for element_id in element_ids:
+            self.property_table.discard(element_id)
+        if self._quantity_engine is not None:
+            for element_id in element_ids:
+                self._quantity_engine.values.pop(element_id, None)
+        if self._geometry_index is not None and geometric_ids:
+            self._geometry_index = self._geometry_index.refreshed(geometric_ids)
+        if structural:
+            self._spatial_index = None
+
+    def _reload_compacted(self):
+        # Compaction merged and dropped value entities the model in memory still has, so edits
+        # journaled against it could not be replayed onto the file. The model is read back and the
+        # journal restarts at the same path without the undo history; elements keep their ids.
+        selected_ids = [e.id() for e in self.selected_elements]
+        self._reload_file()
+        self.changes.ifc_file = self.ifc_file
+        self.journal.discard()
+        self.journal = Journal(self.ifc_file, self.changes, self.journal.model_path)
+        self.selected_elements = [e for e in map(self._find, selected_ids) if e is not None]
+        self.selected_layer = None
+
+    def _reload_file(self):
+        self.ifc_file = ifcopenshell.open(self.ifc_file_path)
+        self.property_table = PropertyTable()
+        self._spatial_index = None
+        self._relationship_index = None
+        self._geometry_index = None
+        self._quantity_engine = None
+        self._aggregation = None
+        self.model_version += 1
+
+    def _find(self, element_id):
+        try:
+            return self.ifc_file.by_id(element_id)
+        except RuntimeError:
+            return None
+
+    def spatial_index(self):
+        # Built on first use; property edits do not change containment
+        if self._spatial_index is None:
+            self._spatial_index = SpatialIndex(self.ifc_file)
+        return self._spatial_index
+
+    def relationship_index(self):
+        # Rebuilt after edits, which can add property sets
+        if self._relationship_index is None or self._relationship_index[0] != self.model_version:
+            self._relationship_index = (self.model_version, RelationshipIndex(self.ifc_file))
+        return self._relationship_index[1]
+
+    def geometry_index(self):
+        # Tessellation is slow: boxes are built on first use and cached on disk per file revision
+        if self._geometry_index is None:
+            from ifc_geometry_index import GeometryIndex
+            self._geometry_index = GeometryIndex.for_model(self.ifc_file, self.ifc_file_path, self.changes.fingerprint, self.processes)
+        return self._geometry_index
+
+    def quantity_engine(self):
+        if self._quantity_engine is None:
+            from ifc_quantities import QuantityEngine
+            self._quantity_engine = QuantityEngine(self.ifc_file, self.processes)
+        return self._quantity_engine
+
+    def derive_quantities(self, elements):
+        # Opt-in geometry work for elements without quantity sets, batched before their properties
+        # are read; rows already cached without the derived values are dropped
+        engine = self.quantity_engine()
+        pending = [e for e in elements if e.id() not in engine.values]
+        engine.derive(pending)
+        for element in pending:
+            if engine.values.get(element.id()) is not None:
+                self.property_table.discard(element.id())
+
+    def get_layer_quantities(self, element, layer):
+        return self.quantity_engine().layer_quantities(element, layer, self.get_element_properties(element))
+
+    def aggregate_quantities(self, group_by, quantity='Volume', functions=None):
+        if self._aggregation is None:
+            from ifc_aggregation import AggregationEngine
+            self._aggregation = AggregationEngine(self)
+        return self._aggregation.aggregate(group_by, quantity, functions or ('sum', 'count', 'mean', 'min', 'max'))
+
+    def validate(self, rules=None):
+        from ifc_validation import ModelValidator
+        validator = ModelValidator(self.ifc_file, rules, self.spatial_index(), self.relationship_index(), self.processes)
+        return validator.run(self.ifc_file_path)
+
+    def extract_elements(self, elements, output_path):
+        from ifc_partition import build_partition
+        build_partition(self.ifc_file, [e.id() for e in elements], self.spatial_index()).write(output_path)
+        return output_path
+
+    def extract_partitions(self, scheme, output_dir):
+        from ifc_partition import partitions_by, write_partitions
+        return sorted(write_partitions(self.ifc_file, partitions_by(self.ifc_file, scheme, self.spatial_index()), output_dir, self.processes))
+
+    def export_graph(self, path, elements=None):
+        # JSON Lines or SQLite, chosen by the file extension
+        from ifc_graph_export import GraphExporter, export_graph
+        return export_graph(GraphExporter(self.ifc_file, self.spatial_index(), self.relationship_index()), path, elements)
+
     def count_elements_by_type(self, element_type):
         return len(self.ifc_file.by_type(element_type))
 
@@ -250,6 +504,86 @@ class IFCViewerEditor:
         print("No layer found at the specified index.")
         return None
 
+def diff_helper(viewer_editor):
+    other_path = input("Enter the path of the other revision of the IFC file: ")
+    if not os.path.exists(other_path):
+        print(f"File not found: {other_path}")
+        return
+    from ifc_model_diff import diff_models, print_diff
+    other_file = ifcopenshell.open(other_path)
+    # The loaded model, including unsaved edits, is treated as the newer revision
+    print_diff(diff_models(other_file, viewer_editor.ifc_file))
+
+def changeset_helper(viewer_editor):
+    if not len(viewer_editor.changes):
+        print("No changes have been made since the model was opened.")
+        return
+    default_name = os.path.splitext(os.path.basename(viewer_editor.ifc_file_path))[0] + '_changes.json'
+    path = input(f"Enter the changeset file name (default: {default_name}): ") or default_name
+    write_changeset(viewer_editor.changes, path)
+    print(f"Changeset with {len(viewer_editor.changes)} edits written to {path}")
+
+def apply_helper(viewer_editor, background):
+    path = input("Enter the path of the changeset to apply: ")
+    if not os.path.exists(path):
+        print(f"File not found: {path}")
+        return
+    try:
+        changeset = load_changeset(path)
+    except (ChangesetError, ValueError) as e:
+        print(f"Error reading changeset: {e}")
+        return
+    skipped = run_write(background, viewer_editor.apply_changeset, changeset)
+    print(f"Applied {len(changeset['edits']) - len(skipped)} of {len(changeset['edits'])} edits. Use 'save' to keep them.")
+    for reason in skipped:
+        print(f"  Skipped: {reason}")
+
+def run_write(background, func, *args):
+    # Edits wait for running background exports to finish reading the model. Before the first
+    # export nothing can be reading, and the call runs here without starting the loop's thread.
+    background_loop, executor = background
+    if not background_loop.started:
+        return func(*args)
+    return background_loop.run(executor.run_write(func, *args))
+
+def recover_helper(viewer_editor):
+    # The undo history of the last save comes back without asking; unsaved edits only if wanted
+    pending = viewer_editor.journal.pending()
+    if not pending or input(f"Found {pending} unsaved edit, undo or redo record(s) from a previous session. Recover them? (y/n): ").lower() != 'y':
+        viewer_editor.recover_journal(replay=False)
+        return viewer_editor
+    try:
+        print(f"Recovered the previous session ({viewer_editor.recover_journal()} record(s) replayed).")
+        return viewer_editor
+    except JournalError as e:
+        # Part of the journal may already be applied: start again from the saved file
+        print(f"Could not recover the edits: {e}")
+        fresh = IFCViewerEditor(viewer_editor.ifc_file_path)
+        fresh.compact_on_save = viewer_editor.compact_on_save
+        return fresh
+
+def watch_helper(viewer_editor, background):
+    # Checked before each prompt: a stat call unless the file was written since the last check
+    watcher = viewer_editor.watcher
+    if watcher is None or not watcher.modified():
+        return
+    if viewer_editor.has_unsaved_changes():
+        answer = input("The file changed on disk. Reload it and discard unsaved edits? (y/n): ").lower()
+        if answer != 'y':
+            watcher.dismiss()
+            return
+    changes = run_write(background, viewer_editor.refresh_from_disk)
+    if changes is not None:
+        print(f"The file changed on disk. {changes.summary()}.")
+
+def history_helper(viewer_editor):
+    journal = viewer_editor.journal
+    if not journal.undo_stack and not journal.redo_stack:
+        print("No edits to undo or redo.")
+        return
+    rows = [["undo", t.name, len(t)] for t in reversed(journal.undo_stack)] + [["redo", t.name, len(t)] for t in reversed(journal.redo_stack)]
+    print(tabulate(rows, headers=["Stack", "Edit", "Changes"], tablefmt="grid"))
+
 def sanitize_filename(filename):
     # Remove invalid characters and replace spaces with underscores
     return re.sub(r'[\\/*?:"<>|]', "", filename).replace(" ", "_")
@@ -267,9 +601,24 @@ def print_help():
     print("  layers     - List and select layers of the current element")
     print("  update     - Update a property of the selected element")
     print("  save       - Save changes to the IFC file")
+    print("  undo       - Undo the last edit")
+    print("  redo       - Redo the last undone edit")
+    print("  history    - List the edits that can be undone and redone")
+    print("  validate   - Check the model against the built-in or a custom set of rules")
     print("  count      - Count elements of a specific type")
+    print("  spatial    - Browse sites, buildings, storeys and spaces, and select elements within one")
+    print("  region     - Select elements by bounding box, point or nearest distance")
+    print("  where      - Select the elements that use a material, layer set, property set or type")
+    print("  aggregate  - Total volumes or areas grouped by type, storey and/or material")
     print("  list       - List all element types in the IFC file")
     print("  export     - Export properties of the selected element or layer to CSV")
+    print("  graph      - Export elements with properties, layers, placement and relationships as JSON Lines or SQLite")
+    print("  extract    - Write the selected elements, or each storey, type or discipline, as standalone IFC files")
+    print("  diff       - Compare the loaded model with another revision of it")
+    print("  changeset  - Write the edits made since opening the model to a changeset file")
+    print("  apply      - Apply a changeset file to the loaded model")
+    print("  jobs       - Show the status of background exports")
+    print("  cancel     - Cancel a running background export")
     print("  quit       - Exit the program")
     print("\nNote: You can type 'quit' at any time to exit the program.")
 
@@ -316,6 +665,7 @@ def view_helper(viewer_editor):
 
 def properties_helper(viewer_editor):
     if viewer_editor.selected_elements:
+        viewer_editor.derive_quantities(viewer_editor.selected_elements)
         all_properties = []
         headers = ["Property"]
         for element in viewer_editor.selected_elements:
@@ -331,8 +681,9 @@ def properties_helper(viewer_editor):
     else:
         print("No elements selected. Use 'select' command first.")
 
-def layers_helper(viewer_editor):
+def layers_helper(viewer_editor, background=None):
     if viewer_editor.selected_elements:
+        viewer_editor.derive_quantities(viewer_editor.selected_elements)
         all_layers = []
         headers = ["Property"]
         for element in viewer_editor.selected_elements:
@@ -343,6 +694,7 @@ def layers_helper(viewer_editor):
                     layer = viewer_editor.select_layer(i, element)
                     if layer:
                         layer_props = viewer_editor.get_layer_properties(layer)
+                        layer_props.update(viewer_editor.get_layer_quantities(element, layer))
                         layer_props['Layer Number'] = i + 1
                         for key, value in layer_props.items():
                             if not any(prop[0] == key for prop in all_layers):
@@ -359,7 +711,7 @@ def layers_helper(viewer_editor):
             while True:
                 action = input("Enter 'export' to export layer properties, 'back' to return, or 'quit' to exit: ").lower()
                 if action == 'export':
-                    if export_helper(viewer_editor):
+                    if export_helper(viewer_editor, background):
                         return True
                 elif action == 'back':
                     break
@@ -404,7 +756,263 @@ def count_helper(viewer_editor):
                     print(f"  {i}. {et}: {count} elements")
         return False
 
-def export_helper(viewer_editor):
+def spatial_helper(viewer_editor):
+    index = viewer_editor.spatial_index()
+    nodes = [node for _, node in index.walk()]
+    if not nodes:
+        print("The IFC file has no spatial structure.")
+        return False
+    print("Spatial structure:")
+    for i, (depth, node) in enumerate(index.walk(), 1):
+        print(f"  {i}. {'  ' * depth}{index.describe(node.id)} ({index.count(node.id)} elements)")
+    while True:
+        choice = input("Enter the number, ID or name of a spatial node, or 'back' to return: ")
+        if choice.lower() == 'back':
+            return False
+        if choice.isdigit() and 1 <= int(choice) <= len(nodes):
+            matches = [nodes[int(choice) - 1]]
+        else:
+            matches = index.find_nodes(choice)
+        if len(matches) == 1:
+            node = matches[0]
+            break
+        print(f"{len(matches)} spatial nodes match '{choice}'. Please try again.")
+
+    print(f"\n{index.path(node.id)}")
+    histogram = sorted(node.histogram.items(), key=lambda item: (-item[1], item[0]))
+    if not histogram:
+        print("No elements are contained in this node.")
+        return False
+    print(tabulate(histogram, headers=["Element Type", "Count"], tablefmt="grid"))
+
+    choice = input("Enter an element type to select within this node (partial matches allowed), 'all', or 'back' to return: ")
+    if choice.lower() == 'back':
+        return False
+    types = None if choice.lower() == 'all' else index.matching_types(node.id, choice)
+    if types == []:
+        print(f"No element types found matching '{choice}'")
+        return False
+    elements = index.elements(node.id, types)
+    viewer_editor.selected_elements = elements
+    viewer_editor.selected_layer = None
+    print(f"Selected {len(elements)} elements. Use 'view', 'properties' or 'export' to work with them.")
+    for element in elements[:20]:
+        print(f"  ID {element.id()}, Type: {element.is_a()}, Name: {element.Name}")
+    if len(elements) > 20:
+        print(f"  ... and {len(elements) - 20} more")
+    return False
+
+def where_used_helper(viewer_editor):
+    from ifc_relationship_index import CATEGORIES
+    index = viewer_editor.relationship_index()
+    for i, category in enumerate(CATEGORIES, 1):
+        print(f"  {i}. {category} ({len(index.used_by[category])} in use)")
+    choice = input("Enter the number or name of what to look up, or 'back' to return: ").lower().strip()
+    if choice == 'back':
+        return False
+    if choice.isdigit() and 1 <= int(choice) <= len(CATEGORIES):
+        category = CATEGORIES[int(choice) - 1]
+    elif choice in CATEGORIES:
+        category = choice
+    else:
+        print(f"Unknown choice '{choice}'")
+        return False
+
+    prompt = f"Enter part of a {category} name or its ID"
+    if viewer_editor.selected_elements:
+        prompt += ", 'selected' for those of the selected elements"
+    text = input(prompt + ", or 'back' to return: ")
+    if text.lower() == 'back':
+        return False
+    if text.lower() == 'selected' and viewer_editor.selected_elements:
+        keys = list(dict.fromkeys(key for e in viewer_editor.selected_elements for key in index.keys_of(category, e)))
+    else:
+        keys = index.find(category, text)
+    if not keys:
+        print(f"No {category} in use matches '{text}'")
+        return False
+    for i, key in enumerate(keys[:20], 1):
+        print(f"  {i}. #{key} {index.describe(category, key)} ({len(index.used_by[category][key])} elements)")
+    if len(keys) > 20:
+        print(f"  ... and {len(keys) - 20} more")
+    if len(keys) > 1:
+        choice = input("Enter numbers separated by commas, 'all', or 'back' to return: ").lower()
+        if choice == 'back':
+            return False
+        if choice != 'all':
+            numbers = [int(n) for n in choice.replace(',', ' ').split() if n.isdigit() and 1 <= int(n) <= min(len(keys), 20)]
+            if not numbers:
+                print("Invalid selection.")
+                return False
+            keys = [keys[n - 1] for n in numbers]
+
+    elements = index.elements(category, keys)
+    viewer_editor.selected_elements = elements
+    viewer_editor.selected_layer = None
+    print(f"Selected {len(elements)} elements. Use 'view', 'properties', 'update' or 'export' to work with them.")
+    for element in elements[:20]:
+        print(f"  ID {element.id()}, Type: {element.is_a()}, Name: {element.Name}")
+    if len(elements) > 20:
+        print(f"  ... and {len(elements) - 20} more")
+    return False
+
+def parse_point(text):
+    values = text.replace(',', ' ').split()
+    try:
+        point = [float(v) for v in values]
+    except ValueError:
+        return None
+    return point if len(point) == 3 else None
+
+def parse_number(text, default):
+    try:
+        return float(text)
+    except ValueError:
+        return default
+
+def input_point(prompt):
+    while True:
+        text = input(prompt)
+        if text.lower() == 'back':
+            return None
+        point = parse_point(text)
+        if point is not None:
+            return point
+        print("Please enter three numbers, e.g. '1.5 -2 0'.")
+
+def region_helper(viewer_editor):
+    if viewer_editor._geometry_index is None:
+        print("Computing element bounding boxes. This is cached after the first run for each file...")
+    index = viewer_editor.geometry_index()
+    bounds = index.bounds()
+    if bounds is None:
+        print("No element geometry could be processed in this file.")
+        return False
+    low, high = bounds
+    print(f"{len(index)} elements with geometry. Model extents: ({', '.join(f'{v:.3f}' for v in low)}) to ({', '.join(f'{v:.3f}' for v in high)})")
+    mode = input("Query by 'box', 'point' or 'nearest' (or 'back' to return): ").lower()
+    if mode == 'box':
+        low = input_point("Enter the minimum corner as x y z: ")
+        high = low and input_point("Enter the maximum corner as x y z: ")
+        if high is None:
+            return False
+        elements = index.elements_in_box(low, high)
+    elif mode == 'point':
+        point = input_point("Enter the point as x y z: ")
+        if point is None:
+            return False
+        tolerance = parse_number(input("Enter a tolerance (default 0): "), 0.0)
+        elements = index.elements_at_point(point, tolerance)
+    elif mode == 'nearest':
+        point = input_point("Enter the point as x y z: ")
+        if point is None:
+            return False
+        count = input("Enter the number of elements to find (default 5): ")
+        nearest = index.nearest_elements(point, int(count) if count.isdigit() else 5)
+        for element, distance in nearest:
+            print(f"  ID {element.id()}, Type: {element.is_a()}, Name: {element.Name}, Distance: {distance:.3f}")
+        elements = [element for element, _ in nearest]
+    else:
+        return False
+    viewer_editor.selected_elements = elements
+    viewer_editor.selected_layer = None
+    print(f"Selected {len(elements)} elements.")
+    if mode != 'nearest':
+        for element in elements[:20]:
+            print(f"  ID {element.id()}, Type: {element.is_a()}, Name: {element.Name}")
+        if len(elements) > 20:
+            print(f"  ... and {len(elements) - 20} more")
+    return False
+
+def validate_helper(viewer_editor):
+    from ifc_validation import ValidationError, load_rules, print_report
+    path = input("Enter a JSON rules file, or press Enter for the built-in rules: ").strip()
+    try:
+        rules = load_rules(path) if path else None
+        report = viewer_editor.validate(rules)
+    except (OSError, ValueError, ValidationError) as e:
+        print(f"Error: {e}")
+        return False
+    print_report(report)
+    if report.issues and input("Export the issues to CSV? (y/n): ").lower() == 'y':
+        base_name = os.path.splitext(os.path.basename(viewer_editor.ifc_file_path))[0]
+        export_to_csv(sanitize_filename(f"{base_name}_validation.csv"), report.issues)
+    return False
+
+def aggregate_helper(viewer_editor):
+    keys = input("Group by (comma-separated: type, storey, material; blank for the whole model): ").lower()
+    group_by = [key.strip() for key in keys.split(',') if key.strip()]
+    quantity = input("Quantity to aggregate, 'volume' or 'area' (default volume): ").strip().capitalize() or 'Volume'
+    functions = input("Functions (comma-separated: sum, count, mean, min, max; blank for all): ").lower()
+    functions = [f.strip() for f in functions.split(',') if f.strip()]
+    if viewer_editor._aggregation is None:
+        print("Gathering element quantities. Later groupings reuse them until the model is edited...")
+    try:
+        rows = viewer_editor.aggregate_quantities(group_by, quantity, functions)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return False
+    if not rows:
+        print("No elements to aggregate.")
+        return False
+    print(f"Quantities in {'cubic' if quantity == 'Volume' else 'square'} metres:")
+    print(tabulate(rows, headers="keys", tablefmt="grid", floatfmt=".3f"))
+    if input("Export this table to CSV? (y/n): ").lower() == 'y':
+        name = "_".join(group_by) or "model"
+        export_to_csv(sanitize_filename(f"{quantity.lower()}_by_{name}.csv"), rows)
+    return False
+
+def graph_helper(viewer_editor):
+    base_name = os.path.splitext(os.path.basename(viewer_editor.ifc_file_path))[0]
+    scope = 'all'
+    if viewer_editor.selected_elements:
+        scope = input("Export 'all' products or the 'selected' elements? (default all): ").lower().strip() or 'all'
+    path = input(f"Enter the output file, .jsonl or .sqlite (default {base_name}.jsonl): ").strip() or f"{base_name}.jsonl"
+    elements = viewer_editor.selected_elements if scope == 'selected' else None
+    try:
+        count = viewer_editor.export_graph(path, elements)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Error exporting: {e}")
+        return False
+    print(f"Exported {count} elements to {path}")
+    return False
+
+def extract_helper(viewer_editor):
+    base_name = os.path.splitext(os.path.basename(viewer_editor.ifc_file_path))[0]
+    choice = input("Extract the 'selection', or one file per 'storey', 'type' or 'discipline' (or 'back' to return): ").lower().strip()
+    if choice == 'selection':
+        if not viewer_editor.selected_elements:
+            print("No elements selected. Use 'select' command first.")
+            return False
+        path = input(f"Enter the output file (default {base_name}_selection.ifc): ").strip() or f"{base_name}_selection.ifc"
+        viewer_editor.extract_elements(viewer_editor.selected_elements, path)
+        print(f"Wrote {len(viewer_editor.selected_elements)} elements and everything they reference to {path}")
+    elif choice in ('storey', 'type', 'discipline'):
+        output_dir = input(f"Enter the output directory (default {base_name}_{choice}): ").strip() or f"{base_name}_{choice}"
+        for name, path, count in viewer_editor.extract_partitions(choice, output_dir):
+            print(f"  {name}: {count} elements -> {path}")
+    return False
+
+def build_element_data(viewer_editor, element):
+    element_data = {
+        'Element Name': element.Name,
+        'Element GlobalId': element.GlobalId,
+        'Element Type': element.is_a(),
+        'Element ID': element.id(),
+        'Properties': viewer_editor.get_element_properties(element),
+        'Layers': []
+    }
+    if 'HasLayers' in element_data['Properties'] and element_data['Properties']['HasLayers']:
+        for i in range(element_data['Properties']['NumberOfLayers']):
+            layer = viewer_editor.select_layer(i, element)
+            if layer:
+                layer_properties = viewer_editor.get_layer_properties(layer)
+                layer_properties.update(viewer_editor.get_layer_quantities(element, layer))
+                layer_properties['Layer Number'] = i + 1
+                element_data['Layers'].append(layer_properties)
+    return element_data
+
+def export_helper(viewer_editor, background=None):
     if not viewer_editor.selected_elements:
         print("No elements selected. Use 'select' command first.")
         return False
@@ -416,87 +1024,115 @@ def export_helper(viewer_editor):
         print("Invalid input. Please try again.")
         return False
 
-    elements_to_export = []
-    for element in viewer_editor.selected_elements:
-        element_data = {
-            'Element Name': element.Name,
-            'Element GlobalId': element.GlobalId,
-            'Element Type': element.is_a(),
-            'Element ID': element.id(),
-            'Properties': viewer_editor.get_element_properties(element),
-            'Layers': []
-        }
-        if 'HasLayers' in element_data['Properties'] and element_data['Properties']['HasLayers']:
-            for i in range(element_data['Properties']['NumberOfLayers']):
-                layer = viewer_editor.select_layer(i, element)
-                if layer:
-                    layer_properties = viewer_editor.get_layer_properties(layer)
-                    layer_properties['Layer Number'] = i + 1
-                    element_data['Layers'].append(layer_properties)
-        elements_to_export.append(element_data)
+    if background is not None and input("Run the export in the background? (y/n): ").lower() == 'y':
+        background_loop, executor = background
+        elements = list(viewer_editor.selected_elements)
+        job_id, _ = background_loop.submit(
+            export_in_background(executor, elements, export_type, export_mode),
+            f"export of {len(elements)} element(s)")
+        print(f"Export started as job {job_id}. Use 'jobs' to check on it or 'cancel' to stop it.")
+        return False
+
+    # Large selections are extracted by worker processes over the loaded model
+    from ifc_parallel_properties import collect_elements_to_export
+    elements_to_export = collect_elements_to_export(viewer_editor, viewer_editor.selected_elements, viewer_editor.processes)
+    write_exports(elements_to_export, export_type, export_mode, viewer_editor)
+    return False
+
+async def export_in_background(executor, elements, export_type, export_mode):
+    # Messages are kept for 'jobs' rather than printed over the prompt
+    elements_to_export = await executor.get_element_data(elements)
+    messages = []
+    await executor.export(write_exports, elements_to_export, export_type, export_mode, executor.viewer_editor, messages.append)
+    return messages
 
+def write_exports(elements_to_export, export_type, export_mode, viewer_editor, report=print):
     # Sort elements by name, GlobalId, and type
     elements_to_export.sort(key=lambda x: (x['Element Name'], x['Element GlobalId'], x['Element Type']))
 
     if export_mode == 's':
         for element in elements_to_export:
             if export_type in ['p', 'b']:
-                export_properties(element, viewer_editor)
+                export_properties(element, viewer_editor, report)
             if export_type in ['l', 'b'] and element['Layers']:
-                export_layers(element, viewer_editor)
+                export_layers(element, viewer_editor, report)
     else:  # collective export
         if export_type in ['p', 'b']:
-            export_properties_collectively(elements_to_export, viewer_editor)
+            export_properties_collectively(elements_to_export, viewer_editor, report)
         if export_type in ['l', 'b']:
-            export_layers_collectively(elements_to_export, viewer_editor)
+            export_layers_collectively(elements_to_export, viewer_editor, report)
 
-    return False
-
-def export_properties(element, viewer_editor):
+def export_properties(element, viewer_editor, report=print):
     sanitized_name = sanitize_filename(element['Element Name'])
     filename = f"{sanitized_name}_{element['Element GlobalId']}_properties.csv"
     properties = element['Properties']
-    export_to_csv(filename, properties)
+    export_to_csv(filename, properties, report)
 
-def export_layers(element, viewer_editor):
+def export_layers(element, viewer_editor, report=print):
     if not element['Layers']:
-        print(f"No layers found for element {element['Element Name']}")
+        report(f"No layers found for element {element['Element Name']}")
         return
     sanitized_name = sanitize_filename(element['Element Name'])
     filename = f"{sanitized_name}_{element['Element GlobalId']}_layers.csv"
-    export_to_csv(filename, element['Layers'])
+    export_to_csv(filename, element['Layers'], report)
 
-def export_properties_collectively(elements, viewer_editor):
+def export_properties_collectively(elements, viewer_editor, report=print):
     filename = "collective_properties.csv"
     data = [{**{'Element Name': e['Element Name'], 'Element GlobalId': e['Element GlobalId'], 'Element Type': e['Element Type']}, **e['Properties']} for e in elements]
-    export_to_csv(filename, data)
+    export_to_csv(filename, data, report)
 
-def export_layers_collectively(elements, viewer_editor):
+def export_layers_collectively(elements, viewer_editor, report=print):
     filename = "collective_layers.csv"
     data = []
     for element in elements:
         for layer in element['Layers']:
             data.append({**{'Element Name': element['Element Name'], 'Element GlobalId': element['Element GlobalId'], 'Element Type': element['Element Type']}, **layer})
     if data:
-        export_to_csv(filename, data)
+        export_to_csv(filename, data, report)
     else:
-        print("No layers found for any selected elements")
+        report("No layers found for any selected elements")
 
-def export_to_csv(filename, data):
-    if isinstance(data, dict):
+def export_to_csv(filename, data, report=print):
+    if isinstance(data, Mapping):
         data = [data]
     if not data:
-        print(f"No data to export to {filename}")
+        report(f"No data to export to {filename}")
         return
     with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-        fieldnames = list(data[0].keys())
+        # Elements of different types carry different property sets
+        fieldnames = list(dict.fromkeys(key for row in data for key in row))
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
         writer.writeheader()
         for row in data:
             writer.writerow(row)
-    print(f"Data exported to {filename}")
+    report(f"Data exported to {filename}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="IFC Viewer and Editor")
+    parser.add_argument("--profile", metavar="PATH", help="Write cProfile stats to PATH and folded span stacks next to it")
+    parser.add_argument("--metrics", metavar="PATH", help="Append per-command metrics to PATH as JSON lines")
+    parser.add_argument("--compact", action="store_true", help="Merge duplicate entities and drop unreferenced ones on save")
+    parser.add_argument("--connect", nargs="?", const="", metavar="SOCKET",
+                        help="Run as a thin client of the model server on SOCKET, starting one in the background if needed")
+    parser.add_argument("--watch", action="store_true", help="Pick up changes other programs make to the IFC file while it is open")
+    args = parser.parse_args(argv)
+
+    if args.connect is not None:
+        from ifc_cli_client import main as client_main
+        return client_main(["--connect", args.connect] if args.connect else [])
 
-def main():
+    metrics = get_metrics()
+    if args.profile or args.metrics:
+        metrics = enable(args.metrics)
+        instrument_class(IFCViewerEditor)
+        instrument_function(sys.modules[__name__], "export_to_csv", "export_to_csv")
+
+    with profiled(args.profile):
+        run_session(metrics, args.compact, args.watch)
+    if metrics.enabled:
+        metrics.emit('session', **metrics.snapshot())
+
+def run_session(metrics, compact=False, watch=False):
     print("Welcome to the IFC Viewer and Editor.")
     ifc_file = input("Enter the name or path of the IFC file (if in the same directory, just enter the filename): ")
     
@@ -511,72 +1147,125 @@ def main():
 
     print(f"Using IFC file: {full_path}")
     viewer_editor = IFCViewerEditor(full_path)
+    viewer_editor.compact_on_save = compact
+    viewer_editor = recover_helper(viewer_editor)
+    if watch:
+        viewer_editor.watch()
+
+    # Imported here because ifc_async_executor imports this module
+    from ifc_async_executor import AsyncModelExecutor, BackgroundLoop
+    background_loop = BackgroundLoop()
+    executor = AsyncModelExecutor(viewer_editor)
+    background = (background_loop, executor)
 
     print("Type 'help' for a list of commands.")
 
     while True:
-        command = input("\nEnter command (help/select/view/properties/layers/update/save/count/list/export/quit): ").lower()
-
-        if command == 'help':
-            print_help()
-        elif command == 'select':
-            if select_helper(viewer_editor):
-                break
-            viewer_editor.selected_layer = None  # Reset layer selection when selecting a new element
-        elif command == 'view':
-            view_helper(viewer_editor)
-        elif command == 'properties':
-            properties_helper(viewer_editor)
-        elif command == 'layers':
-            if layers_helper(viewer_editor):
-                break
-        elif command == 'update':
-            if viewer_editor.selected_elements:
-                while True:
-                    property_name = input("Enter property name (or 'list' to see properties, 'back' to return): ")
-                    if property_name.lower() == 'back':
-                        break
-                    if property_name.lower() == 'list':
-                        properties_helper(viewer_editor)
-                        continue
-                    new_value = input("Enter new value: ")
-                    if viewer_editor.update_element_property(viewer_editor.selected_elements, property_name, new_value):
-                        print(f"Updated {property_name} to {new_value} for selected element(s)")
-                        save_prompt = input("Do you want to save changes now? (y/n): ").lower()
-                        if save_prompt == 'y':
-                            if viewer_editor.save_ifc_file():
-                                print("Changes saved successfully.")
-                            else:
-                                print("Failed to save changes.")
+        watch_helper(viewer_editor, background)
+        command = input("\nEnter command (help/select/view/properties/layers/update/save/undo/redo/history/validate/count/spatial/region/where/aggregate/list/export/graph/extract/diff/changeset/apply/jobs/cancel/quit): ").lower()
+
+        with metrics.command('command', command):
+            if command == 'help':
+                print_help()
+            elif command == 'select':
+                if select_helper(viewer_editor):
+                    break
+                viewer_editor.selected_layer = None  # Reset layer selection when selecting a new element
+            elif command == 'view':
+                view_helper(viewer_editor)
+            elif command == 'properties':
+                properties_helper(viewer_editor)
+            elif command == 'layers':
+                if layers_helper(viewer_editor, background):
+                    break
+            elif command == 'update':
+                if viewer_editor.selected_elements:
+                    while True:
+                        property_name = input("Enter property name (or 'list' to see properties, 'back' to return): ")
+                        if property_name.lower() == 'back':
+                            break
+                        if property_name.lower() == 'list':
+                            properties_helper(viewer_editor)
+                            continue
+                        new_value = input("Enter new value: ")
+                        if run_write(background, viewer_editor.update_element_property, viewer_editor.selected_elements, property_name, new_value):
+                            print(f"Updated {property_name} to {new_value} for selected element(s)")
+                            save_prompt = input("Do you want to save changes now? (y/n): ").lower()
+                            if save_prompt == 'y':
+                                if run_write(background, viewer_editor.save_ifc_file):
+                                    print("Changes saved successfully.")
+                                else:
+                                    print("Failed to save changes.")
+                        else:
+                            print(f"Failed to update property {property_name}. Make sure the property exists and is editable.")
+                else:
+                    print("No elements selected. Use 'select' command first.")
+            elif command == 'save':
+                confirm = input("Are you sure you want to save changes? This will overwrite the existing file. (y/n): ").lower()
+                if confirm == 'y':
+                    if run_write(background, viewer_editor.save_ifc_file):
+                        print("Changes saved successfully.")
                     else:
-                        print(f"Failed to update property {property_name}. Make sure the property exists and is editable.")
-            else:
-                print("No elements selected. Use 'select' command first.")
-        elif command == 'save':
-            confirm = input("Are you sure you want to save changes? This will overwrite the existing file. (y/n): ").lower()
-            if confirm == 'y':
-                if viewer_editor.save_ifc_file():
-                    print("Changes saved successfully.")
+                        print("Failed to save changes.")
+                else:
+                    print("Save operation cancelled.")
+            elif command in ('undo', 'redo'):
+                transaction = run_write(background, viewer_editor.undo if command == 'undo' else viewer_editor.redo)
+                if transaction is None:
+                    print(f"Nothing to {command}.")
+                else:
+                    print(f"{'Undid' if command == 'undo' else 'Redid'}: {transaction.name}")
+            elif command == 'history':
+                history_helper(viewer_editor)
+            elif command == 'validate':
+                validate_helper(viewer_editor)
+            elif command == 'count':
+                if count_helper(viewer_editor):
+                    break
+            elif command == 'spatial':
+                spatial_helper(viewer_editor)
+            elif command == 'region':
+                region_helper(viewer_editor)
+            elif command == 'where':
+                where_used_helper(viewer_editor)
+            elif command == 'aggregate':
+                aggregate_helper(viewer_editor)
+            elif command == 'list':
+                element_types = viewer_editor.list_all_element_types()
+                print("All element types in the IFC file:")
+                for element_type in element_types:
+                    print(f"  {element_type}")
+            elif command == 'export':
+                if export_helper(viewer_editor, background):
+                    break
+            elif command == 'graph':
+                graph_helper(viewer_editor)
+            elif command == 'extract':
+                extract_helper(viewer_editor)
+            elif command == 'diff':
+                diff_helper(viewer_editor)
+            elif command == 'changeset':
+                changeset_helper(viewer_editor)
+            elif command == 'apply':
+                apply_helper(viewer_editor, background)
+            elif command == 'jobs':
+                jobs = background_loop.job_status()
+                if jobs:
+                    print(tabulate(jobs, headers=["Job", "Description", "Status"], tablefmt="grid"))
                 else:
-                    print("Failed to save changes.")
+                    print("No background jobs.")
+            elif command == 'cancel':
+                job_id = input("Enter the number of the job to cancel: ")
+                if job_id.isdigit() and background_loop.cancel(int(job_id)):
+                    print(f"Job {job_id} cancelled.")
+                else:
+                    print(f"Job {job_id} is not running.")
+            elif command == 'quit':
+                if confirm_quit():
+                    break
             else:
-                print("Save operation cancelled.")
-        elif command == 'count':
-            if count_helper(viewer_editor):
-                break
-        elif command == 'list':
-            element_types = viewer_editor.list_all_element_types()
-            print("All element types in the IFC file:")
-            for element_type in element_types:
-                print(f"  {element_type}")
-        elif command == 'export':
-            if export_helper(viewer_editor):
-                break
-        elif command == 'quit':
-            if confirm_quit():
-                break
-        else:
-            print("Invalid command. Please try again.")
+                print("Invalid command. Please try again.")
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
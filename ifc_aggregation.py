@@ -0,0 +1,179 @@
+import numpy as np
+import ifcopenshell.util.element
+from ifc_quantities import DERIVED_PREFIX, LAYER_AREA_QUANTITIES
+
+GROUP_KEYS = ('type', 'storey', 'material')
+QUANTITIES = ('Volume', 'Area')
+FUNCTIONS = ('sum', 'count', 'mean', 'min', 'max')
+NO_VALUE = '(none)'
+
+def _first_quantity(qtos, names):
+    for values in qtos.values():
+        for name in names:
+            if values.get(name):
+                return values[name]
+    return None
+
+class QuantityFrame:
+    # One row per element, or per element and material layer, with integer-coded group keys
+    # and float quantity columns (NaN where unknown)
+    def __init__(self, ids, keys, labels, quantities):
+        self.ids = ids
+        self.keys = keys
+        self.labels = labels
+        self.quantities = quantities
+
+    def __len__(self):
+        return len(self.ids)
+
+class _Encoder:
+    def __init__(self):
+        self.codes = {}
+        self.labels = []
+
+    def __call__(self, label):
+        code = self.codes.get(label)
+        if code is None:
+            code = self.codes[label] = len(self.labels)
+            self.labels.append(label)
+        return code
+
+class AggregationEngine:
+    # Group-by totals over the model's elements. Rows are gathered once per model version;
+    # each grouping is then a handful of NumPy reductions and is cached for that version.
+    def __init__(self, viewer_editor):
+        self.viewer_editor = viewer_editor
+        self.version = None
+        self.frames = {}
+        self.results = {}
+
+    def _check_version(self):
+        if self.version != self.viewer_editor.model_version:
+            self.version = self.viewer_editor.model_version
+            self.frames.clear()
+            self.results.clear()
+
+    def _storey_names(self):
+        index = self.viewer_editor.spatial_index()
+        names = {}
+        for _, node in index.walk():
+            storey = node.id
+            while storey is not None and index.nodes[storey].type != 'IfcBuildingStorey':
+                storey = index.nodes[storey].parent
+            if storey is None:
+                names[node.id] = NO_VALUE
+            else:
+                names[node.id] = index.ifc_file.by_id(storey).Name or f"#{storey}"
+        return index, names
+
+    def frame(self, by_material=False):
+        self._check_version()
+        if by_material in self.frames:
+            return self.frames[by_material]
+        viewer_editor = self.viewer_editor
+        engine = viewer_editor.quantity_engine()
+        _, area_scale, volume_scale = engine.unit_scales()
+        elements = [e for e in viewer_editor.ifc_file.by_type('IfcElement') if not e.is_a('IfcFeatureElementSubtraction')]
+        engine.derive(elements)
+        index, storey_names = self._storey_names()
+
+        encoders = {key: _Encoder() for key in GROUP_KEYS}
+        ids, keys, volumes, areas = [], {key: [] for key in GROUP_KEYS}, [], []
+        for element in elements:
+            qtos = ifcopenshell.util.element.get_psets(element, qtos_only=True)
+            derived = engine.quantities(element) if not qtos else {}
+            volume = _first_quantity(qtos, ('NetVolume', 'GrossVolume'))
+            volume = volume * volume_scale if volume else derived.get(f"{DERIVED_PREFIX}.Volume")
+            flat = {f"{q}.{n}": v for q, values in qtos.items() for n, v in values.items()}
+            area = engine.layer_set_area(element, {**flat, **derived})
+            if area is None:
+                area = _first_quantity(qtos, [name for _, name in LAYER_AREA_QUANTITIES])
+                area = area * area_scale if area else derived.get(f"{DERIVED_PREFIX}.FootprintArea")
+            container = index.container_of(element)
+            storey = storey_names.get(container, NO_VALUE)
+
+            rows = [(NO_VALUE, 1.0)]
+            if by_material:
+                material = ifcopenshell.util.element.get_material(element)
+                if material is not None and material.is_a('IfcMaterialLayerSetUsage'):
+                    material = material.ForLayerSet
+                if material is not None and material.is_a('IfcMaterialLayerSet'):
+                    # Layered elements contribute one row per layer, in proportion to its thickness
+                    total = sum(layer.LayerThickness for layer in material.MaterialLayers) or 1.0
+                    rows = [(layer.Material.Name if layer.Material else NO_VALUE, layer.LayerThickness / total)
+                            for layer in material.MaterialLayers]
+                else:
+                    names = sorted(m.Name or NO_VALUE for m in ifcopenshell.util.element.get_materials(element))
+                    rows = [(", ".join(names) if names else NO_VALUE, 1.0)]
+            for material_name, share in rows:
+                ids.append(element.id())
+                keys['type'].append(encoders['type'](element.is_a()))
+                keys['storey'].append(encoders['storey'](storey))
+                keys['material'].append(encoders['material'](material_name))
+                volumes.append(volume * share if volume is not None else np.nan)
+                areas.append(area if area is not None else np.nan)
+
+        frame = QuantityFrame(
+            np.asarray(ids, dtype=np.uint32),
+            {key: np.asarray(values, dtype=np.int64) for key, values in keys.items()},
+            {key: encoder.labels for key, encoder in encoders.items()},
+            {'Volume': np.asarray(volumes, dtype=np.float64), 'Area': np.asarray(areas, dtype=np.float64)})
+        self.frames[by_material] = frame
+        return frame
+
+    def aggregate(self, group_by, quantity='Volume', functions=FUNCTIONS):
+        group_by = tuple(group_by)
+        functions = tuple(functions)
+        if any(key not in GROUP_KEYS for key in group_by):
+            raise ValueError(f"Group keys must be among {', '.join(GROUP_KEYS)}")
+        if quantity not in QUANTITIES or any(f not in FUNCTIONS for f in functions):
+            raise ValueError(f"Quantity must be one of {', '.join(QUANTITIES)} and functions among {', '.join(FUNCTIONS)}")
+        self._check_version()
+        cache_key = (group_by, quantity, functions)
+        if cache_key in self.results:
+            return self.results[cache_key]
+
+        frame = self.frame(by_material='material' in group_by)
+        if not len(frame):
+            self.results[cache_key] = []
+            return []
+        values = frame.quantities[quantity]
+        if group_by:
+            codes = np.stack([frame.keys[key] for key in group_by], axis=1)
+            groups, inverse = np.unique(codes, axis=0, return_inverse=True)
+            inverse = inverse.ravel()
+        else:
+            groups, inverse = np.zeros((1, 0), dtype=np.int64), np.zeros(len(frame), dtype=np.int64)
+        group_count = len(groups)
+        known = ~np.isnan(values)
+        # Layered elements have several rows; each element is counted once per group
+        pairs = np.unique(np.stack([inverse, frame.ids.astype(np.int64)]), axis=1)
+        elements = np.bincount(pairs[0], minlength=group_count)
+        counts = np.bincount(inverse, weights=known, minlength=group_count)
+        sums = np.bincount(inverse, weights=np.where(known, values, 0.0), minlength=group_count)
+        minimums = np.full(group_count, np.inf)
+        maximums = np.full(group_count, -np.inf)
+        np.minimum.at(minimums, inverse[known], values[known])
+        np.maximum.at(maximums, inverse[known], values[known])
+
+        rows = []
+        for g in range(group_count):
+            row = {key.capitalize(): frame.labels[key][groups[g][i]] for i, key in enumerate(group_by)}
+            row['Elements'] = int(elements[g])
+            has_values = counts[g] > 0
+            for function in functions:
+                name = f"{quantity} {function}"
+                if function == 'sum':
+                    row[name] = float(sums[g])
+                elif function == 'count':
+                    row[name] = int(counts[g])
+                elif function == 'mean':
+                    row[name] = float(sums[g] / counts[g]) if has_values else None
+                elif function == 'min':
+                    row[name] = float(minimums[g]) if has_values else None
+                else:
+                    row[name] = float(maximums[g]) if has_values else None
+            rows.append(row)
+        rows.sort(key=lambda row: tuple(str(row[key.capitalize()]) for key in group_by))
+        self.results[cache_key] = rows
+        return rows
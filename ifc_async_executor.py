@@ -0,0 +1,273 @@
+import asyncio
+import itertools
+import contextvars
+import threading
+import contextlib
+import concurrent.futures
+from command_line_ifc_viewer_editor import build_element_data
+from ifc_profiling import get_metrics
+
+# Finished jobs job_status still lists; older ones are dropped together with their results
+KEPT_FINISHED_JOBS = 10
+
+class OperationCancelled(Exception):
+    pass
+
+class CancellationToken:
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise OperationCancelled()
+
+class AsyncReadWriteLock:
+    # Many readers or one writer; waiting writers block new readers so edits are not starved
+    def __init__(self):
+        self._condition = asyncio.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextlib.asynccontextmanager
+    async def read(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._writer and not self._waiting_writers)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._readers -= 1
+                self._condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def write(self):
+        async with self._condition:
+            self._waiting_writers += 1
+            try:
+                await self._condition.wait_for(lambda: not self._writer and not self._readers)
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+class _SharedOperation:
+    def __init__(self, task, token):
+        self.task = task
+        self.token = token
+        self.waiters = 0
+
+def _dedupe_key(value):
+    if hasattr(value, 'id') and hasattr(value, 'is_a'):
+        return ('#', value.id())
+    if isinstance(value, (list, tuple)):
+        return tuple(_dedupe_key(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _dedupe_key(v)) for k, v in value.items()))
+    return value
+
+def collect_element_data(viewer_editor, elements, token):
+    viewer_editor.derive_quantities(elements)
+    elements_data = []
+    for element in elements:
+        token.raise_if_cancelled()
+        elements_data.append(build_element_data(viewer_editor, element))
+    return elements_data
+
+def collect_element_properties(viewer_editor, elements, token):
+    viewer_editor.derive_quantities(elements)
+    properties = {}
+    for element in elements:
+        token.raise_if_cancelled()
+        properties[element.id()] = viewer_editor.get_element_properties(element)
+    return properties
+
+class AsyncModelExecutor:
+    # One executor per loaded model. Blocking IFCViewerEditor calls run in a worker
+    # pool; identical reads that are already in flight share a single result.
+    def __init__(self, viewer_editor, executor=None, max_workers=None):
+        self.viewer_editor = viewer_editor
+        self.executor = executor or concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ifc-model")
+        self._owns_executor = executor is None
+        self._lock = None
+        self._inflight = {}
+
+    @property
+    def lock(self):
+        # Created lazily so the lock binds to the loop that first uses it
+        if self._lock is None:
+            self._lock = AsyncReadWriteLock()
+        return self._lock
+
+    async def _run_in_pool(self, func, args):
+        loop = asyncio.get_running_loop()
+        # In the caller's context, as asyncio.to_thread does, so its metrics go to its command
+        context = contextvars.copy_context()
+        future = loop.run_in_executor(self.executor, lambda: context.run(func, *args))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Keep holding the model lock until the worker has actually stopped
+            with contextlib.suppress(Exception, asyncio.CancelledError):
+                await future
+            raise
+
+    async def _read_job(self, func, args, token, with_token):
+        async with self.lock.read():
+            token.raise_if_cancelled()
+            return await self._run_in_pool(func, args + (token,) if with_token else args)
+
+    async def run_read(self, func, *args, dedupe=True, with_token=False):
+        key = (func, _dedupe_key(args)) if dedupe else None
+        shared = self._inflight.get(key) if key else None
+        if key:
+            get_metrics().count("cache.inflight_reads.hit" if shared else "cache.inflight_reads.miss")
+        if shared is None:
+            token = CancellationToken()
+            shared = _SharedOperation(asyncio.ensure_future(self._read_job(func, args, token, with_token)), token)
+            if key:
+                self._inflight[key] = shared
+                shared.task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        shared.waiters += 1
+        try:
+            return await asyncio.shield(shared.task)
+        except asyncio.CancelledError:
+            # Only stop the shared work once nobody is waiting for it any more
+            if shared.waiters == 1:
+                shared.token.cancel()
+                shared.task.cancel()
+            raise
+        finally:
+            shared.waiters -= 1
+
+    async def run_write(self, func, *args):
+        async with self.lock.write():
+            return await self._run_in_pool(func, args)
+
+    async def list_all_element_types(self):
+        return await self.run_read(self.viewer_editor.list_all_element_types)
+
+    async def find_close_matches(self, identifier):
+        return await self.run_read(self.viewer_editor.find_close_matches, identifier)
+
+    async def count_elements_by_type(self, element_type):
+        return await self.run_read(self.viewer_editor.count_elements_by_type, element_type)
+
+    async def get_element_properties(self, element):
+        return await self.run_read(self.viewer_editor.get_element_properties, element)
+
+    async def get_properties_for_elements(self, elements):
+        return await self.run_read(collect_element_properties, self.viewer_editor, list(elements), with_token=True)
+
+    async def get_element_data(self, elements):
+        return await self.run_read(collect_element_data, self.viewer_editor, list(elements), with_token=True)
+
+    async def export(self, func, *args, with_token=False):
+        # Exports read the model and write files; they run alongside other readers
+        return await self.run_read(func, *args, dedupe=False, with_token=with_token)
+
+    async def update_element_property(self, elements, property_name, new_value):
+        return await self.run_write(self.viewer_editor.update_element_property, elements, property_name, new_value)
+
+    async def create_new_property(self, element, property_name, property_value):
+        return await self.run_write(self.viewer_editor.create_new_property, element, property_name, property_value)
+
+    async def undo(self):
+        return await self.run_write(self.viewer_editor.undo)
+
+    async def redo(self):
+        return await self.run_write(self.viewer_editor.redo)
+
+    async def save_ifc_file(self):
+        return await self.run_write(self.viewer_editor.save_ifc_file)
+
+    async def refresh_from_disk(self):
+        return await self.run_write(self.viewer_editor.refresh_from_disk)
+
+    def shutdown(self):
+        if self._owns_executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+class BackgroundLoop:
+    # Runs an event loop in a daemon thread so synchronous front ends can submit coroutines. The
+    # thread starts with the first coroutine: until then the process can still fork worker pools.
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = None
+        self._job_ids = itertools.count(1)
+        self.jobs = {}
+        self._jobs_lock = threading.Lock()
+
+    @property
+    def started(self):
+        return self.thread is not None
+
+    def _start(self):
+        with self._jobs_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.loop.run_forever, name="ifc-async-loop", daemon=True)
+                self.thread.start()
+
+    def schedule(self, coro):
+        # Only the caller holds on to the future, so a loop shared by many sessions keeps nothing
+        self._start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def submit(self, coro, description=""):
+        # A numbered job for job_status and cancel
+        future = self.schedule(coro)
+        job_id = next(self._job_ids)
+        with self._jobs_lock:
+            self.jobs[job_id] = (description, future)
+        future.add_done_callback(lambda _: self._prune())
+        return job_id, future
+
+    def _prune(self):
+        with self._jobs_lock:
+            finished = [job_id for job_id, (_, future) in self.jobs.items() if future.done()]
+            for job_id in finished[:-KEPT_FINISHED_JOBS]:
+                del self.jobs[job_id]
+
+    def run(self, coro):
+        return self.schedule(coro).result()
+
+    def cancel(self, job_id):
+        with self._jobs_lock:
+            job = self.jobs.get(job_id)
+        return job is not None and job[1].cancel()
+
+    def job_status(self):
+        status = []
+        with self._jobs_lock:
+            jobs = list(self.jobs.items())
+        for job_id, (description, future) in jobs:
+            if future.cancelled():
+                state = "cancelled"
+            elif not future.done():
+                state = "running"
+            elif future.exception() is not None:
+                state = f"failed: {future.exception()}"
+            else:
+                # A job that returns messages reports them here instead of printing from its thread
+                result = future.result()
+                state = "\n".join(["done", *result]) if isinstance(result, list) else "done"
+            status.append((job_id, description, state))
+        return status
+
+    def close(self):
+        if self.thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=5)
@@ -0,0 +1,268 @@
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+import ifcopenshell
+
+CHANGESET_FORMAT = "ifc-changeset"
+CHANGESET_VERSION = 1
+FINGERPRINT_CHUNK_SIZE = 1024 * 1024
+TRUE_STRINGS = {'true', 't', 'yes', 'y', '1', '.t.'}
+ENTITY_ID = re.compile(rb'^\s*#(\d+)\s*=')
+TYPE_NAME = re.compile(r'\bIfc\w+(?=\()')
+
+class ChangesetError(Exception):
+    pass
+
+def file_fingerprint(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(FINGERPRINT_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def bytes_fingerprint(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def step_line(entity):
+    # ifcopenshell prints mixed-case type names, the files it writes use upper case.
+    # Splitting on quotes keeps string contents untouched.
+    parts = str(entity).split("'")
+    parts[::2] = [TYPE_NAME.sub(lambda m: m.group(0).upper(), part) for part in parts[::2]]
+    return "'".join(parts) + ";"
+
+def convert_value(current, new_value):
+    # Text input is converted to the type the property already holds
+    if current is None:
+        return 'IfcLabel', str(new_value)
+    kind = type(current.wrappedValue)
+    if kind is bool:
+        value = str(new_value).strip().lower() in TRUE_STRINGS
+    elif kind in (int, float):
+        value = kind(new_value)
+    else:
+        value = str(new_value)
+    return current.is_a(), value
+
+def find_property_set(element, pset_name):
+    for definition in getattr(element, 'IsDefinedBy', None) or ():
+        if definition.is_a('IfcRelDefinesByProperties'):
+            property_set = definition.RelatingPropertyDefinition
+            if property_set.is_a('IfcPropertySet') and property_set.Name == pset_name:
+                return property_set
+    return None
+
+def find_property(element, pset_name, property_name):
+    property_set = find_property_set(element, pset_name)
+    if property_set is not None:
+        for property in property_set.HasProperties:
+            if property.Name == property_name:
+                return property
+    return None
+
+def set_property_value(ifc_file, property, value, value_type):
+    if value_type:
+        property.NominalValue = ifc_file.create_entity(value_type, value)
+    else:
+        property.Value = value
+
+def add_custom_property(ifc_file, element, pset_name, property_name, value):
+    import ifcopenshell.api
+    # New properties go into the element's custom set, created on first use
+    property_set = find_property_set(element, pset_name)
+    if property_set is None:
+        property_set = ifcopenshell.api.run("pset.add_pset", ifc_file, product=element, name=pset_name)
+    ifcopenshell.api.run("pset.edit_pset", ifc_file, pset=property_set, properties={property_name: value})
+    return property_set
+
+def custom_property_targets(element, pset_name):
+    # What add_custom_property may modify besides the entities it creates
+    property_set = find_property_set(element, pset_name)
+    if property_set is None:
+        return []
+    return [property_set, property_set.OwnerHistory, *property_set.HasProperties]
+
+def edit_targets(ifc_file, edit):
+    # The existing entities apply_edit would modify, so they can be recorded beforehand
+    try:
+        element = ifc_file.by_guid(edit['global_id'])
+    except RuntimeError:
+        return []
+    if edit['op'] == 'set_attribute':
+        return [element]
+    if edit['op'] == 'set_property':
+        return [find_property(element, edit['pset'], edit['property'])]
+    if edit['op'] == 'create_property':
+        return custom_property_targets(element, edit['pset'])
+    return []
+
+def apply_edit(ifc_file, edit):
+    try:
+        element = ifc_file.by_guid(edit['global_id'])
+    except RuntimeError:
+        raise ChangesetError(f"No element with GlobalId {edit['global_id']}")
+    op = edit['op']
+    if op == 'set_attribute':
+        setattr(element, edit['attribute'], edit['value'])
+        return [element]
+    if op == 'set_property':
+        property = find_property(element, edit['pset'], edit['property'])
+        if property is None:
+            raise ChangesetError(f"No property {edit['pset']}.{edit['property']} on {edit['global_id']}")
+        set_property_value(ifc_file, property, edit['value'], edit.get('value_type'))
+        return [property]
+    if op == 'create_property':
+        property_set = add_custom_property(ifc_file, element, edit['pset'], edit['property'], edit['value'])
+        return [property_set, property_set.OwnerHistory]
+    raise ChangesetError(f"Unknown changeset operation: {op}")
+
+class ChangeTracker:
+    # Edits made since the model was opened, addressed by GlobalId so they can be replayed on
+    # any copy, plus the entity ids they touched so an identical copy can be patched line by line
+    def __init__(self, ifc_file, source_path=None, fingerprint=None):
+        self.ifc_file = ifc_file
+        self.source_path = source_path
+        self.source_mtime = os.path.getmtime(source_path) if source_path and os.path.exists(source_path) else None
+        self.fingerprint = fingerprint
+        self.base_max_id = ifc_file.get_max_id()
+        self.edits = []
+        self.modified_ids = set()
+
+    def __len__(self):
+        return len(self.edits)
+
+    def record(self, edit, *entities):
+        if not self.edits and self.fingerprint is None and self.source_mtime is not None:
+            # Hashed on the first edit, and only if the file on disk is still the one that was loaded
+            if os.path.getmtime(self.source_path) == self.source_mtime:
+                self.fingerprint = file_fingerprint(self.source_path)
+        self.edits.append(edit)
+        for entity in entities:
+            if entity is not None and entity.id() <= self.base_max_id:
+                self.modified_ids.add(entity.id())
+
+    def to_changeset(self):
+        modified = {}
+        removed = []
+        for entity_id in sorted(self.modified_ids):
+            try:
+                modified[str(entity_id)] = step_line(self.ifc_file.by_id(entity_id))
+            except RuntimeError:
+                removed.append(entity_id)
+        created = []
+        for entity_id in range(self.base_max_id + 1, self.ifc_file.get_max_id() + 1):
+            try:
+                created.append(step_line(self.ifc_file.by_id(entity_id)))
+            except RuntimeError:
+                continue
+        return {
+            'format': CHANGESET_FORMAT,
+            'version': CHANGESET_VERSION,
+            'schema': self.ifc_file.schema,
+            'base': {
+                'file': os.path.basename(self.source_path) if self.source_path else None,
+                'fingerprint': self.fingerprint,
+                'max_id': self.base_max_id
+            },
+            'edits': self.edits,
+            'entities': {'modified': modified, 'created': created, 'removed': removed}
+        }
+
+def write_changeset(tracker, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(tracker.to_changeset(), f, indent=2)
+    return path
+
+def load_changeset(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        changeset = json.load(f)
+    if changeset.get('format') != CHANGESET_FORMAT:
+        raise ChangesetError(f"{path} is not an IFC changeset")
+    if changeset.get('version', 0) > CHANGESET_VERSION:
+        raise ChangesetError(f"Changeset version {changeset['version']} is not supported")
+    return changeset
+
+def patch_step_file(changeset, source_path, output_path):
+    # Streams the unchanged copy once: modified #id lines are swapped, removed ones dropped and
+    # created ones written before the end of the DATA section. Nothing is parsed.
+    entities = changeset['entities']
+    replacements = {int(k): v.encode('utf-8') for k, v in entities['modified'].items()}
+    removed = set(entities['removed'])
+    created = [line.encode('utf-8') for line in entities['created']]
+    pending = set(replacements)
+    in_data = False
+    skipping = False
+    with open(source_path, 'rb') as source, open(output_path, 'wb') as output:
+        for line in source:
+            stripped = line.strip()
+            if skipping:
+                # Rest of a statement that spans several lines
+                skipping = not stripped.endswith(b';')
+                continue
+            if not in_data:
+                in_data = stripped == b'DATA;'
+                output.write(line)
+                continue
+            if stripped == b'ENDSEC;':
+                for created_line in created:
+                    output.write(created_line + b'\n')
+                created = []
+                in_data = False
+                output.write(line)
+                continue
+            match = ENTITY_ID.match(line)
+            entity_id = int(match.group(1)) if match else None
+            if entity_id in replacements or entity_id in removed:
+                if entity_id in replacements:
+                    output.write(replacements[entity_id] + b'\n')
+                    pending.discard(entity_id)
+                skipping = not stripped.endswith(b';')
+                continue
+            output.write(line)
+    if pending:
+        os.unlink(output_path)
+        raise ChangesetError(f"{len(pending)} modified entities were not found in {source_path}")
+
+def replay_changeset(changeset, ifc_file):
+    skipped = []
+    for edit in changeset['edits']:
+        try:
+            apply_edit(ifc_file, edit)
+        except ChangesetError as e:
+            skipped.append(str(e))
+    return skipped
+
+def apply_changeset_file(changeset, target_path, output_path):
+    # Identical copies are patched as text; anything else is opened and the edits replayed by GlobalId
+    fingerprint = changeset['base'].get('fingerprint')
+    if fingerprint and fingerprint == file_fingerprint(target_path):
+        patch_step_file(changeset, target_path, output_path)
+        return 'patched', []
+    ifc_file = ifcopenshell.open(target_path)
+    skipped = replay_changeset(changeset, ifc_file)
+    ifc_file.write(output_path)
+    return 'replayed', skipped
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply an IFC changeset to another copy of the model.")
+    parser.add_argument("changeset")
+    parser.add_argument("target", help="IFC file the changes are applied to")
+    parser.add_argument("-o", "--output", help="Where to write the result (defaults to overwriting TARGET)")
+    args = parser.parse_args(argv)
+
+    changeset = load_changeset(args.changeset)
+    output = args.output or args.target
+    temp_output = output + '.tmp'
+    mode, skipped = apply_changeset_file(changeset, args.target, temp_output)
+    os.replace(temp_output, output)
+    print(f"Applied {len(changeset['edits']) - len(skipped)} of {len(changeset['edits'])} edits to {args.target} ({mode}), written to {output}")
+    for reason in skipped:
+        print(f"  Skipped: {reason}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
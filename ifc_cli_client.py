@@ -0,0 +1,291 @@
+import os
+import re
+import sys
+import argparse
+import http.client
+from ifc_model_client import ModelServerError, connect_daemon, default_socket_path
+
+# The same prompts as the full CLI for the commands the model server offers. The daemon keeps
+# the model parsed and indexed between sessions; this process only holds the selected ids.
+COMMANDS = "help/select/view/properties/layers/update/save/undo/redo/count/list/export/quit"
+
+def print_table(rows, headers):
+    # Imported on first use so it stays off the path to the first prompt
+    from tabulate import tabulate
+    print(tabulate(rows, headers=headers, tablefmt="grid"))
+
+def confirm_quit():
+    confirm = input("Are you sure you want to quit? (y/n): ").lower()
+    return confirm == 'y'
+
+def sanitize_filename(filename):
+    return re.sub(r'[\\/*?:"<>|]', "", str(filename)).replace(" ", "_")
+
+def describe(element):
+    return f"{element['type']} (ID: {element['id']})"
+
+def merge_columns(columns, key='Property'):
+    # {column: {row name: value}} -> rows with one column per element, in first-seen row order
+    rows = {}
+    for position, values in enumerate(columns.values()):
+        for name, value in values.items():
+            rows.setdefault(name, [name] + [""] * len(columns))[position + 1] = str(value)
+    return list(rows.values()), [key, *columns]
+
+class RemoteSession:
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+        self.selected = []
+
+    def call(self, command, **params):
+        return self.client.call(command, self.path, **params)
+
+    def ids(self):
+        return [element['id'] for element in self.selected]
+
+    def element_types(self):
+        return self.call('list')['types']
+
+def select_helper(session):
+    identifier = input("Enter element type, ID, 'list' to see all types, or 'quit' to exit: ")
+    if identifier.lower() == 'quit':
+        return confirm_quit()
+    if identifier.lower() == 'list':
+        element_types = session.element_types()
+        print("All element types in the IFC file:")
+        for i, element_type in enumerate(element_types, 1):
+            print(f"  {i}. {element_type}")
+        type_choice = input("Enter the number or name of the type to select: ")
+        if type_choice.isdigit() and 1 <= int(type_choice) <= len(element_types):
+            identifier = element_types[int(type_choice) - 1]
+        else:
+            identifier = type_choice
+    result = session.call('select', identifier=identifier)
+    if len(result['matches']) > 1:
+        print(f"Found {len(result['matches'])} possible matches:")
+        for i, match in enumerate(result['matches'], 1):
+            print(f"{i}. {match}")
+        choice = input("Enter the number of the type to select: ")
+        if not (choice.isdigit() and 1 <= int(choice) <= len(result['matches'])):
+            print("Invalid selection.")
+            return False
+        result = session.call('select', identifier=result['matches'][int(choice) - 1])
+    elements = result['elements']
+    if result['matches'] and elements:
+        print(f"Found {len(elements)} elements of type {result['matches'][0]}:")
+        for i, element in enumerate(elements, 1):
+            print(f"{i}. ID: {element['id']}, Name: {element['name']}")
+        choice = input("Enter the numbers or IDs of the elements to select, separated by commas, or 'all': ").strip().lower()
+        if choice != 'all':
+            by_id = {element['id']: element for element in elements}
+            chosen = []
+            for part in filter(None, (p.strip() for p in choice.split(','))):
+                if part.isdigit() and 1 <= int(part) <= len(elements):
+                    chosen.append(elements[int(part) - 1])
+                elif part.isdigit() and int(part) in by_id:
+                    chosen.append(by_id[int(part)])
+                else:
+                    print(f"Ignoring invalid selection '{part}'")
+            elements = chosen
+    session.selected = elements
+    if elements:
+        print("Selected elements:")
+        for element in elements:
+            print(f"  ID {element['id']}, Type: {element['type']}, Name: {element['name']}")
+    else:
+        print("No elements selected.")
+    return False
+
+def recover_helper(session):
+    pending = session.call('journal')['pending']
+    if not pending:
+        return
+    answer = input(f"Found {pending} unsaved edit, undo or redo record(s) from a previous session. Recover them? (y/n): ").lower()
+    try:
+        result = session.call('recover', replay=answer == 'y')
+    except ModelServerError as e:
+        print(f"Error: {e}")
+        return
+    if answer == 'y':
+        print(f"Recovered the previous session ({result['recovered']} record(s) replayed).")
+
+def view_helper(session):
+    for i, element in enumerate(session.selected, 1):
+        print(f"\nElement {i}:")
+        print(f"  ID: {element['id']}")
+        print(f"  Type: {element['type']}")
+        print(f"  Name: {element['name']}")
+        print(f"  GlobalId: {element['global_id']}")
+
+def properties_helper(session):
+    properties = session.call('properties', ids=session.ids())['properties']
+    print_table(*merge_columns({describe(e): properties[str(e['id'])] for e in session.selected}))
+
+def layers_helper(session):
+    layers = session.call('layers', ids=session.ids())['layers']
+    columns = {}
+    for element in session.selected:
+        if not layers[str(element['id'])]:
+            print(f"Element {element['id']} does not have layers.")
+            continue
+        columns[describe(element)] = {f"Layer {layer['Layer Number']} {key}": value for layer in layers[str(element['id'])]
+                                      for key, value in layer.items() if key != 'Layer Number'}
+    if columns:
+        print("\nLayers for selected elements:")
+        print_table(*merge_columns(columns))
+    else:
+        print("No layers found for the selected elements.")
+
+def count_helper(session):
+    choice = input("Enter the name of the type to count (partial matches allowed): ")
+    counts = session.call('count', type=choice)['counts']
+    if not counts:
+        print(f"No element types found matching '{choice}'")
+    for element_type, count in counts.items():
+        print(f"Number of {element_type} elements: {count}")
+
+def update_helper(session):
+    while True:
+        property_name = input("Enter property name (or 'list' to see properties, 'back' to return): ")
+        if property_name.lower() == 'back':
+            return
+        if property_name.lower() == 'list':
+            properties_helper(session)
+            continue
+        new_value = input("Enter new value: ")
+        if session.call('update', ids=session.ids(), property=property_name, value=new_value)['updated']:
+            print(f"Updated {property_name} to {new_value} for selected element(s)")
+            if input("Do you want to save changes now? (y/n): ").lower() == 'y':
+                save(session)
+        else:
+            print(f"Failed to update property {property_name}. Make sure the property exists and is editable.")
+
+def save(session):
+    if session.call('save')['saved']:
+        print("Changes saved successfully.")
+    else:
+        print("Failed to save changes.")
+
+def export_helper(session):
+    export_type = input("Export (p)roperties, (l)ayers, or (b)oth? ").lower()
+    export_mode = input("Export (s)eparately for each element or (c)ollectively? ").lower()
+    if export_type not in ['p', 'l', 'b'] or export_mode not in ['s', 'c']:
+        print("Invalid input. Please try again.")
+        return
+    kinds = [kind for kind, flag in (('properties', 'p'), ('layers', 'l')) if export_type in (flag, 'b')]
+    # The server writes the files, so paths are made absolute against this directory
+    if export_mode == 'c':
+        jobs = [(kind, session.selected, f"collective_{kind}.csv") for kind in kinds]
+    else:
+        jobs = [(kind, [e], f"{sanitize_filename(e['name'])}_{e['global_id']}_{kind}.csv") for e in session.selected for kind in kinds]
+    for kind, elements, filename in jobs:
+        result = session.call('export', ids=[e['id'] for e in elements], kind=kind, output=os.path.abspath(filename))
+        if result['rows']:
+            print(f"Data exported to {filename}")
+        else:
+            print(f"No data to export to {filename}")
+
+def print_help():
+    print("\nAvailable commands:")
+    print("  help       - Display this help message")
+    print("  select     - Select elements by ID or type")
+    print("  view       - Display basic information about the selected elements")
+    print("  properties - Display properties of the selected elements")
+    print("  layers     - Display the layers of the selected elements")
+    print("  update     - Update a property of the selected elements")
+    print("  save       - Save changes to the IFC file")
+    print("  undo       - Undo the last edit")
+    print("  redo       - Redo the last undone edit")
+    print("  count      - Count elements of a specific type")
+    print("  list       - List all element types in the IFC file")
+    print("  export     - Export properties or layers of the selected elements to CSV")
+    print("  quit       - Exit the client; the server keeps the model loaded")
+
+def run_session(client):
+    print("Welcome to the IFC Viewer and Editor (connected to the model server).")
+    ifc_file = input("Enter the name or path of the IFC file (if in the same directory, just enter the filename): ")
+    if not os.path.exists(ifc_file):
+        print(f"File not found: {ifc_file}")
+        return
+    session = RemoteSession(client, os.path.abspath(ifc_file))
+    print(f"Using IFC file: {session.path}")
+    # Parsed by the server on first use and kept warm for the next session
+    try:
+        session.element_types()
+        recover_helper(session)
+    except ModelServerError as e:
+        print(f"Error: {e}")
+        return
+    except (OSError, http.client.HTTPException) as e:
+        print(f"Lost the connection to the model server: {e}")
+        return
+    print("Type 'help' for a list of commands.")
+
+    needs_selection = ('view', 'properties', 'layers', 'update', 'export')
+    while True:
+        command = input(f"\nEnter command ({COMMANDS}): ").lower()
+        try:
+            if command in needs_selection and not session.selected:
+                print("No elements selected. Use 'select' command first.")
+            elif command == 'help':
+                print_help()
+            elif command == 'select':
+                if select_helper(session):
+                    break
+            elif command == 'view':
+                view_helper(session)
+            elif command == 'properties':
+                properties_helper(session)
+            elif command == 'layers':
+                layers_helper(session)
+            elif command == 'update':
+                update_helper(session)
+            elif command == 'save':
+                if input("Are you sure you want to save changes? This will overwrite the existing file. (y/n): ").lower() == 'y':
+                    save(session)
+                else:
+                    print("Save operation cancelled.")
+            elif command in ('undo', 'redo'):
+                transaction = session.call(command)['transaction']
+                if transaction is None:
+                    print(f"Nothing to {command}.")
+                else:
+                    print(f"{'Undid' if command == 'undo' else 'Redid'}: {transaction}")
+            elif command == 'count':
+                count_helper(session)
+            elif command == 'list':
+                print("All element types in the IFC file:")
+                for element_type in session.element_types():
+                    print(f"  {element_type}")
+            elif command == 'export':
+                export_helper(session)
+            elif command == 'quit':
+                if confirm_quit():
+                    break
+            else:
+                print("Invalid command. Please try again.")
+        except ModelServerError as e:
+            print(f"Error: {e}")
+        except (OSError, http.client.HTTPException) as e:
+            # The daemon died mid-session; the next client starts a new one
+            print(f"Lost the connection to the model server: {e}")
+            return
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="IFC Viewer and Editor, as a client of a warm model server")
+    parser.add_argument("--connect", nargs="?", const=default_socket_path(), default=default_socket_path(), metavar="SOCKET",
+                        help="Unix socket of the model server; one is started in the background if none is running")
+    args, _ = parser.parse_known_args(argv)
+    try:
+        client, started = connect_daemon(args.connect)
+    except ModelServerError as e:
+        print(e)
+        return 1
+    if started:
+        print(f"Started the model server on {args.connect}")
+    run_session(client)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
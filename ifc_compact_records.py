@@ -0,0 +1,203 @@
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+
+# Strings shorter than this are interned so repeated values share one object
+INTERN_MAX_LENGTH = 64
+MATERIAL_LAYERS_KEY = 'MaterialLayers'
+PLACEMENT_KEY = 'LocalPlacement'
+# Rows left behind by discarded elements are dropped once there are this many and they
+# outnumber the live ones
+COMPACT_MIN_FREED = 1024
+
+class ElementHeader:
+    __slots__ = ('element_id', 'columns')
+
+    def __init__(self, element_id, columns):
+        self.element_id = element_id
+        self.columns = columns
+
+class LayerRecord:
+    __slots__ = ('position', 'material', 'thickness', 'is_ventilated', 'area', 'volume', 'has_quantities')
+
+    def __init__(self, layer_info):
+        self.position = layer_info['Position']
+        self.material = _intern(layer_info['Material'])
+        self.thickness = layer_info['Thickness']
+        self.is_ventilated = layer_info['IsVentilated']
+        self.has_quantities = 'Area' in layer_info
+        self.area = layer_info.get('Area')
+        self.volume = layer_info.get('Volume')
+
+    def to_dict(self):
+        layer_info = {
+            'Position': self.position,
+            'Material': self.material,
+            'Thickness': self.thickness,
+            'IsVentilated': self.is_ventilated
+        }
+        if self.has_quantities:
+            layer_info['Area'] = self.area
+            layer_info['Volume'] = self.volume
+        return layer_info
+
+class PropertyColumn:
+    # Rows that have a value, in increasing order, and the values themselves. Columns start
+    # as typed arrays and fall back to a list once a value of another type turns up.
+    __slots__ = ('rows', 'values')
+
+    def __init__(self, value):
+        self.rows = array('I')
+        if isinstance(value, float):
+            self.values = array('d')
+        elif isinstance(value, int) and not isinstance(value, bool):
+            self.values = array('q')
+        else:
+            self.values = []
+
+    def append(self, row, value):
+        self.rows.append(row)
+        values = self.values
+        if isinstance(values, array):
+            if values.typecode == 'd' and isinstance(value, float):
+                values.append(value)
+                return
+            if values.typecode == 'q' and isinstance(value, int) and not isinstance(value, bool) and -2**63 <= value < 2**63:
+                values.append(value)
+                return
+            self.values = values = values.tolist()
+        values.append(value)
+
+    def get(self, row):
+        index = bisect_left(self.rows, row)
+        if index < len(self.rows) and self.rows[index] == row:
+            return self.values[index]
+        raise KeyError(row)
+
+def _intern(value):
+    if isinstance(value, str) and len(value) < INTERN_MAX_LENGTH:
+        return sys.intern(value)
+    return value
+
+def _pack(key, value):
+    if key == PLACEMENT_KEY and isinstance(value, list):
+        return array('d', (v for row in value for v in row))
+    if key == MATERIAL_LAYERS_KEY and isinstance(value, list):
+        return tuple(LayerRecord(layer_info) for layer_info in value)
+    if isinstance(value, list):
+        return tuple(_intern(v) for v in value)
+    return _intern(value)
+
+def _unpack(key, value):
+    if key == PLACEMENT_KEY and isinstance(value, array):
+        return [list(value[i:i + 4]) for i in range(0, len(value), 4)]
+    if key == MATERIAL_LAYERS_KEY and isinstance(value, tuple):
+        return [layer.to_dict() for layer in value]
+    if isinstance(value, tuple):
+        return list(value)
+    return value
+
+class PropertyStore:
+    # Columns and row headers. Rows are only ever appended, so a view keeps reading the store
+    # it was made from after the table has been cleared or compacted onto a new one.
+    def __init__(self):
+        self.keys = []
+        self.key_index = {}
+        self.columns = []
+        self.headers = []
+
+    def append(self, element_id, items):
+        row = len(self.headers)
+        column_indices = array('I')
+        for key, value in items:
+            index = self.key_index.get(key)
+            if index is None:
+                index = self.key_index[key] = len(self.keys)
+                self.keys.append(sys.intern(key))
+                self.columns.append(PropertyColumn(value))
+            self.columns[index].append(row, value)
+            column_indices.append(index)
+        self.headers.append(ElementHeader(element_id, column_indices))
+        return row
+
+    def packed_items(self, row):
+        for index in self.headers[row].columns:
+            yield self.keys[index], self.columns[index].get(row)
+
+class PropertyTable:
+    # Filled from reader threads (the executor's read jobs, background exports, server
+    # requests), so every change to the rows happens under the lock
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.store = PropertyStore()
+        self.row_by_id = {}
+        self.freed = 0
+
+    def __len__(self):
+        return len(self.row_by_id)
+
+    def __contains__(self, element_id):
+        return element_id in self.row_by_id
+
+    def add(self, element_id, properties):
+        items = [(key, _pack(key, value)) for key, value in properties.items()]
+        with self.lock:
+            if element_id in self.row_by_id:
+                self.freed += 1
+            row = self.row_by_id[element_id] = self.store.append(element_id, items)
+            return ElementPropertiesView(self.store, row)
+
+    def get(self, element_id):
+        with self.lock:
+            row = self.row_by_id.get(element_id)
+            return None if row is None else ElementPropertiesView(self.store, row)
+
+    def discard(self, element_id):
+        with self.lock:
+            if self.row_by_id.pop(element_id, None) is not None:
+                self.freed += 1
+                if self.freed >= COMPACT_MIN_FREED and self.freed > len(self.row_by_id):
+                    self._compact()
+
+    def clear(self):
+        with self.lock:
+            self.store = PropertyStore()
+            self.row_by_id = {}
+            self.freed = 0
+
+    def _compact(self):
+        # Live rows are copied to a new store in their current order
+        old = self.store
+        self.store = PropertyStore()
+        for element_id, row in sorted(self.row_by_id.items(), key=lambda item: item[1]):
+            self.row_by_id[element_id] = self.store.append(element_id, old.packed_items(row))
+        self.freed = 0
+
+class ElementPropertiesView(Mapping):
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    def __getitem__(self, key):
+        index = self.store.key_index.get(key)
+        if index is None:
+            raise KeyError(key)
+        try:
+            return _unpack(key, self.store.columns[index].get(self.row))
+        except KeyError:
+            raise KeyError(key) from None
+
+    def __iter__(self):
+        keys = self.store.keys
+        for index in self.store.headers[self.row].columns:
+            yield keys[index]
+
+    def __len__(self):
+        return len(self.store.headers[self.row].columns)
+
+    def __repr__(self):
+        return repr(dict(self))
@@ -0,0 +1,171 @@
+import os
+import re
+import sys
+import argparse
+
+# Value-like entities with no identity of their own: structurally equal instances can be shared
+# and unreferenced ones dropped. Everything else (products, placements, representations, layers
+# with single-valued inverses) is left exactly as written.
+MERGEABLE_TYPES = frozenset({
+    'IFCCARTESIANPOINT', 'IFCDIRECTION', 'IFCVECTOR', 'IFCAXIS1PLACEMENT', 'IFCAXIS2PLACEMENT2D',
+    'IFCAXIS2PLACEMENT3D', 'IFCCARTESIANTRANSFORMATIONOPERATOR2D', 'IFCCARTESIANTRANSFORMATIONOPERATOR3D',
+    'IFCCARTESIANTRANSFORMATIONOPERATOR3DNONUNIFORM', 'IFCCARTESIANPOINTLIST2D', 'IFCCARTESIANPOINTLIST3D',
+    'IFCPOLYLINE', 'IFCPOLYLOOP', 'IFCLINE', 'IFCPROPERTYENUMERATION',
+    'IFCMEASUREWITHUNIT', 'IFCDIMENSIONALEXPONENTS', 'IFCSIUNIT', 'IFCCOLOURRGB',
+})
+# Properties and quantities are edited in place, so a shared one would carry an edit to every
+# set that uses it; like property sets, which have their own GlobalId, they are only dropped
+# when nothing refers to them
+ORPHAN_TYPES = MERGEABLE_TYPES | {
+    'IFCPROPERTYSINGLEVALUE', 'IFCPROPERTYENUMERATEDVALUE', 'IFCPROPERTYLISTVALUE', 'IFCPROPERTYBOUNDEDVALUE',
+    'IFCPROPERTYTABLEVALUE',
+    'IFCQUANTITYLENGTH', 'IFCQUANTITYAREA', 'IFCQUANTITYVOLUME', 'IFCQUANTITYCOUNT', 'IFCQUANTITYWEIGHT', 'IFCQUANTITYTIME',
+    'IFCPROPERTYSET', 'IFCELEMENTQUANTITY',
+}
+ENTITY = re.compile(r'^\s*#(\d+)\s*=\s*([A-Za-z0-9_]+)\s*(\(.*\))\s*;\s*$', re.S)
+REFERENCE = re.compile(r'#(\d+)')
+
+class CompactionStats:
+    def __init__(self):
+        self.entities = 0
+        self.merged = 0
+        self.orphans = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+
+    def summary(self):
+        saved = self.bytes_before - self.bytes_after
+        percent = 100 * saved / self.bytes_before if self.bytes_before else 0
+        return (f"Merged {self.merged} duplicate and dropped {self.orphans} unreferenced entities of {self.entities}; "
+                f"{self.bytes_before / 1e6:.1f} MB -> {self.bytes_after / 1e6:.1f} MB ({percent:.0f}% smaller)")
+
+def _split_references(arguments):
+    # Even parts are outside string literals; '' escapes only ever produce empty odd parts
+    return arguments.split("'")
+
+def _references(arguments):
+    parts = _split_references(arguments)
+    return [int(r) for part in parts[::2] for r in REFERENCE.findall(part)]
+
+def _rewrite(arguments, mapping):
+    parts = _split_references(arguments)
+    parts[::2] = [REFERENCE.sub(lambda m: f"#{mapping.get(int(m.group(1)), int(m.group(1)))}", part) for part in parts[::2]]
+    return "'".join(parts)
+
+def _read_statements(source):
+    # (header lines, {id: (type, arguments)} in file order, footer lines). Statements may span
+    # lines; one ends at a ';' that is not inside a string.
+    header, footer, entities = [], [], {}
+    section = header
+    buffer = ''
+    for line in source:
+        if section is not entities:
+            section.append(line)
+            if section is header and line.strip() == 'DATA;':
+                section = entities
+            continue
+        if not buffer and line.strip() == 'ENDSEC;':
+            section = footer
+            footer.append(line)
+            continue
+        buffer += line
+        if buffer.count("'") % 2 == 0 and buffer.rstrip().endswith(';'):
+            match = ENTITY.match(buffer)
+            if match:
+                entities[int(match.group(1))] = (match.group(2).upper(), match.group(3))
+            buffer = ''
+    return header, entities, footer
+
+def compact_entities(entities, stats):
+    # Bottom-up: an entity's key uses the canonical ids of what it references, so equal
+    # subtrees collapse from the leaves (points, directions) upwards in a single pass
+    canonical = {}
+    representatives = {}
+    for root in entities:
+        if root in canonical:
+            continue
+        stack = [(root, False)]
+        visiting = set()
+        while stack:
+            entity_id, expanded = stack.pop()
+            if entity_id in canonical or entity_id not in entities:
+                continue
+            entity_type, arguments = entities[entity_id]
+            if not expanded:
+                if entity_id in visiting:
+                    # Reference cycle: leave this entity as it is
+                    canonical[entity_id] = entity_id
+                    continue
+                visiting.add(entity_id)
+                stack.append((entity_id, True))
+                stack.extend((r, False) for r in _references(arguments) if r not in canonical)
+                continue
+            if entity_type not in MERGEABLE_TYPES:
+                canonical[entity_id] = entity_id
+                continue
+            key = (entity_type, _rewrite(arguments, canonical))
+            canonical[entity_id] = representatives.setdefault(key, entity_id)
+
+    merged = {entity_id: (entity_type, _rewrite(arguments, canonical))
+              for entity_id, (entity_type, arguments) in entities.items() if canonical[entity_id] == entity_id}
+    stats.merged = len(entities) - len(merged)
+
+    # Drop value entities nothing refers to, then whatever only they referred to
+    references = {entity_id: _references(arguments) for entity_id, (_, arguments) in merged.items()}
+    counts = {}
+    for refs in references.values():
+        for r in refs:
+            counts[r] = counts.get(r, 0) + 1
+    pending = [i for i, (entity_type, _) in merged.items() if entity_type in ORPHAN_TYPES and not counts.get(i)]
+    removed = set()
+    while pending:
+        entity_id = pending.pop()
+        if entity_id in removed:
+            continue
+        removed.add(entity_id)
+        for r in references[entity_id]:
+            counts[r] -= 1
+            if not counts[r] and r in merged and merged[r][0] in ORPHAN_TYPES:
+                pending.append(r)
+    stats.orphans = len(removed)
+    return {i: entity for i, entity in merged.items() if i not in removed}
+
+def compact_step_file(source_path, output_path):
+    stats = CompactionStats()
+    stats.bytes_before = os.path.getsize(source_path)
+    with open(source_path, 'r', encoding='utf-8', errors='surrogateescape', newline='') as source:
+        header, entities, footer = _read_statements(source)
+    stats.entities = len(entities)
+    compacted = compact_entities(entities, stats)
+    with open(output_path, 'w', encoding='utf-8', errors='surrogateescape', newline='') as output:
+        output.writelines(header)
+        for entity_id, (entity_type, arguments) in compacted.items():
+            output.write(f"#{entity_id}={entity_type}{arguments};\n")
+        output.writelines(footer)
+    stats.bytes_after = os.path.getsize(output_path)
+    return stats
+
+def compact_in_place(path):
+    temp_path = path + '.compact.tmp'
+    try:
+        stats = compact_step_file(path, temp_path)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge duplicate value entities and drop unreferenced ones from an IFC file.")
+    parser.add_argument("ifc_file")
+    parser.add_argument("-o", "--output", help="Where to write the result (defaults to overwriting IFC_FILE)")
+    args = parser.parse_args(argv)
+
+    if args.output:
+        stats = compact_step_file(args.ifc_file, args.output)
+    else:
+        stats = compact_in_place(args.ifc_file)
+    print(stats.summary())
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,58 @@
+import io
+import os
+import csv
+import zipfile
+import collections
+import concurrent.futures
+from collections.abc import Mapping
+
+# CSVs rendered ahead of the one being written, per worker
+AHEAD_PER_WORKER = 4
+
+def csv_bytes(rows):
+    if isinstance(rows, Mapping):
+        rows = [rows]
+    if not rows:
+        return None
+    buffer = io.StringIO(newline='')
+    writer = csv.DictWriter(buffer, fieldnames=list(dict.fromkeys(key for row in rows for key in row)))
+    writer.writeheader()
+    writer.writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+def _render(member):
+    file_name, rows = member
+    return file_name, csv_bytes(rows)
+
+def write_csv_bundle(members, zip_path, workers=None, token=None):
+    # members yields (file name, rows). Worker threads render CSVs a bounded distance ahead
+    # while each finished one is compressed into the archive in order, so only that window
+    # is ever held in memory. Returns the number of files written and the names left empty.
+    workers = workers or min(4, os.cpu_count() or 1)
+    written, empty = 0, []
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as archive, \
+            concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix="csv-bundle") as pool:
+        pending = collections.deque()
+
+        def write_next():
+            nonlocal written
+            file_name, data = pending.popleft().result()
+            if data is None:
+                empty.append(file_name)
+            else:
+                archive.writestr(file_name, data)
+                written += 1
+
+        try:
+            for member in members:
+                if token is not None:
+                    token.raise_if_cancelled()
+                pending.append(pool.submit(_render, member))
+                if len(pending) >= workers * AHEAD_PER_WORKER:
+                    write_next()
+            while pending:
+                write_next()
+        finally:
+            for future in pending:
+                future.cancel()
+    return written, empty
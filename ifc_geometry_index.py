@@ -0,0 +1,240 @@
+import os
+import math
+import heapq
+import numpy as np
+import ifcopenshell
+import ifcopenshell.geom
+from ifc_changeset import file_fingerprint
+from ifc_profiling import get_metrics
+from ifc_worker_pool import worker_model, worker_pool
+
+CACHE_ENV = "IFC_VIEWER_CACHE_DIR"
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ifc_viewer")
+CACHE_VERSION = 1
+# Entries per R-tree node
+NODE_CAPACITY = 16
+PARALLEL_THRESHOLD = 200
+CHUNKS_PER_WORKER = 8
+
+def cache_dir():
+    return os.environ.get(CACHE_ENV, DEFAULT_CACHE_DIR)
+
+def cache_path(fingerprint):
+    return os.path.join(cache_dir(), f"{fingerprint}.bboxes.npz")
+
+def geometry_settings():
+    settings = ifcopenshell.geom.settings()
+    settings.set(settings.USE_WORLD_COORDS, True)
+    return settings
+
+def iter_shapes(ifc_file, include=None, num_threads=1):
+    # Body representations only; openings and products the kernel cannot process are left out
+    iterator = ifcopenshell.geom.iterator(geometry_settings(), ifc_file, num_threads, **({'include': include} if include else {}))
+    if not iterator.initialize():
+        return
+    while True:
+        shape = iterator.get()
+        if not ifc_file.by_id(shape.id).is_a('IfcFeatureElementSubtraction'):
+            yield shape
+        if not iterator.next():
+            break
+
+def geometric_products(ifc_file):
+    return [p.id() for p in ifc_file.by_type('IfcProduct')
+            if getattr(p, 'Representation', None) is not None and not p.is_a('IfcFeatureElementSubtraction')]
+
+def _run_chunk(task):
+    function, ids = task
+    return function(worker_model(), ids, 1)
+
+def map_product_chunks(ifc_file, ids, function, processes=None):
+    # Yields function(ifc_file, chunk_ids, num_threads) results as they finish, from a worker
+    # pool over the loaded model; for small inputs one call covers everything and the kernel's
+    # own threads do the work.
+    processes = processes or os.cpu_count() or 1
+    if processes > 1 and len(ids) >= PARALLEL_THRESHOLD:
+        size = max(1, math.ceil(len(ids) / (processes * CHUNKS_PER_WORKER)))
+        tasks = [(function, ids[i:i + size]) for i in range(0, len(ids), size)]
+        with worker_pool(ifc_file, processes) as pool:
+            yield from pool.imap_unordered(_run_chunk, tasks)
+    elif ids:
+        yield function(ifc_file, ids, os.cpu_count() or 1)
+
+def _bounding_boxes_chunk(ifc_file, ids, num_threads):
+    found = []
+    boxes = []
+    for shape in iter_shapes(ifc_file, [ifc_file.by_id(i) for i in ids], num_threads):
+        verts = np.asarray(shape.geometry.verts, dtype=np.float64).reshape(-1, 3)
+        if len(verts):
+            found.append(shape.id)
+            boxes.append(np.concatenate((verts.min(axis=0), verts.max(axis=0))))
+    return np.asarray(found, dtype=np.uint32), np.asarray(boxes, dtype=np.float64).reshape(-1, 6)
+
+def compute_bounding_boxes(ifc_file, processes=None):
+    results = list(map_product_chunks(ifc_file, geometric_products(ifc_file), _bounding_boxes_chunk, processes))
+    if not results:
+        return np.zeros(0, dtype=np.uint32), np.zeros((0, 6))
+    ids = np.concatenate([r[0] for r in results])
+    boxes = np.concatenate([r[1] for r in results])
+    order = np.argsort(ids)
+    return ids[order], boxes[order]
+
+def _box_distance(boxes, point):
+    gap = np.maximum(np.maximum(boxes[:, :3] - point, point - boxes[:, 3:]), 0.0)
+    return np.sqrt((gap * gap).sum(axis=1))
+
+def _intersects(boxes, low, high):
+    return np.all(boxes[:, :3] <= high, axis=1) & np.all(boxes[:, 3:] >= low, axis=1)
+
+class BoxTree:
+    # Static R-tree packed with sort-tile-recursive ordering. Every level is a plain array
+    # of node boxes and node i covers children i * NODE_CAPACITY .. (i + 1) * NODE_CAPACITY - 1
+    # of the level below, so queries walk down level by level with vectorised tests.
+    def __init__(self, ids, boxes):
+        order = self._pack_order(boxes)
+        self.ids = ids[order]
+        self.boxes = boxes[order]
+        self.levels = []
+        level = self.boxes
+        while len(level) > NODE_CAPACITY:
+            level = self._parents(level)
+            self.levels.append(level)
+        self.levels.reverse()
+
+    @staticmethod
+    def _pack_order(boxes):
+        count = len(boxes)
+        if count <= NODE_CAPACITY:
+            return np.arange(count)
+        centers = (boxes[:, :3] + boxes[:, 3:]) / 2
+        slices = max(1, math.ceil(math.sqrt(count / NODE_CAPACITY)))
+        by_x = np.argsort(centers[:, 0], kind='stable')
+        slice_size = math.ceil(count / slices)
+        order = []
+        for start in range(0, count, slice_size):
+            part = by_x[start:start + slice_size]
+            order.append(part[np.argsort(centers[part, 1], kind='stable')])
+        return np.concatenate(order)
+
+    @staticmethod
+    def _parents(level):
+        count = math.ceil(len(level) / NODE_CAPACITY)
+        padded = np.full((count * NODE_CAPACITY, 6), np.nan)
+        padded[:len(level)] = level
+        grouped = padded.reshape(count, NODE_CAPACITY, 6)
+        return np.concatenate((np.nanmin(grouped[:, :, :3], axis=1), np.nanmax(grouped[:, :, 3:], axis=1)), axis=1)
+
+    def _children(self, nodes, size):
+        children = (nodes[:, None] * NODE_CAPACITY + np.arange(NODE_CAPACITY)).ravel()
+        return children[children < size]
+
+    def query_box(self, low, high):
+        low = np.asarray(low, dtype=np.float64)
+        high = np.asarray(high, dtype=np.float64)
+        candidates = np.arange(len(self.levels[0]) if self.levels else len(self.boxes))
+        for depth, level in enumerate(self.levels):
+            hits = candidates[_intersects(level[candidates], low, high)]
+            size = len(self.levels[depth + 1]) if depth + 1 < len(self.levels) else len(self.boxes)
+            candidates = self._children(hits, size)
+        return self.ids[candidates[_intersects(self.boxes[candidates], low, high)]]
+
+    def query_point(self, point, tolerance=0.0):
+        point = np.asarray(point, dtype=np.float64)
+        return self.query_box(point - tolerance, point + tolerance)
+
+    def nearest(self, point, count=1):
+        # Best-first search: nodes and boxes leave the heap in order of distance to the point
+        point = np.asarray(point, dtype=np.float64)
+        top = self.levels[0] if self.levels else self.boxes
+        heap = [(d, 0, i) for i, d in enumerate(_box_distance(top, point))]
+        heapq.heapify(heap)
+        leaf_depth = len(self.levels)
+        results = []
+        while heap and len(results) < count:
+            distance, depth, index = heapq.heappop(heap)
+            if depth == leaf_depth:
+                results.append((int(self.ids[index]), float(distance)))
+                continue
+            level = self.levels[depth + 1] if depth + 1 < leaf_depth else self.boxes
+            children = self._children(np.array([index]), len(level))
+            for child, child_distance in zip(children, _box_distance(level[children], point)):
+                heapq.heappush(heap, (child_distance, depth + 1, int(child)))
+        return results
+
+class GeometryIndex:
+    def __init__(self, ifc_file, ids, boxes):
+        self.ifc_file = ifc_file
+        self.ids = ids
+        self.boxes = boxes
+        self.tree = BoxTree(ids, boxes)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def bounds(self):
+        if not len(self.boxes):
+            return None
+        return self.boxes[:, :3].min(axis=0), self.boxes[:, 3:].max(axis=0)
+
+    def box_of(self, element):
+        index = np.searchsorted(self.ids, element.id())
+        if index < len(self.ids) and self.ids[index] == element.id():
+            return self.boxes[index]
+        return None
+
+    def _elements(self, ids):
+        return [self.ifc_file.by_id(int(i)) for i in sorted(ids)]
+
+    def elements_in_box(self, low, high):
+        return self._elements(self.tree.query_box(low, high))
+
+    def elements_at_point(self, point, tolerance=0.0):
+        return self._elements(self.tree.query_point(point, tolerance))
+
+    def nearest_elements(self, point, count=1):
+        return [(self.ifc_file.by_id(i), distance) for i, distance in self.tree.nearest(point, count)]
+
+    def refreshed(self, element_ids):
+        # After the model was updated in place: only the given elements are tessellated again
+        element_ids = sorted(element_ids)
+        keep = ~np.isin(self.ids, np.asarray(element_ids, dtype=np.uint32))
+        pending = []
+        for element_id in element_ids:
+            try:
+                product = self.ifc_file.by_id(element_id)
+            except RuntimeError:
+                continue
+            if product.is_a('IfcProduct') and getattr(product, 'Representation', None) is not None \
+                    and not product.is_a('IfcFeatureElementSubtraction'):
+                pending.append(element_id)
+        ids, boxes = self.ids[keep], self.boxes[keep]
+        if pending:
+            new_ids, new_boxes = _bounding_boxes_chunk(self.ifc_file, pending, os.cpu_count() or 1)
+            ids, boxes = np.concatenate((ids, new_ids)), np.concatenate((boxes, new_boxes))
+            order = np.argsort(ids)
+            ids, boxes = ids[order], boxes[order]
+        return GeometryIndex(self.ifc_file, ids, boxes)
+
+    @classmethod
+    def for_model(cls, ifc_file, source_path=None, fingerprint=None, processes=None):
+        # Boxes are cached on disk under the file's content hash, so the geometry pass runs
+        # once per revision of a file however often it is opened
+        if fingerprint is None and source_path and os.path.exists(source_path):
+            fingerprint = file_fingerprint(source_path)
+        path = cache_path(fingerprint) if fingerprint else None
+        if path and os.path.exists(path):
+            try:
+                with np.load(path) as cached:
+                    if int(cached['version']) == CACHE_VERSION:
+                        get_metrics().count("cache.bboxes.hit")
+                        return cls(ifc_file, cached['ids'], cached['boxes'])
+            except (OSError, ValueError, KeyError):
+                pass
+        get_metrics().count("cache.bboxes.miss")
+        ids, boxes = compute_bounding_boxes(ifc_file, processes)
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = path + f".{os.getpid()}.tmp.npz"
+            np.savez(temp_path, version=CACHE_VERSION, ids=ids, boxes=boxes)
+            os.replace(temp_path, path)
+        return cls(ifc_file, ids, boxes)
@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import ifcopenshell
+import ifcopenshell.util.element
+import ifcopenshell.util.placement
+from ifc_spatial_index import SpatialIndex
+from ifc_relationship_index import RelationshipIndex
+
+FORMATS = ('jsonl', 'sqlite')
+BATCH_SIZE = 1000
+PLACEMENT_DIGITS = 6
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS elements (
+    id INTEGER PRIMARY KEY, global_id TEXT, type TEXT, name TEXT,
+    container INTEGER, type_object INTEGER, x REAL, y REAL, z REAL, placement TEXT);
+CREATE TABLE IF NOT EXISTS properties (element INTEGER, kind TEXT, set_name TEXT, name TEXT, value);
+CREATE TABLE IF NOT EXISTS layers (element INTEGER, position INTEGER, layer_set INTEGER, material TEXT, thickness REAL);
+CREATE TABLE IF NOT EXISTS relations (source INTEGER, relation TEXT, target INTEGER);
+"""
+# Built after loading: one index build is far cheaper than maintaining them row by row
+INDEXES = """
+CREATE INDEX IF NOT EXISTS elements_type ON elements (type);
+CREATE INDEX IF NOT EXISTS elements_global_id ON elements (global_id);
+CREATE INDEX IF NOT EXISTS properties_element ON properties (element);
+CREATE INDEX IF NOT EXISTS properties_name ON properties (set_name, name);
+CREATE INDEX IF NOT EXISTS layers_element ON layers (element);
+CREATE INDEX IF NOT EXISTS relations_source ON relations (source, relation);
+CREATE INDEX IF NOT EXISTS relations_target ON relations (target, relation);
+"""
+
+def _plain(value):
+    if isinstance(value, ifcopenshell.entity_instance):
+        return value.id()
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    return value
+
+def _property_sets(element, **kwargs):
+    return {name: {k: _plain(v) for k, v in values.items() if k != 'id'}
+            for name, values in ifcopenshell.util.element.get_psets(element, **kwargs).items()}
+
+def _related_ids(element, inverse, attribute):
+    return [getattr(rel, attribute).id() for rel in getattr(element, inverse, None) or () if getattr(rel, attribute, None) is not None]
+
+def _related_lists(element, inverse, attribute):
+    return [related.id() for rel in getattr(element, inverse, None) or () for related in getattr(rel, attribute, None) or ()]
+
+class GraphExporter:
+    # Element records assembled from the spatial and where-used indexes plus each element's own
+    # inverse attributes, produced one at a time so writers never hold more than a batch
+    def __init__(self, ifc_file, spatial=None, relationships=None):
+        self.ifc_file = ifc_file
+        self.spatial = spatial or SpatialIndex(ifc_file)
+        self.relationships = relationships or RelationshipIndex(ifc_file)
+
+    def products(self):
+        return self.ifc_file.by_type('IfcProduct')
+
+    def record(self, element):
+        assigned = self.relationships.assigned
+        element_id = element.id()
+        placement = None
+        if getattr(element, 'ObjectPlacement', None) is not None:
+            matrix = ifcopenshell.util.placement.get_local_placement(element.ObjectPlacement)
+            placement = [[round(float(v), PLACEMENT_DIGITS) for v in row] for row in matrix]
+        layers = []
+        for layer_set_id in assigned['layer set'].get(element_id, ()):
+            for position, layer in enumerate(self.ifc_file.by_id(layer_set_id).MaterialLayers):
+                layers.append({'layer_set': layer_set_id, 'position': position,
+                               'material': layer.Material.Name if layer.Material else None, 'thickness': layer.LayerThickness})
+        types = assigned['type'].get(element_id, ())
+        parent = self.spatial.nodes[element_id].parent if element_id in self.spatial.nodes else None
+        return {
+            'id': element_id,
+            'global_id': element.GlobalId,
+            'type': element.is_a(),
+            'name': element.Name,
+            'psets': _property_sets(element, psets_only=True),
+            'qtos': _property_sets(element, qtos_only=True),
+            'layers': layers,
+            'placement': placement,
+            'relations': {
+                'container': self.spatial.container_of(element) or parent,
+                'type_object': types[0] if types else None,
+                'materials': list(assigned['material'].get(element_id, ())),
+                'property_sets': list(assigned['property set'].get(element_id, ())),
+                'aggregated_by': _related_ids(element, 'Decomposes', 'RelatingObject'),
+                'parts': _related_lists(element, 'IsDecomposedBy', 'RelatedObjects'),
+                'openings': _related_ids(element, 'HasOpenings', 'RelatedOpeningElement'),
+                'voids': _related_ids(element, 'VoidsElements', 'RelatingBuildingElement'),
+                'fills': _related_ids(element, 'FillsVoids', 'RelatingOpeningElement'),
+                'filled_by': _related_ids(element, 'HasFillings', 'RelatedBuildingElement'),
+                'connected_to': _related_ids(element, 'ConnectedTo', 'RelatedElement'),
+                'connected_from': _related_ids(element, 'ConnectedFrom', 'RelatingElement'),
+            }
+        }
+
+    def records(self, elements=None):
+        for element in self.products() if elements is None else elements:
+            yield self.record(element)
+
+def write_jsonl(records, path):
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, default=str, separators=(',', ':')))
+            f.write('\n')
+            count += 1
+    return count
+
+def _sql_value(value):
+    if isinstance(value, (list, tuple, dict)):
+        return json.dumps(value, default=str)
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    return str(value)
+
+def _rows(record):
+    element_id = record['id']
+    placement = record['placement']
+    location = [row[3] for row in placement[:3]] if placement else [None, None, None]
+    relations = record['relations']
+    element = (element_id, record['global_id'], record['type'], record['name'], relations['container'],
+               relations['type_object'], *location, json.dumps(placement) if placement else None)
+    properties = [(element_id, kind, set_name, name, _sql_value(value))
+                  for kind in ('psets', 'qtos') for set_name, values in record[kind].items() for name, value in values.items()]
+    layers = [(element_id, l['position'], l['layer_set'], l['material'], l['thickness']) for l in record['layers']]
+    links = []
+    for relation, targets in relations.items():
+        if relation in ('container', 'type_object'):
+            targets = [] if targets is None else [targets]
+        links.extend((element_id, relation, target) for target in targets)
+    return element, properties, layers, links
+
+def write_sqlite(records, path, batch_size=BATCH_SIZE):
+    # Rows are inserted with executemany, one transaction per batch of elements; durability
+    # is relaxed while loading since a failed export is simply run again
+    if os.path.exists(path):
+        os.unlink(path)
+    connection = sqlite3.connect(path)
+    count = 0
+    try:
+        connection.execute("PRAGMA journal_mode=OFF")
+        connection.execute("PRAGMA synchronous=OFF")
+        connection.executescript(SCHEMA)
+        batch = ([], [], [], [])
+        for record in records:
+            for rows, new_rows in zip(batch, _rows(record)):
+                if isinstance(new_rows, tuple):
+                    rows.append(new_rows)
+                else:
+                    rows.extend(new_rows)
+            count += 1
+            if count % batch_size == 0:
+                _insert(connection, batch)
+                batch = ([], [], [], [])
+        _insert(connection, batch)
+        connection.executescript(INDEXES)
+    finally:
+        connection.close()
+    return count
+
+def _insert(connection, batch):
+    elements, properties, layers, links = batch
+    with connection:
+        connection.executemany("INSERT INTO elements VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", elements)
+        connection.executemany("INSERT INTO properties VALUES (?, ?, ?, ?, ?)", properties)
+        connection.executemany("INSERT INTO layers VALUES (?, ?, ?, ?, ?)", layers)
+        connection.executemany("INSERT INTO relations VALUES (?, ?, ?)", links)
+
+def format_for(path):
+    return 'sqlite' if os.path.splitext(path)[1].lower() in ('.sqlite', '.db', '.sqlite3') else 'jsonl'
+
+def export_graph(exporter, path, elements=None, export_format=None):
+    records = exporter.records(elements)
+    if (export_format or format_for(path)) == 'sqlite':
+        return write_sqlite(records, path)
+    return write_jsonl(records, path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export every product of an IFC model with its properties, layers, placement and relationships.")
+    parser.add_argument("ifc_file")
+    parser.add_argument("output", help="A .jsonl file, or a .sqlite/.db file for the SQLite schema")
+    parser.add_argument("--format", choices=FORMATS, help="Override the format implied by the output extension")
+    args = parser.parse_args(argv)
+
+    exporter = GraphExporter(ifcopenshell.open(args.ifc_file))
+    count = export_graph(exporter, args.output, export_format=args.format)
+    print(f"Exported {count} elements to {args.output}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,62 @@
+import gzip
+import zipfile
+import ifcopenshell
+
+CHUNK_SIZE = 1024 * 1024
+ZIP_MAGIC = b'PK\x03\x04'
+GZIP_MAGIC = b'\x1f\x8b'
+UPLOAD_TYPES = ["ifc", "ifczip", "gz"]
+
+def detect_format(fileobj):
+    head = fileobj.read(4)
+    fileobj.seek(0)
+    if head.startswith(ZIP_MAGIC):
+        return 'ifczip'
+    if head.startswith(GZIP_MAGIC):
+        return 'gzip'
+    return 'ifc'
+
+def strip_compression_suffix(filename):
+    lowered = filename.lower()
+    for suffix in ('.ifczip', '.ifc.gz', '.gz', '.ifc'):
+        if lowered.endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
+
+def _read_chunks(stream):
+    # Decompress chunk by chunk into one growing buffer instead of holding
+    # the compressed and decompressed payloads side by side several times
+    data = bytearray()
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+def _decode(data):
+    # STEP files should be plain ASCII, but some exporters write raw UTF-8
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('latin-1')
+
+def read_ifc_text(fileobj):
+    file_format = detect_format(fileobj)
+    if file_format == 'ifczip':
+        with zipfile.ZipFile(fileobj) as archive:
+            members = [name for name in archive.namelist() if name.lower().endswith('.ifc')]
+            if not members:
+                raise LookupError("No .ifc file found in the archive")
+            with archive.open(members[0]) as member:
+                data = _read_chunks(member)
+    elif file_format == 'gzip':
+        with gzip.GzipFile(fileobj=fileobj, mode='rb') as member:
+            data = _read_chunks(member)
+    else:
+        data = fileobj.read()
+    return _decode(data)
+
+def open_ifc_buffer(fileobj):
+    # Parse straight from memory; nothing is written to disk
+    return ifcopenshell.file.from_string(read_ifc_text(fileobj))
@@ -0,0 +1,283 @@
+import os
+import json
+import contextlib
+
+JOURNAL_FORMAT = "ifc-journal"
+JOURNAL_VERSION = 1
+
+class JournalError(Exception):
+    pass
+
+def encode_value(value):
+    # Attribute values as JSON: references by id, typed values (IfcLabel('x')) by type and value
+    if hasattr(value, 'is_a'):
+        if value.id():
+            return {'#': value.id()}
+        return {'type': value.is_a(), 'value': encode_value(value.wrappedValue)}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(v) for v in value]
+    return value
+
+def decode_value(ifc_file, value):
+    if isinstance(value, dict):
+        if '#' in value:
+            return ifc_file.by_id(value['#'])
+        return ifc_file.create_entity(value['type'], decode_value(ifc_file, value['value']))
+    if isinstance(value, list):
+        return tuple(decode_value(ifc_file, v) for v in value)
+    return value
+
+def _find(ifc_file, entity_id):
+    try:
+        return ifc_file.by_id(entity_id)
+    except RuntimeError:
+        return None
+
+def _entity(ifc_file, entity_id, entity_type):
+    entity = _find(ifc_file, entity_id)
+    if entity is None or entity.is_a() != entity_type:
+        raise JournalError(f"Entity #{entity_id} is not the {entity_type} the journal expects")
+    return entity
+
+class Transaction:
+    # Before and after values of the attributes it changed and the full contents of the entities
+    # it created; undo and redo touch only those
+    def __init__(self, name, changes=None, created=None, elements=None, edits=None):
+        self.name = name
+        self.changes = changes or []
+        self.created = created or []
+        self.elements = elements or []
+        self.edits = edits or []
+
+    def __len__(self):
+        return len(self.changes) + len(self.created)
+
+    def to_dict(self):
+        return {'name': self.name, 'changes': self.changes, 'created': self.created, 'elements': self.elements, 'edits': self.edits}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['name'], data['changes'], data['created'], data['elements'], data['edits'])
+
+    def apply(self, ifc_file):
+        for entity in self.created:
+            if _find(ifc_file, entity['id']) is not None:
+                raise JournalError(f"Entity #{entity['id']} already exists")
+        changed = [(_entity(ifc_file, entity_id, entity_type), attribute, after)
+                   for entity_id, entity_type, attribute, _, after in self.changes]
+        # Created entities first, empty, so they can refer to each other in any order
+        created = [(ifc_file.create_entity(entity['type'], id=entity['id']), entity['attributes']) for entity in self.created]
+        for entity, attributes in created:
+            for index, value in enumerate(attributes):
+                if value is not None:
+                    setattr(entity, entity.attribute_name(index), decode_value(ifc_file, value))
+        for entity, attribute, value in changed:
+            setattr(entity, attribute, decode_value(ifc_file, value))
+
+    def revert(self, ifc_file):
+        changed = [(_entity(ifc_file, entity_id, entity_type), attribute, before)
+                   for entity_id, entity_type, attribute, before, _ in self.changes]
+        created = [_entity(ifc_file, entity['id'], entity['type']) for entity in self.created]
+        for entity, attribute, value in reversed(changed):
+            setattr(entity, attribute, decode_value(ifc_file, value))
+        for entity in reversed(created):
+            ifc_file.remove(entity)
+
+class Journal:
+    # Undo and redo stacks of transactions. With a path, every commit, undo and redo is appended
+    # and synced to a JSON Lines file next to the model before the call returns; after a crash
+    # the file is replayed onto the last saved model rather than starting from a backup.
+    def __init__(self, ifc_file, changes, model_path=None):
+        self.ifc_file = ifc_file
+        self.changes = changes
+        self.model_path = model_path
+        self.path = model_path + '.journal' if model_path else None
+        self.undo_stack = []
+        self.redo_stack = []
+        # The first record of a session starts a new file unless an old one was recovered
+        self._fresh = True
+        self._depth = 0
+        self._before = None
+        self._elements = None
+        self._max_id = None
+        self._edit_count = None
+        self._name = None
+
+    @contextlib.contextmanager
+    def transaction(self, name):
+        # Nested transactions join the outermost one
+        if self._depth == 0:
+            self._name = name
+            self._before = {}
+            self._elements = {}
+            self._max_id = self.ifc_file.get_max_id()
+            self._edit_count = len(self.changes.edits)
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                self._commit()
+
+    def track(self, *entities):
+        # Called before an entity is modified; only the first snapshot in a transaction counts
+        if self._depth == 0:
+            return
+        for entity in entities:
+            if entity is not None and entity.id() and entity.id() not in self._before:
+                self._before[entity.id()] = (entity.is_a(), [encode_value(v) for v in entity])
+
+    def touched(self, elements):
+        if self._depth:
+            self._elements.update((element.id(), None) for element in elements)
+
+    def _commit(self):
+        changes = []
+        for entity_id, (entity_type, before) in self._before.items():
+            entity = _find(self.ifc_file, entity_id)
+            # Entities created earlier in the transaction are recorded whole below
+            if entity is None or entity_id > self._max_id:
+                continue
+            for index, value in enumerate(entity):
+                after = encode_value(value)
+                if after != before[index]:
+                    changes.append([entity_id, entity_type, entity.attribute_name(index), before[index], after])
+        created = []
+        for entity_id in range(self._max_id + 1, self.ifc_file.get_max_id() + 1):
+            entity = _find(self.ifc_file, entity_id)
+            if entity is not None:
+                created.append({'id': entity_id, 'type': entity.is_a(), 'attributes': [encode_value(v) for v in entity]})
+        transaction = Transaction(self._name, changes, created, list(self._elements), self.changes.edits[self._edit_count:])
+        self._before = self._elements = None
+        if len(transaction):
+            self.undo_stack.append(transaction)
+            self.redo_stack = []
+            self._append({'kind': 'commit', 'transaction': transaction.to_dict()})
+
+    def undo(self):
+        if not self.undo_stack:
+            return None
+        transaction = self._undo()
+        self._append({'kind': 'undo'})
+        return transaction
+
+    def redo(self):
+        if not self.redo_stack:
+            return None
+        transaction = self._redo()
+        self._append({'kind': 'redo'})
+        return transaction
+
+    def _undo(self):
+        transaction = self.undo_stack.pop()
+        transaction.revert(self.ifc_file)
+        edits = self.changes.edits
+        if transaction.edits and edits[-len(transaction.edits):] == transaction.edits:
+            del edits[-len(transaction.edits):]
+        self.redo_stack.append(transaction)
+        return transaction
+
+    def _redo(self):
+        transaction = self.redo_stack.pop()
+        transaction.apply(self.ifc_file)
+        entities = [self.ifc_file.by_id(change[0]) for change in transaction.changes]
+        for edit in transaction.edits:
+            self.changes.record(edit, *entities)
+        self.undo_stack.append(transaction)
+        return transaction
+
+    def _header(self):
+        stat = os.stat(self.model_path)
+        return {'format': JOURNAL_FORMAT, 'version': JOURNAL_VERSION, 'schema': self.ifc_file.schema,
+                'base': {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}}
+
+    def _append(self, record):
+        if not self.path:
+            return
+        with open(self.path, 'w' if self._fresh else 'a', encoding='utf-8') as f:
+            if self._fresh:
+                f.write(json.dumps(self._header()) + '\n')
+                self._fresh = False
+            f.write(json.dumps(record, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def rebase(self):
+        # The model was saved: the file on disk now holds every applied transaction, so the
+        # journal restarts from it, keeping the undo and redo history
+        if not self.path:
+            return
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(self._header()) + '\n')
+            for stack, transactions in (('undo', self.undo_stack), ('redo', self.redo_stack)):
+                for transaction in transactions:
+                    f.write(json.dumps({'kind': 'history', 'stack': stack, 'transaction': transaction.to_dict()}, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self._fresh = False
+
+    def discard(self):
+        if self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def pending(self):
+        # Commits, undos and redos a previous session left behind for the current file. Any of
+        # them can leave the model different from the file, even when they cancel out in number;
+        # 'history' records only bring back the undo stacks of the last save. Once this session
+        # has written the journal, it is no longer someone else's to recover.
+        if not self._fresh:
+            return 0
+        return sum(1 for record in self._read() or () if record['kind'] != 'history')
+
+    def _read(self):
+        if not self.path or not os.path.exists(self.path):
+            return None
+        records = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # A record cut short by the crash; everything before it was synced
+                    break
+        if not records or records[0].get('format') != JOURNAL_FORMAT:
+            return None
+        header = records.pop(0)
+        stat = os.stat(self.model_path)
+        base = header['base']
+        if header['schema'] != self.ifc_file.schema or base['size'] != stat.st_size or base['mtime_ns'] != stat.st_mtime_ns:
+            return None
+        return records
+
+    def recover(self, replay=True):
+        # Replays the journal onto the freshly loaded model; returns the commits, undos and redos
+        # replayed. Without replay only the undo history of the last save comes back, and the
+        # unsaved records are dropped from the file so a later crash does not bring them back.
+        records = self._read()
+        if records is None:
+            return 0
+        self._fresh = False
+        replayed = 0
+        for record in records:
+            if record['kind'] == 'history':
+                stack = self.undo_stack if record['stack'] == 'undo' else self.redo_stack
+                stack.append(Transaction.from_dict(record['transaction']))
+            elif not replay:
+                continue
+            elif record['kind'] == 'commit':
+                # Replayed like a redo of a transaction that was just undone
+                self.redo_stack = [Transaction.from_dict(record['transaction'])]
+                self._redo()
+                replayed += 1
+            elif record['kind'] == 'undo' and self.undo_stack:
+                self._undo()
+                replayed += 1
+            elif record['kind'] == 'redo' and self.redo_stack:
+                self._redo()
+                replayed += 1
+        if not replay and any(record['kind'] != 'history' for record in records):
+            self.rebase()
+        return replayed
@@ -0,0 +1,86 @@
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import subprocess
+import http.client
+
+# Only the standard library: thin clients must start without importing the modelling stack
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DAEMON_START_TIMEOUT = 30
+
+class ModelServerError(Exception):
+    pass
+
+def default_socket_path():
+    user = os.getuid() if hasattr(os, 'getuid') else os.environ.get('USERNAME', 'user')
+    return os.path.join(tempfile.gettempdir(), f"ifc_model_server_{user}.sock")
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+class ModelServerClient:
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None, timeout=None):
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def _connection(self):
+        if self.socket_path:
+            return UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _request(self, method, endpoint, params=None):
+        connection = self._connection()
+        try:
+            body = json.dumps(params).encode('utf-8') if params is not None else None
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            connection.request(method, f"/{endpoint}", body=body, headers=headers)
+            response = connection.getresponse()
+            payload = json.loads(response.read() or b'{}')
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise ModelServerError(payload.get('error', f"Server returned {response.status}"))
+        return payload
+
+    def call(self, command, path, **params):
+        return self._request("POST", command, {'path': path, **params})
+
+    def status(self):
+        return self._request("GET", "status")
+
+    def ping(self):
+        try:
+            self.status()
+            return True
+        except (OSError, http.client.HTTPException):
+            return False
+
+def connect_daemon(socket_path=None, preload=()):
+    # Connects to the model server on socket_path, starting it in the background when nothing
+    # is listening there yet. The daemon outlives this process and keeps its models parsed.
+    socket_path = socket_path or default_socket_path()
+    client = ModelServerClient(socket_path=socket_path)
+    if client.ping():
+        return client, False
+    server_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ifc_model_server.py")
+    subprocess.Popen([sys.executable, server_script, "--socket", socket_path, "--preload", *preload],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    deadline = time.monotonic() + DAEMON_START_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        if client.ping():
+            return client, True
+    raise ModelServerError(f"The model server did not start on {socket_path}")
@@ -0,0 +1,173 @@
+import os
+import sys
+import json
+import math
+import hashlib
+import argparse
+import ifcopenshell
+import ifcopenshell.util.element
+import ifcopenshell.util.placement
+from ifc_worker_pool import worker_model, worker_pool
+
+SECTIONS = ('attributes', 'psets', 'qtos', 'materials', 'placement')
+DIGEST_SIZE = 16
+# Coordinates and quantities are compared at this precision so float noise is not a change
+FLOAT_DIGITS = 6
+CHUNKS_PER_WORKER = 4
+PARALLEL_THRESHOLD = 2000
+# Entity ids are renumbered between exports, so references are compared by what they point at
+SKIPPED_ATTRIBUTES = {'id', 'type', 'GlobalId', 'OwnerHistory', 'ObjectPlacement', 'Representation'}
+
+def _canonical(value):
+    if isinstance(value, float):
+        return round(value, FLOAT_DIGITS) + 0.0
+    if isinstance(value, ifcopenshell.entity_instance):
+        return getattr(value, 'GlobalId', None) or value.is_a()
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _canonical(v) for k, v in value.items() if k != 'id'}
+    return value
+
+def _flatten(sets):
+    return {f"{set_name}.{name}": _canonical(value)
+            for set_name, values in sets.items()
+            for name, value in values.items() if name != 'id'}
+
+def _material_names(element):
+    materials = ifcopenshell.util.element.get_materials(element)
+    return sorted(m.Name or '' for m in materials if m is not None)
+
+def element_sections(element):
+    attributes = {k: _canonical(v) for k, v in element.get_info(recursive=False).items() if k not in SKIPPED_ATTRIBUTES}
+    attributes['Type'] = element.is_a()
+    placement = []
+    if getattr(element, 'ObjectPlacement', None) is not None:
+        matrix = ifcopenshell.util.placement.get_local_placement(element.ObjectPlacement)
+        placement = [_canonical(float(v)) for v in matrix.flatten()]
+    return {
+        'attributes': attributes,
+        'psets': _flatten(ifcopenshell.util.element.get_psets(element, psets_only=True)),
+        'qtos': _flatten(ifcopenshell.util.element.get_psets(element, qtos_only=True)),
+        'materials': {'Materials': _material_names(element)},
+        'placement': {'LocalPlacement': placement}
+    }
+
+def _digest(section):
+    payload = json.dumps(section, sort_keys=True, default=str, separators=(',', ':')).encode('utf-8')
+    return hashlib.blake2b(payload, digest_size=DIGEST_SIZE).digest()
+
+def _digest_chunk(ids, ifc_file=None):
+    # One bytes blob per chunk: len(SECTIONS) digests per element, back to back
+    ifc_file = ifc_file or worker_model()
+    global_ids = []
+    digests = bytearray()
+    for element_id in ids:
+        element = ifc_file.by_id(element_id)
+        sections = element_sections(element)
+        global_ids.append(element.GlobalId)
+        for name in SECTIONS:
+            digests += _digest(sections[name])
+    return global_ids, bytes(digests)
+
+def _partition(ids, parts):
+    size = max(1, math.ceil(len(ids) / parts))
+    return [ids[i:i + size] for i in range(0, len(ids), size)]
+
+def index_model(ifc_file, processes=None, element_type='IfcProduct'):
+    ids = [element.id() for element in ifc_file.by_type(element_type) if element.GlobalId]
+    processes = processes or os.cpu_count() or 1
+    if processes > 1 and len(ids) >= PARALLEL_THRESHOLD:
+        with worker_pool(ifc_file, processes) as pool:
+            chunks = pool.map(_digest_chunk, _partition(ids, processes * CHUNKS_PER_WORKER))
+    else:
+        chunks = [_digest_chunk(ids, ifc_file)]
+
+    index = {}
+    width = DIGEST_SIZE * len(SECTIONS)
+    for global_ids, digests in chunks:
+        for i, global_id in enumerate(global_ids):
+            index[global_id] = digests[i * width:(i + 1) * width]
+    return index
+
+def _changed_sections(old_digest, new_digest):
+    return [name for i, name in enumerate(SECTIONS)
+            if old_digest[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE] != new_digest[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE]]
+
+def _changed_values(old_values, new_values):
+    changes = {}
+    for key in dict.fromkeys(list(old_values) + list(new_values)):
+        old, new = old_values.get(key), new_values.get(key)
+        if old != new:
+            changes[key] = {'old': old, 'new': new}
+    return changes
+
+class ModelDiff:
+    def __init__(self, added, removed, modified):
+        self.added = added
+        self.removed = removed
+        self.modified = modified
+
+    def summary(self):
+        return {'added': len(self.added), 'removed': len(self.removed), 'modified': len(self.modified)}
+
+    def to_dict(self):
+        return {'summary': self.summary(), 'added': self.added, 'removed': self.removed, 'modified': self.modified}
+
+def _describe(ifc_file, global_id):
+    element = ifc_file.by_guid(global_id)
+    return {'GlobalId': global_id, 'Type': element.is_a(), 'Name': element.Name}
+
+def diff_models(old_file, new_file, processes=None):
+    old_index = index_model(old_file, processes)
+    new_index = index_model(new_file, processes)
+
+    added = [_describe(new_file, g) for g in new_index if g not in old_index]
+    removed = [_describe(old_file, g) for g in old_index if g not in new_index]
+    modified = []
+    for global_id, new_digest in new_index.items():
+        old_digest = old_index.get(global_id)
+        if old_digest is None or old_digest == new_digest:
+            continue
+        # Full property detail is only rebuilt for the few elements whose digests differ
+        sections = _changed_sections(old_digest, new_digest)
+        old_sections = element_sections(old_file.by_guid(global_id))
+        new_sections = element_sections(new_file.by_guid(global_id))
+        change = _describe(new_file, global_id)
+        change['ChangedSections'] = sections
+        change['Changes'] = {name: _changed_values(old_sections[name], new_sections[name]) for name in sections}
+        modified.append(change)
+    return ModelDiff(added, removed, modified)
+
+def diff_files(old_path, new_path, processes=None):
+    return diff_models(ifcopenshell.open(old_path), ifcopenshell.open(new_path), processes)
+
+def print_diff(diff, limit=50):
+    from tabulate import tabulate
+    summary = diff.summary()
+    print(f"Added: {summary['added']}, Removed: {summary['removed']}, Modified: {summary['modified']}")
+    rows = [["added", e['GlobalId'], e['Type'], e['Name'], ""] for e in diff.added[:limit]]
+    rows += [["removed", e['GlobalId'], e['Type'], e['Name'], ""] for e in diff.removed[:limit]]
+    for change in diff.modified[:limit]:
+        keys = [key for section in change['Changes'].values() for key in section]
+        rows.append(["modified", change['GlobalId'], change['Type'], change['Name'], ", ".join(keys[:5]) + (" ..." if len(keys) > 5 else "")])
+    if rows:
+        print(tabulate(rows, headers=["Change", "GlobalId", "Type", "Name", "Changed"], tablefmt="grid"))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two IFC revisions element by element using GlobalIds.")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--json", metavar="PATH", help="Write the full diff to PATH")
+    parser.add_argument("--processes", type=int, help="Worker processes used for hashing")
+    args = parser.parse_args(argv)
+
+    diff = diff_files(args.old, args.new, args.processes)
+    print_diff(diff)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(diff.to_dict(), f, indent=2, default=str)
+        print(f"Diff written to {args.json}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
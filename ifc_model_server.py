@@ -0,0 +1,484 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import socketserver
+import concurrent.futures
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from command_line_ifc_viewer_editor import IFCViewerEditor, build_element_data, export_to_csv
+from ifc_profiling import enable, get_metrics, instrument_class
+from ifc_changeset import write_changeset
+from ifc_journal import JournalError
+# The client lives in a module of its own so thin clients avoid these imports; it is
+# re-exported here for scripts that import it from the server
+from ifc_model_client import DEFAULT_HOST, DEFAULT_PORT, ModelServerError, ModelServerClient
+
+DEFAULT_MEMORY_BUDGET_MB = 2048
+# A parsed model takes roughly this many times its file size in memory
+MEMORY_FACTOR = 8
+
+class PooledModel:
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.estimated_bytes = os.path.getsize(path) * MEMORY_FACTOR
+        started = time.perf_counter()
+        # A journal a crashed session left behind is only replayed when a client asks for it; the
+        # undo history of the last save comes back without asking
+        self.viewer_editor = IFCViewerEditor(path, processes=1)
+        if not self.viewer_editor.journal.pending():
+            self.viewer_editor.recover_journal(replay=False)
+        self.recovered = 0
+        self.viewer_editor.watch()
+        self.load_seconds = time.perf_counter() - started
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.hits = 0
+        self._element_types = None
+
+    def list_all_element_types(self):
+        if self._element_types is None:
+            get_metrics().count("cache.element_types.miss")
+            self._element_types = self.viewer_editor.list_all_element_types()
+        else:
+            get_metrics().count("cache.element_types.hit")
+        return self._element_types
+
+class ModelPool:
+    def __init__(self, memory_budget_bytes):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.models = OrderedDict()
+        # Futures of models being loaded; requests for the same path wait on them
+        self.loading = {}
+        self.lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def get(self, path):
+        if not path:
+            raise ModelServerError("A 'path' to an IFC file is required")
+        path = os.path.realpath(path)
+        if not os.path.exists(path):
+            raise ModelServerError(f"File not found: {path}")
+        # The pool lock only guards the bookkeeping: parsing and refreshing a model happen
+        # outside it, so a cold load does not hold up requests for other models
+        loading = None
+        with self.lock:
+            model = self.models.get(path)
+            if model is not None:
+                get_metrics().count("cache.model_pool.hit")
+                model.hits += 1
+                self.models.move_to_end(path)
+            elif path in self.loading:
+                loading = self.loading[path]
+            else:
+                get_metrics().count("cache.model_pool.miss")
+                self.loading[path] = concurrent.futures.Future()
+        if model is not None:
+            self._refresh(model)
+            return model
+        if loading is not None:
+            return loading.result()
+        return self._load(path)
+
+    def _load(self, path):
+        loading = self.loading[path]
+        try:
+            model = PooledModel(path)
+        except BaseException as e:
+            with self.lock:
+                del self.loading[path]
+            loading.set_exception(e)
+            raise
+        with self.lock:
+            del self.loading[path]
+            self.loads += 1
+            self.models[path] = model
+            self._evict(keep=path)
+        loading.set_result(model)
+        return model
+
+    def _refresh(self, model):
+        # Models that changed on disk re-read the changed entities, unless they hold unsaved edits
+        if model.dirty or os.path.getmtime(model.path) == model.mtime:
+            return
+        with model.lock:
+            if model.dirty or os.path.getmtime(model.path) == model.mtime:
+                return
+            changes = model.viewer_editor.refresh_from_disk()
+            model.mtime = os.path.getmtime(model.path)
+            model._element_types = None
+        if changes is not None:
+            get_metrics().count("cache.model_pool.refresh")
+
+    def _evict(self, keep):
+        # Least recently used first; models with unsaved edits are never dropped
+        for path in list(self.models):
+            if self.used_bytes() <= self.memory_budget_bytes:
+                break
+            if path != keep and not self.models[path].dirty:
+                del self.models[path]
+                self.evictions += 1
+
+    def used_bytes(self):
+        return sum(model.estimated_bytes for model in self.models.values())
+
+    def evict(self, path):
+        with self.lock:
+            return self.models.pop(os.path.realpath(path), None) is not None
+
+    def status(self):
+        with self.lock:
+            return {
+                'memory_budget_bytes': self.memory_budget_bytes,
+                'used_bytes': self.used_bytes(),
+                'loads': self.loads,
+                'evictions': self.evictions,
+                'models': [
+                    {
+                        'path': path,
+                        'estimated_bytes': model.estimated_bytes,
+                        'load_seconds': round(model.load_seconds, 3),
+                        'hits': model.hits,
+                        'dirty': model.dirty,
+                        'recovered': model.recovered
+                    }
+                    for path, model in self.models.items()
+                ]
+            }
+
+def describe_element(element):
+    # Any entity can be asked for by id; only rooted ones have a name and GlobalId
+    return {'id': element.id(), 'type': element.is_a(), 'name': getattr(element, 'Name', None),
+            'global_id': getattr(element, 'GlobalId', None)}
+
+def resolve_elements(viewer_editor, ids):
+    if not ids:
+        raise ModelServerError("No element 'ids' given")
+    elements = []
+    for element_id in ids:
+        try:
+            elements.append(viewer_editor.ifc_file.by_id(int(element_id)))
+        except RuntimeError:
+            raise ModelServerError(f"No element found with ID {element_id}")
+    return elements
+
+def handle_list(model, params):
+    return {'types': model.list_all_element_types()}
+
+def handle_count(model, params):
+    element_type = params.get('type', '')
+    matches = [t for t in model.list_all_element_types() if element_type.lower() in t.lower()]
+    if element_type in matches:
+        matches = [element_type]
+    return {'counts': {t: model.viewer_editor.count_elements_by_type(t) for t in matches}}
+
+def handle_select(model, params):
+    identifier = str(params.get('identifier', ''))
+    viewer_editor = model.viewer_editor
+    if identifier.isdigit():
+        return {'matches': [], 'elements': [describe_element(e) for e in resolve_elements(viewer_editor, [identifier])]}
+    matches = [t for t in model.list_all_element_types() if identifier.lower() in t.lower()]
+    if identifier in matches:
+        matches = [identifier]
+    if not matches:
+        raise ModelServerError(f"No elements found matching '{identifier}'")
+    elements = viewer_editor.ifc_file.by_type(matches[0]) if len(matches) == 1 else []
+    return {'matches': matches, 'elements': [describe_element(e) for e in elements]}
+
+def handle_spatial(model, params):
+    index = model.viewer_editor.spatial_index()
+    node_id = params.get('node')
+    if node_id is None:
+        return {'nodes': [{'id': node.id, 'depth': depth, 'name': index.describe(node.id), 'parent': node.parent,
+                           'histogram': dict(node.histogram)} for depth, node in index.walk()]}
+    if int(node_id) not in index.nodes:
+        raise ModelServerError(f"No spatial node with ID {node_id}")
+    node_id = int(node_id)
+    types = index.matching_types(node_id, params['type']) if params.get('type') else None
+    return {'path': index.path(node_id), 'histogram': dict(index.nodes[node_id].histogram),
+            'elements': [describe_element(e) for e in index.elements(node_id, types)]}
+
+def handle_where_used(model, params):
+    from ifc_relationship_index import CATEGORIES
+    category = params.get('category', 'material')
+    if category not in CATEGORIES:
+        raise ModelServerError(f"'category' must be one of {', '.join(CATEGORIES)}")
+    viewer_editor = model.viewer_editor
+    index = viewer_editor.relationship_index()
+    if params.get('key') is not None:
+        keys = [int(params['key'])]
+    elif params.get('name'):
+        keys = index.find(category, params['name'])
+    elif params.get('ids'):
+        keys = list(dict.fromkeys(key for e in resolve_elements(viewer_editor, params['ids']) for key in index.keys_of(category, e)))
+    else:
+        return {'entries': [{'id': key, 'name': name, 'elements': count} for key, name, count in index.entries(category)]}
+    return {'keys': [{'id': key, 'name': index.describe(category, key)} for key in keys if key in index.used_by[category]],
+            'elements': [describe_element(e) for e in index.elements(category, keys)]}
+
+def handle_validate(model, params):
+    from ifc_validation import ValidationError
+    try:
+        return model.viewer_editor.validate(params.get('rules')).to_dict()
+    except ValidationError as e:
+        raise ModelServerError(str(e))
+
+def handle_extract(model, params):
+    viewer_editor = model.viewer_editor
+    if params.get('scheme'):
+        if not params.get('output_dir'):
+            raise ModelServerError("'output_dir' is required with 'scheme'")
+        partitions = viewer_editor.extract_partitions(params['scheme'], params['output_dir'])
+        return {'partitions': [{'name': name, 'path': path, 'elements': count} for name, path, count in partitions]}
+    if not params.get('output'):
+        raise ModelServerError("'output' is required")
+    elements = resolve_elements(viewer_editor, params.get('ids'))
+    return {'path': viewer_editor.extract_elements(elements, params['output']), 'elements': len(elements)}
+
+def handle_graph(model, params):
+    if not params.get('output'):
+        raise ModelServerError("'output' is required")
+    viewer_editor = model.viewer_editor
+    elements = resolve_elements(viewer_editor, params['ids']) if params.get('ids') else None
+    return {'path': params['output'], 'elements': viewer_editor.export_graph(params['output'], elements)}
+
+def handle_properties(model, params):
+    viewer_editor = model.viewer_editor
+    elements = resolve_elements(viewer_editor, params.get('ids'))
+    viewer_editor.derive_quantities(elements)
+    return {'properties': {str(e.id()): dict(viewer_editor.get_element_properties(e)) for e in elements}}
+
+def handle_layers(model, params):
+    viewer_editor = model.viewer_editor
+    elements = resolve_elements(viewer_editor, params.get('ids'))
+    viewer_editor.derive_quantities(elements)
+    return {'layers': {str(e.id()): build_element_data(viewer_editor, e)['Layers'] for e in elements}}
+
+def handle_update(model, params):
+    viewer_editor = model.viewer_editor
+    elements = resolve_elements(viewer_editor, params.get('ids'))
+    if 'property' not in params or 'value' not in params:
+        raise ModelServerError("Both 'property' and 'value' are required")
+    success = viewer_editor.update_element_property(elements, params['property'], params['value'])
+    if success:
+        model.dirty = True
+    return {'updated': success}
+
+def history_result(model, transaction):
+    journal = model.viewer_editor.journal
+    if transaction is not None:
+        model.dirty = True
+    return {'transaction': transaction.name if transaction else None,
+            'undo': [t.name for t in journal.undo_stack], 'redo': [t.name for t in journal.redo_stack]}
+
+def handle_undo(model, params):
+    return history_result(model, model.viewer_editor.undo())
+
+def handle_redo(model, params):
+    return history_result(model, model.viewer_editor.redo())
+
+def handle_history(model, params):
+    return history_result(model, None)
+
+def handle_journal(model, params):
+    return {'pending': model.viewer_editor.journal.pending()}
+
+def handle_recover(model, params):
+    # Replays the journal a previous session left behind, as the CLI does after asking; with
+    # replay false only the undo history of the last save is kept
+    viewer_editor = model.viewer_editor
+    if not viewer_editor.journal.pending():
+        raise ModelServerError("No journal to recover")
+    try:
+        model.recovered = viewer_editor.recover_journal(bool(params.get('replay')))
+    except JournalError as e:
+        # Part of the journal may already be applied: start again from the saved file
+        model.viewer_editor = IFCViewerEditor(model.path, processes=1)
+        model.viewer_editor.watch()
+        model._element_types = None
+        raise ModelServerError(f"Could not recover the edits: {e}")
+    model._element_types = None
+    # Replayed records can leave the model different from the file even when they cancel out
+    if model.recovered:
+        model.dirty = True
+    return {'recovered': model.recovered}
+
+def handle_save(model, params):
+    saved = model.viewer_editor.save_ifc_file(params.get('compact'))
+    if saved:
+        model.dirty = False
+        model.mtime = os.path.getmtime(model.path)
+    return {'saved': saved}
+
+def handle_export(model, params):
+    viewer_editor = model.viewer_editor
+    elements = resolve_elements(viewer_editor, params.get('ids'))
+    viewer_editor.derive_quantities(elements)
+    kind = params.get('kind', 'properties')
+    output = params.get('output')
+    if kind not in ('properties', 'layers') or not output:
+        raise ModelServerError("'kind' must be 'properties' or 'layers' and 'output' is required")
+    data = []
+    for element in elements:
+        element_data = build_element_data(viewer_editor, element)
+        header = {'Element Name': element_data['Element Name'], 'Element GlobalId': element_data['Element GlobalId'], 'Element Type': element_data['Element Type']}
+        if kind == 'properties':
+            data.append({**header, **element_data['Properties']})
+        else:
+            data.extend({**header, **layer} for layer in element_data['Layers'])
+    export_to_csv(output, data)
+    return {'rows': len(data), 'output': os.path.abspath(output)}
+
+def handle_changeset(model, params):
+    output = params.get('output')
+    if not output:
+        raise ModelServerError("'output' is required")
+    write_changeset(model.viewer_editor.changes, output)
+    return {'edits': len(model.viewer_editor.changes), 'output': os.path.abspath(output)}
+
+COMMANDS = {
+    'select': handle_select,
+    'spatial': handle_spatial,
+    'where_used': handle_where_used,
+    'properties': handle_properties,
+    'layers': handle_layers,
+    'count': handle_count,
+    'list': handle_list,
+    'update': handle_update,
+    'save': handle_save,
+    'export': handle_export,
+    'extract': handle_extract,
+    'graph': handle_graph,
+    'changeset': handle_changeset,
+    'undo': handle_undo,
+    'redo': handle_redo,
+    'history': handle_history,
+    'journal': handle_journal,
+    'recover': handle_recover,
+    'validate': handle_validate,
+}
+
+class ModelRequestHandler(BaseHTTPRequestHandler):
+    server_version = "IFCModelServer/1.0"
+
+    def address_string(self):
+        # Unix socket peers have no host/port pair
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.strip('/') == 'status':
+            status = self.server.pool.status()
+            if get_metrics().enabled:
+                status['metrics'] = get_metrics().snapshot()
+            self.send_json(200, status)
+        else:
+            self.send_json(404, {'error': f"Unknown endpoint: {self.path}"})
+
+    def do_POST(self):
+        command = self.path.strip('/')
+        started = time.perf_counter()
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            params = json.loads(self.rfile.read(length) or b'{}')
+            if command == 'evict':
+                result = {'evicted': self.server.pool.evict(params.get('path', ''))}
+            elif command in COMMANDS:
+                with get_metrics().command('request', command):
+                    model = self.server.pool.get(params.get('path'))
+                    with model.lock:
+                        result = COMMANDS[command](model, params)
+            else:
+                self.send_json(404, {'error': f"Unknown command: {command}"})
+                return
+        except (ModelServerError, ValueError) as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        except Exception as e:
+            self.send_json(500, {'error': f"Error running {command}: {e}"})
+            return
+        result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        self.send_json(200, result)
+
+class ModelHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+class ModelUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def create_server(pool, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None, verbose=False):
+    if socket_path:
+        # Only Unix sockets need it, and fcntl is POSIX-only
+        import fcntl
+        # The server holding the lock file owns the socket, so a second daemon started by a
+        # concurrent client cannot unlink it; a socket left by a crashed server is replaced
+        lock = open(socket_path + ".lock", "a")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            raise ModelServerError(f"A model server is already running on {socket_path}")
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = ModelUnixServer(socket_path, ModelRequestHandler)
+        server.socket_lock = lock
+    else:
+        server = ModelHTTPServer((host, port), ModelRequestHandler)
+    server.pool = pool
+    server.verbose = verbose
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve IFC models over a local JSON API.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--socket", help="Listen on a Unix socket instead of TCP")
+    parser.add_argument("--memory-budget", type=int, default=DEFAULT_MEMORY_BUDGET_MB, help="Model pool budget in MB")
+    parser.add_argument("--preload", nargs="*", default=[], help="IFC files to parse at startup")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--metrics", metavar="PATH", help="Append per-request metrics to PATH as JSON lines")
+    args = parser.parse_args(argv)
+
+    if args.metrics:
+        enable(args.metrics)
+        instrument_class(IFCViewerEditor)
+
+    pool = ModelPool(args.memory_budget * 1024 * 1024)
+    try:
+        server = create_server(pool, args.host, args.port, args.socket, args.verbose)
+    except ModelServerError as e:
+        print(e, file=sys.stderr)
+        return 1
+    for path in args.preload:
+        pool.get(path)
+    where = args.socket or f"http://{args.host}:{args.port}"
+    print(f"IFC model server listening on {where}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket:
+            if os.path.exists(args.socket):
+                os.unlink(args.socket)
+            server.socket_lock.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,33 @@
+from collections import OrderedDict
+from ifc_profiling import get_metrics
+
+MAX_ENTRIES = 256
+
+class PageCache:
+    # Derived data for the pages of one session, keyed by page input. Entries belong to one
+    # model and model version: loading another model or any edit drops them all on the next
+    # lookup. The least recently used entries go first once the cache is full.
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._model = None
+        self._version = None
+
+    def get(self, viewer_editor, name, compute, *inputs):
+        if viewer_editor is not self._model or viewer_editor.model_version != self._version:
+            self._entries.clear()
+            self._model = viewer_editor
+            self._version = viewer_editor.model_version
+        key = (name, inputs)
+        if key in self._entries:
+            get_metrics().count("cache.page.hit")
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        get_metrics().count("cache.page.miss")
+        value = compute()
+        # An edit made while computing means the value may already be stale
+        if viewer_editor.model_version == self._version:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
@@ -0,0 +1,115 @@
+import os
+import math
+import functools
+from array import array
+from command_line_ifc_viewer_editor import IFCViewerEditor, build_element_data
+from ifc_worker_pool import worker_model, worker_pool
+
+# Below this many elements the cost of starting workers outweighs the gain
+PARALLEL_THRESHOLD = 500
+CHUNKS_PER_WORKER = 4
+
+def _add_to_columns(columns, row, values):
+    for key, value in values.items():
+        column = columns.get(key)
+        if column is None:
+            column = columns[key] = (array('I'), [])
+        column[0].append(row)
+        column[1].append(value)
+
+def _from_columns(columns, count):
+    rows = [{} for _ in range(count)]
+    for key, (row_numbers, values) in columns.items():
+        for row, value in zip(row_numbers, values):
+            rows[row][key] = value
+    return rows
+
+class ElementDataChunk:
+    # Columnar result of one worker task. Each column holds the row numbers that have a
+    # value and the values themselves, so property and layer keys travel once per chunk
+    # rather than once per element or layer.
+    __slots__ = ('ids', 'headers', 'columns', 'layer_elements', 'layer_columns')
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.headers = []
+        self.columns = {}
+        # Element row of each layer row
+        self.layer_elements = array('I')
+        self.layer_columns = {}
+
+    def add(self, row, element_data):
+        self.headers.append((element_data['Element Name'], element_data['Element GlobalId'], element_data['Element Type']))
+        _add_to_columns(self.columns, row, element_data['Properties'])
+        for layer in element_data['Layers']:
+            _add_to_columns(self.layer_columns, len(self.layer_elements), layer)
+            self.layer_elements.append(row)
+
+    def rows(self):
+        properties = _from_columns(self.columns, len(self.ids))
+        layers = [[] for _ in self.ids]
+        for row, layer in zip(self.layer_elements, _from_columns(self.layer_columns, len(self.layer_elements))):
+            layers[row].append(layer)
+        for row, element_id in enumerate(self.ids):
+            name, global_id, element_type = self.headers[row]
+            yield {
+                'Element Name': name,
+                'Element GlobalId': global_id,
+                'Element Type': element_type,
+                'Element ID': element_id,
+                'Properties': properties[row],
+                'Layers': layers[row]
+            }
+
+def _worker_editor(path, derived, ifc_file):
+    # Workers that parsed the model themselves get the derived quantities computed up front
+    viewer_editor = IFCViewerEditor(path, ifc_file, processes=1)
+    viewer_editor.quantity_engine().values.update(derived)
+    return viewer_editor
+
+def _extract_chunk(ids, viewer_editor=None):
+    viewer_editor = viewer_editor or worker_model()
+    chunk = ElementDataChunk(array('q', ids))
+    for row, element_id in enumerate(ids):
+        chunk.add(row, build_element_data(viewer_editor, viewer_editor.ifc_file.by_id(element_id)))
+    return chunk
+
+class ParallelExtraction:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __len__(self):
+        return sum(len(chunk.ids) for chunk in self.chunks)
+
+    def column_names(self):
+        names = {}
+        for chunk in self.chunks:
+            names.update(dict.fromkeys(chunk.columns))
+        return list(names)
+
+    def iter_element_data(self):
+        for chunk in self.chunks:
+            yield from chunk.rows()
+
+def partition(ids, parts):
+    size = max(1, math.ceil(len(ids) / parts))
+    return [ids[i:i + size] for i in range(0, len(ids), size)]
+
+def extract_element_data_parallel(viewer_editor, elements, processes=None):
+    ids = [element.id() for element in elements]
+    processes = processes or os.cpu_count() or 1
+    # Derived quantities are computed up front so the extraction workers inherit them
+    viewer_editor.derive_quantities(elements)
+    if processes < 2 or len(ids) < PARALLEL_THRESHOLD:
+        return ParallelExtraction([_extract_chunk(ids, viewer_editor)] if ids else [])
+
+    engine = viewer_editor.quantity_engine()
+    derived = {element_id: engine.values[element_id] for element_id in ids if element_id in engine.values}
+    setup = functools.partial(_worker_editor, viewer_editor.ifc_file_path, derived)
+    with worker_pool(viewer_editor.ifc_file, processes, viewer_editor, setup) as pool:
+        # imap keeps chunk order, so element order is preserved
+        chunks = list(pool.imap(_extract_chunk, partition(ids, processes * CHUNKS_PER_WORKER)))
+    return ParallelExtraction(chunks)
+
+def collect_elements_to_export(viewer_editor, elements, processes=None):
+    return list(extract_element_data_parallel(viewer_editor, elements, processes).iter_element_data())
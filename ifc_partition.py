@@ -0,0 +1,161 @@
+import os
+import re
+import sys
+import argparse
+import ifcopenshell
+from ifc_spatial_index import SpatialIndex, is_spatial
+from ifc_worker_pool import worker_model, worker_pool
+
+SCHEMES = ('storey', 'type', 'discipline')
+# Element classes per discipline; anything else is architectural
+DISCIPLINES = {
+    'Structural': ('IfcBeam', 'IfcColumn', 'IfcFooting', 'IfcPile', 'IfcReinforcingElement', 'IfcTendon'),
+    'MEP': ('IfcDistributionElement', 'IfcFlowSegment', 'IfcFlowFitting', 'IfcFlowTerminal', 'IfcEnergyConversionDevice'),
+}
+DEFAULT_DISCIPLINE = 'Architectural'
+
+def _is_object(value):
+    return isinstance(value, ifcopenshell.entity_instance) and value.is_a('IfcObjectDefinition')
+
+def partition_objects(ifc_file, element_ids, spatial=None):
+    # The elements, their parts and openings, the spatial structure above them, their types
+    # and whatever they are placed relative to
+    spatial = spatial or SpatialIndex(ifc_file)
+    included = set()
+    pending = [ifc_file.by_id(i) for i in element_ids]
+    while pending:
+        element = pending.pop()
+        if element.id() in included:
+            continue
+        if is_spatial(element) or element.is_a('IfcProject'):
+            node_id = element.id()
+            while node_id is not None and node_id not in included:
+                included.add(node_id)
+                node_id = spatial.nodes[node_id].parent if node_id in spatial.nodes else None
+            continue
+        included.add(element.id())
+        # Products placed relative to another one (doors in openings, parts in assemblies)
+        # need that one too, or the copied placement would not place anything
+        placement = getattr(element, 'ObjectPlacement', None)
+        if placement is not None and getattr(placement, 'PlacementRelTo', None) is not None:
+            pending.extend(getattr(placement.PlacementRelTo, 'PlacesObject', None) or ())
+        for rel in getattr(element, 'IsDecomposedBy', None) or ():
+            pending.extend(rel.RelatedObjects)
+        for rel in getattr(element, 'HasOpenings', None) or ():
+            pending.append(rel.RelatedOpeningElement)
+        for rel in getattr(element, 'IsDefinedBy', None) or ():
+            if rel.is_a('IfcRelDefinesByType'):
+                included.add(rel.RelatingType.id())
+        for rel in getattr(element, 'IsTypedBy', None) or ():
+            included.add(rel.RelatingType.id())
+        node_id = spatial.container_of(element)
+        while node_id is not None and node_id not in included:
+            included.add(node_id)
+            node_id = spatial.nodes[node_id].parent
+    included.update(p.id() for p in ifc_file.by_type('IfcProject'))
+    return included
+
+def _copy_relationship(target, rel, included):
+    # Object references are kept only when the object is in the partition; a relationship
+    # left without one of its ends is not copied
+    values = []
+    for value in rel:
+        if _is_object(value):
+            if value.id() not in included:
+                return None
+            values.append(target.add(value))
+        elif isinstance(value, tuple) and any(_is_object(v) for v in value):
+            kept = tuple(target.add(v) for v in value if not _is_object(v) or v.id() in included)
+            if not kept:
+                return None
+            values.append(kept)
+        elif isinstance(value, ifcopenshell.entity_instance):
+            values.append(target.add(value))
+        elif isinstance(value, tuple) and value and isinstance(value[0], ifcopenshell.entity_instance):
+            values.append(tuple(target.add(v) for v in value))
+        else:
+            values.append(value)
+    return target.create_entity(rel.is_a(), *values)
+
+def _reference_closure(ifc_file, ids):
+    # Shared geometry is walked once however many objects use it
+    seen = set()
+    pending = list(ids)
+    while pending:
+        entity_id = pending.pop()
+        if entity_id in seen:
+            continue
+        seen.add(entity_id)
+        pending.extend(e.id() for e in ifc_file.traverse(ifc_file.by_id(entity_id), max_levels=1) if e.id() and e.id() not in seen)
+    return seen
+
+def build_partition(ifc_file, element_ids, spatial=None):
+    # A standalone model: everything the objects reference, transitively, plus the
+    # relationships among them, styles for their geometry and the project's units and contexts
+    included = partition_objects(ifc_file, element_ids, spatial)
+    target = ifcopenshell.file(schema=ifc_file.schema)
+    for object_id in sorted(included):
+        target.add(ifc_file.by_id(object_id))
+    for rel in ifc_file.by_type('IfcRelationship'):
+        _copy_relationship(target, rel, included)
+    copied = _reference_closure(ifc_file, included)
+    for styled_item in ifc_file.by_type('IfcStyledItem'):
+        if styled_item.Item is not None and styled_item.Item.id() in copied:
+            target.add(styled_item)
+    return target
+
+def partition_name(name):
+    return re.sub(r'[^\w\-. ]', '', str(name)).strip().replace(' ', '_') or 'partition'
+
+def _write_partition(task, ifc_file=None):
+    name, element_ids, output_path = task
+    target = build_partition(ifc_file or worker_model(), element_ids)
+    target.write(output_path)
+    return name, output_path, len(element_ids)
+
+def write_partitions(ifc_file, partitions, output_dir, processes=None):
+    # One file per partition, written by a worker pool over the loaded model
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [(name, ids, os.path.join(output_dir, f"{partition_name(name)}.ifc")) for name, ids in partitions.items() if ids]
+    processes = min(processes or os.cpu_count() or 1, len(tasks))
+    if processes > 1:
+        with worker_pool(ifc_file, processes) as pool:
+            return list(pool.imap_unordered(_write_partition, tasks))
+    return [_write_partition(task, ifc_file) for task in tasks]
+
+def elements_of(ifc_file):
+    return [e for e in ifc_file.by_type('IfcElement') if not e.is_a('IfcFeatureElementSubtraction')]
+
+def partitions_by(ifc_file, scheme, spatial=None):
+    partitions = {}
+    if scheme == 'storey':
+        spatial = spatial or SpatialIndex(ifc_file)
+        for node in spatial.storeys():
+            name = ifc_file.by_id(node.id).Name or f"storey_{node.id}"
+            partitions.setdefault(name, []).extend(spatial.element_ids(node.id))
+    elif scheme == 'type':
+        for element in elements_of(ifc_file):
+            partitions.setdefault(element.is_a(), []).append(element.id())
+    elif scheme == 'discipline':
+        for element in elements_of(ifc_file):
+            discipline = next((d for d, types in DISCIPLINES.items() if any(element.is_a(t) for t in types)), DEFAULT_DISCIPLINE)
+            partitions.setdefault(discipline, []).append(element.id())
+    else:
+        raise ValueError(f"Partition scheme must be one of {', '.join(SCHEMES)}")
+    return partitions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split an IFC model into standalone sub-models.")
+    parser.add_argument("ifc_file")
+    parser.add_argument("--by", choices=SCHEMES, default='storey', help="How to partition the elements")
+    parser.add_argument("-o", "--output-dir", help="Directory for the sub-models (defaults to <name>_<scheme>)")
+    parser.add_argument("--processes", type=int, help="Partitions written in parallel")
+    args = parser.parse_args(argv)
+
+    ifc_file = ifcopenshell.open(args.ifc_file)
+    output_dir = args.output_dir or f"{os.path.splitext(args.ifc_file)[0]}_{args.by}"
+    for name, path, count in sorted(write_partitions(ifc_file, partitions_by(ifc_file, args.by), output_dir, args.processes)):
+        print(f"{name}: {count} elements -> {path}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
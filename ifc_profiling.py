@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import uuid
+import cProfile
+import functools
+import threading
+import contextlib
+import contextvars
+from collections import Counter
+import ifcopenshell
+import ifcopenshell.util.element
+import ifcopenshell.util.placement
+
+METRICS_ENV = "IFC_VIEWER_METRICS"
+PROFILE_ENV = "IFC_VIEWER_PROFILE"
+# Methods that walk every entity in the file
+FULL_SCAN_METHODS = {"list_all_element_types", "find_close_matches"}
+# Library hot paths timed as nested spans
+HOT_PATHS = [
+    (ifcopenshell.util.element, "get_psets"),
+    (ifcopenshell.util.element, "get_materials"),
+    (ifcopenshell.util.placement, "get_local_placement"),
+]
+
+# Counters of the command running in this context. Work handed to other threads with a copy of
+# the context adds to the same Counter, and concurrent sessions each count into their own.
+_command_counters = contextvars.ContextVar('command_counters', default=None)
+
+class Metrics:
+    def __init__(self, sink=None, session_id=None):
+        self.enabled = True
+        self.sink = sink
+        self.session_id = session_id or uuid.uuid4().hex[:12]
+        self.spans = {}
+        self.counters = Counter()
+        self.folded = Counter()
+        self._entity_counts = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextlib.contextmanager
+    def span(self, name):
+        stack = self._stack()
+        stack.append(name)
+        path = ";".join(stack)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            stack.pop()
+            with self._lock:
+                entry = self.spans.setdefault(name, [0, 0.0, 0.0])
+                entry[0] += 1
+                entry[1] += elapsed
+                entry[2] = max(entry[2], elapsed)
+                # Self time per stack, the format flame graph tools expect
+                self.folded[path] += elapsed
+                if len(stack):
+                    self.folded[";".join(stack)] -= elapsed
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+            counters = _command_counters.get()
+            if counters is not None:
+                counters[name] += amount
+
+    def entity_count(self, ifc_file):
+        key = id(ifc_file)
+        if key not in self._entity_counts:
+            self._entity_counts[key] = sum(1 for _ in ifc_file)
+        return self._entity_counts[key]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'spans': {name: {'count': c, 'total_seconds': round(t, 6), 'max_seconds': round(m, 6)}
+                          for name, (c, t, m) in self.spans.items()},
+                'counters': dict(self.counters)
+            }
+
+    def emit(self, event, **fields):
+        if not self.sink:
+            return
+        record = {'ts': time.time(), 'session': self.session_id, 'event': event, **fields}
+        with self._lock, open(self.sink, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+    @contextlib.contextmanager
+    def command(self, kind, name, **fields):
+        # One JSON line per CLI command or Streamlit page run, with the counters it moved
+        counters = Counter()
+        token = _command_counters.set(counters)
+        started = time.perf_counter()
+        try:
+            with self.span(f"{kind}.{name}"):
+                yield
+        finally:
+            _command_counters.reset(token)
+            with self._lock:
+                delta = dict(counters)
+            self.emit(kind, **{'name': name, 'seconds': round(time.perf_counter() - started, 6), 'counters': delta, **fields})
+
+    def write_folded(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, seconds in sorted(self.folded.items()):
+                if seconds > 0:
+                    f.write(f"{stack} {int(seconds * 1_000_000)}\n")
+
+class NullMetrics:
+    enabled = False
+
+    @contextlib.contextmanager
+    def span(self, name):
+        yield
+
+    def command(self, kind, name, **fields):
+        return self.span(name)
+
+    def count(self, name, amount=1):
+        pass
+
+    def emit(self, event, **fields):
+        pass
+
+_metrics = NullMetrics()
+
+def get_metrics():
+    return _metrics
+
+def enable(sink=None, session_id=None):
+    global _metrics
+    if not _metrics.enabled:
+        _metrics = Metrics(sink, session_id)
+        for module, name in HOT_PATHS:
+            instrument_function(module, name, name)
+    return _metrics
+
+def enable_from_environment():
+    if os.environ.get(METRICS_ENV) or os.environ.get(PROFILE_ENV):
+        return enable(os.environ.get(METRICS_ENV))
+    return _metrics
+
+def _entities_in(args):
+    count = 0
+    for arg in args:
+        if isinstance(arg, ifcopenshell.entity_instance):
+            count += 1
+        elif isinstance(arg, (list, tuple)):
+            count += sum(1 for a in arg if isinstance(a, ifcopenshell.entity_instance))
+    return count
+
+def _wrap(func, span_name, scan=False, count_entities=True):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        metrics = _metrics
+        if not metrics.enabled:
+            return func(*args, **kwargs)
+        metrics.count(f"calls.{span_name}")
+        if not count_entities:
+            pass
+        elif scan and args and hasattr(args[0], 'ifc_file'):
+            metrics.count("entities_visited", metrics.entity_count(args[0].ifc_file))
+        else:
+            metrics.count("entities_visited", _entities_in(args[1:] if args and hasattr(args[0], 'ifc_file') else args))
+        with metrics.span(span_name):
+            return func(*args, **kwargs)
+    wrapper.__instrumented__ = True
+    return wrapper
+
+def instrument_function(module, name, span_name):
+    func = getattr(module, name)
+    if not getattr(func, '__instrumented__', False):
+        setattr(module, name, _wrap(func, span_name, count_entities=False))
+
+def instrument_class(cls):
+    for name, func in list(vars(cls).items()):
+        if callable(func) and not name.startswith('_') and not getattr(func, '__instrumented__', False):
+            setattr(cls, name, _wrap(func, f"{cls.__name__}.{name}", scan=name in FULL_SCAN_METHODS))
+    return cls
+
+@contextlib.contextmanager
+def profiled(path):
+    # cProfile output for snakeviz/flameprof plus folded span stacks for flamegraph.pl
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        if _metrics.enabled:
+            _metrics.write_folded(os.path.splitext(path)[0] + ".folded")
@@ -0,0 +1,161 @@
+import os
+import hashlib
+import sqlite3
+import numpy as np
+import ifcopenshell.util.element
+import ifcopenshell.util.placement
+import ifcopenshell.util.unit
+from ifc_geometry_index import cache_dir, iter_shapes, map_product_chunks
+from ifc_profiling import get_metrics
+
+DERIVED_PREFIX = "DerivedQuantities"
+QUANTITY_NAMES = ('Volume', 'SurfaceArea', 'FootprintArea', 'Height')
+CACHE_FILE = "quantities.sqlite"
+# Exported quantities preferred over derived ones for the layer takeoff, most specific first
+LAYER_AREA_QUANTITIES = [
+    ('Qto_WallBaseQuantities', 'NetSideArea'),
+    ('Qto_WallBaseQuantities', 'GrossSideArea'),
+    ('Qto_SlabBaseQuantities', 'NetArea'),
+    ('Qto_SlabBaseQuantities', 'GrossArea'),
+    ('Qto_CoveringBaseQuantities', 'NetArea'),
+    ('Qto_RoofBaseQuantities', 'NetArea'),
+]
+
+def mesh_quantities(verts, faces):
+    vertices = np.asarray(verts, dtype=np.float64).reshape(-1, 3)
+    triangles = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+    if not len(triangles):
+        return None
+    # Centred first so large world coordinates do not swamp the volume sum
+    vertices = vertices - vertices.mean(axis=0)
+    a, b, c = vertices[triangles[:, 0]], vertices[triangles[:, 1]], vertices[triangles[:, 2]]
+    normals = np.cross(b - a, c - a)
+    volume = abs(np.einsum('ij,ij->i', a, np.cross(b, c)).sum()) / 6
+    area = np.linalg.norm(normals, axis=1).sum() / 2
+    # A closed shell covers its plan outline twice (top and bottom), whatever the winding
+    footprint = np.abs(normals[:, 2]).sum() / 4
+    height = vertices[:, 2].max() - vertices[:, 2].min()
+    return (float(volume), float(area), float(footprint), float(height))
+
+def representation_key(element):
+    # Changes whenever the element's geometry or placement does, whatever else is edited
+    digest = hashlib.blake2b(element.GlobalId.encode('utf-8'), digest_size=16)
+    for entity in element.file.traverse(element.Representation):
+        digest.update(str(entity).encode('utf-8'))
+    if element.ObjectPlacement is not None:
+        matrix = ifcopenshell.util.placement.get_local_placement(element.ObjectPlacement)
+        digest.update(np.round(matrix, 6).tobytes())
+    return digest.hexdigest()
+
+def cache_path():
+    return os.path.join(cache_dir(), CACHE_FILE)
+
+def _connect(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute("CREATE TABLE IF NOT EXISTS quantities (key TEXT PRIMARY KEY, volume REAL, area REAL, footprint REAL, height REAL)")
+    return connection
+
+def _lookup(connection, keys):
+    found = {}
+    keys = list(keys)
+    for start in range(0, len(keys), 500):
+        batch = keys[start:start + 500]
+        rows = connection.execute(f"SELECT key, volume, area, footprint, height FROM quantities WHERE key IN ({','.join('?' * len(batch))})", batch)
+        for key, *values in rows:
+            found[key] = tuple(values)
+    return found
+
+def _quantities_chunk(ifc_file, ids, num_threads):
+    # Keys and cache lookups happen in the workers too; only cache misses are tessellated, and
+    # their number goes back with the results since workers have no metrics of their own
+    keys = {element_id: representation_key(ifc_file.by_id(element_id)) for element_id in ids}
+    connection = _connect(cache_path())
+    try:
+        cached = _lookup(connection, keys.values())
+    finally:
+        connection.close()
+    results = {element_id: cached[key] for element_id, key in keys.items() if key in cached}
+    missing = [ifc_file.by_id(element_id) for element_id in ids if element_id not in results]
+    computed = []
+    if missing:
+        for shape in iter_shapes(ifc_file, missing, num_threads):
+            quantities = mesh_quantities(shape.geometry.verts, shape.geometry.faces)
+            if quantities is not None:
+                results[shape.id] = quantities
+                computed.append((keys[shape.id],) + quantities)
+    return results, computed, len(missing)
+
+def needs_derived_quantities(element):
+    return (getattr(element, 'Representation', None) is not None
+            and not element.is_a('IfcFeatureElementSubtraction')
+            and not ifcopenshell.util.element.get_psets(element, qtos_only=True))
+
+class QuantityEngine:
+    # Volume, surface area, footprint and height in metres from tessellated body geometry, for
+    # elements exported without quantity sets. Values are kept per element for the session and
+    # on disk per representation, so unchanged elements are never tessellated twice.
+    def __init__(self, ifc_file, processes=None):
+        self.ifc_file = ifc_file
+        self.processes = processes
+        self.values = {}
+        self._unit_scales = None
+
+    def derive(self, elements):
+        pending = [e.id() for e in elements if e.id() not in self.values and needs_derived_quantities(e)]
+        if not pending:
+            return
+        for element_id in pending:
+            self.values[element_id] = None
+        computed = []
+        misses = 0
+        for results, new_rows, chunk_misses in map_product_chunks(self.ifc_file, pending, _quantities_chunk, self.processes):
+            self.values.update(results)
+            computed.extend(new_rows)
+            misses += chunk_misses
+        get_metrics().count("cache.quantities.hit", len(pending) - misses)
+        get_metrics().count("cache.quantities.miss", misses)
+        if computed:
+            connection = _connect(cache_path())
+            try:
+                with connection:
+                    connection.executemany("INSERT OR REPLACE INTO quantities VALUES (?, ?, ?, ?, ?)", computed)
+            finally:
+                connection.close()
+
+    def quantities(self, element):
+        # Only what derive() has computed; reading never tessellates
+        values = self.values.get(element.id())
+        if values is None:
+            return {}
+        return {f"{DERIVED_PREFIX}.{name}": value for name, value in zip(QUANTITY_NAMES, values)}
+
+    def unit_scales(self):
+        if self._unit_scales is None:
+            # Exported quantities are in the file's own area and volume units, which need not be
+            # its length unit squared or cubed
+            self._unit_scales = (ifcopenshell.util.unit.calculate_unit_scale(self.ifc_file),
+                                 ifcopenshell.util.unit.calculate_unit_scale(self.ifc_file, 'AREAUNIT'),
+                                 ifcopenshell.util.unit.calculate_unit_scale(self.ifc_file, 'VOLUMEUNIT'))
+        return self._unit_scales
+
+    def layer_set_area(self, element, properties):
+        # Area of the layer set in square metres: the exported side or gross area when there is
+        # one, otherwise the derived volume spread over the total layer thickness
+        length_scale, area_scale, _ = self.unit_scales()
+        for qto_name, quantity_name in LAYER_AREA_QUANTITIES:
+            area = properties.get(f"{qto_name}.{quantity_name}")
+            if area:
+                return area * area_scale
+        volume = properties.get(f"{DERIVED_PREFIX}.Volume")
+        usage = ifcopenshell.util.element.get_material(element)
+        if not volume or usage is None or not usage.is_a('IfcMaterialLayerSetUsage'):
+            return None
+        thickness = sum(layer.LayerThickness for layer in usage.ForLayerSet.MaterialLayers) * length_scale
+        return volume / thickness if thickness else None
+
+    def layer_quantities(self, element, layer, properties):
+        area = self.layer_set_area(element, properties)
+        if area is None:
+            return {}
+        return {'Area': area, 'Volume': area * layer.LayerThickness * self.unit_scales()[0]}
@@ -0,0 +1,122 @@
+from array import array
+
+CATEGORIES = ('material', 'layer set', 'property set', 'type')
+
+def _material_parts(definition):
+    # (layer set or None, materials) for whatever an IfcRelAssociatesMaterial points at
+    if definition.is_a('IfcMaterialLayerSetUsage'):
+        definition = definition.ForLayerSet
+    elif definition.is_a('IfcMaterialProfileSetUsage'):
+        definition = definition.ForProfileSet
+    if definition.is_a('IfcMaterial'):
+        return None, [definition]
+    if definition.is_a('IfcMaterialLayerSet'):
+        return definition, [layer.Material for layer in definition.MaterialLayers if layer.Material]
+    if definition.is_a('IfcMaterialLayer') or definition.is_a('IfcMaterialProfile') or definition.is_a('IfcMaterialConstituent'):
+        return None, [definition.Material] if definition.Material else []
+    if definition.is_a('IfcMaterialList'):
+        return None, list(definition.Materials)
+    if definition.is_a('IfcMaterialProfileSet'):
+        return None, [profile.Material for profile in definition.MaterialProfiles if profile.Material]
+    if definition.is_a('IfcMaterialConstituentSet'):
+        return None, [c.Material for c in definition.MaterialConstituents or () if c.Material]
+    return None, []
+
+class RelationshipIndex:
+    # Material, layer set, property set and type assignments resolved in one pass over the
+    # relationship entities, kept both ways: element -> related entities and related entity ->
+    # elements. Occurrences inherit what is assigned to their type unless they override it.
+    def __init__(self, ifc_file):
+        self.ifc_file = ifc_file
+        self.used_by = {category: {} for category in CATEGORIES}
+        self.assigned = {category: {} for category in CATEGORIES}
+        self._build()
+
+    def _link(self, category, element_id, key):
+        keys = self.assigned[category].setdefault(element_id, [])
+        if key not in keys:
+            keys.append(key)
+            self.used_by[category].setdefault(key, array('I')).append(element_id)
+
+    def _build(self):
+        occurrences = {}
+        for rel in self.ifc_file.by_type('IfcRelDefinesByType'):
+            occurrences.setdefault(rel.RelatingType.id(), []).extend(rel.RelatedObjects)
+
+        materials_by_object = {}
+        for rel in self.ifc_file.by_type('IfcRelAssociatesMaterial'):
+            layer_set, materials = _material_parts(rel.RelatingMaterial)
+            for related in rel.RelatedObjects:
+                materials_by_object.setdefault(related.id(), []).append((layer_set, materials))
+
+        psets_by_object = {}
+        for rel in self.ifc_file.by_type('IfcRelDefinesByProperties'):
+            definitions = rel.RelatingPropertyDefinition
+            # IFC4 allows a set of property set definitions on one relationship
+            for definition in definitions if isinstance(definitions, tuple) else (definitions,):
+                for related in rel.RelatedObjects:
+                    psets_by_object.setdefault(related.id(), []).append(definition)
+        for type_object in self.ifc_file.by_type('IfcTypeObject'):
+            for definition in type_object.HasPropertySets or ():
+                psets_by_object.setdefault(type_object.id(), []).append(definition)
+
+        # Type objects are not indexed themselves; their assignments go to their occurrences
+        type_ids = {type_object.id() for type_object in self.ifc_file.by_type('IfcTypeObject')}
+        for object_id, assignments in materials_by_object.items():
+            if object_id not in type_ids:
+                self._link_materials(object_id, assignments)
+        for object_id, definitions in psets_by_object.items():
+            if object_id not in type_ids:
+                for definition in definitions:
+                    self._link('property set', object_id, definition.id())
+
+        for type_id, related in occurrences.items():
+            type_materials = materials_by_object.get(type_id, ())
+            type_psets = psets_by_object.get(type_id, ())
+            for occurrence in related:
+                occurrence_id = occurrence.id()
+                self._link('type', occurrence_id, type_id)
+                if occurrence_id not in materials_by_object:
+                    self._link_materials(occurrence_id, type_materials)
+                own_names = {definition.Name for definition in psets_by_object.get(occurrence_id, ())}
+                for definition in type_psets:
+                    if definition.Name not in own_names:
+                        self._link('property set', occurrence_id, definition.id())
+
+    def _link_materials(self, object_id, assignments):
+        for layer_set, materials in assignments:
+            if layer_set is not None:
+                self._link('layer set', object_id, layer_set.id())
+            for material in materials:
+                self._link('material', object_id, material.id())
+
+    def describe(self, category, key):
+        entity = self.ifc_file.by_id(key)
+        name = getattr(entity, 'Name', None) or getattr(entity, 'LayerSetName', None) or f"#{key}"
+        return f"{entity.is_a()} {name}" if category in ('property set', 'type') else name
+
+    def entries(self, category):
+        # (key, label, element count), by label
+        entries = [(key, self.describe(category, key), len(ids)) for key, ids in self.used_by[category].items()]
+        return sorted(entries, key=lambda entry: (entry[1].lower(), entry[0]))
+
+    def find(self, category, text):
+        text = text.strip().lower()
+        if text.isdigit() and int(text) in self.used_by[category]:
+            return [int(text)]
+        return [key for key, label, _ in self.entries(category) if text in label.lower()]
+
+    def keys_of(self, category, element):
+        return list(self.assigned[category].get(element.id(), ()))
+
+    def element_ids(self, category, keys):
+        ids = set()
+        for key in keys:
+            ids.update(self.used_by[category].get(key, ()))
+        return sorted(ids)
+
+    def elements(self, category, keys):
+        return [self.ifc_file.by_id(element_id) for element_id in self.element_ids(category, keys)]
+
+    def count(self, category, keys):
+        return len(self.element_ids(category, keys))
@@ -0,0 +1,142 @@
+from array import array
+from collections import Counter
+
+SPATIAL_TYPES = ('IfcSpatialStructureElement', 'IfcSpatialElement')
+
+def is_spatial(entity):
+    return any(entity.is_a(spatial_type) for spatial_type in SPATIAL_TYPES)
+
+class SpatialNode:
+    __slots__ = ('id', 'type', 'parent', 'children', 'elements', 'histogram')
+
+    def __init__(self, entity):
+        self.id = entity.id()
+        self.type = entity.is_a()
+        self.parent = None
+        self.children = []
+        # Directly contained element ids per type; histogram counts the whole subtree
+        self.elements = {}
+        self.histogram = Counter()
+
+    def add(self, element):
+        ids = self.elements.get(element.is_a())
+        if ids is None:
+            ids = self.elements[element.is_a()] = array('I')
+        ids.append(element.id())
+
+class SpatialIndex:
+    # Project -> site -> building -> storey -> space, each with the elements contained in it.
+    # Built once from the relationship entities, so scoped queries only touch their results.
+    def __init__(self, ifc_file):
+        self.ifc_file = ifc_file
+        self.nodes = {}
+        self.roots = []
+        self.container_by_element = {}
+        self._build()
+
+    def _node(self, entity):
+        node = self.nodes.get(entity.id())
+        if node is None:
+            node = self.nodes[entity.id()] = SpatialNode(entity)
+        return node
+
+    def _build(self):
+        parts = {}
+        aggregated = []
+        for rel in self.ifc_file.by_type('IfcRelAggregates'):
+            parent = rel.RelatingObject
+            if is_spatial(parent) or parent.is_a('IfcProject'):
+                node = self._node(parent)
+                for child in rel.RelatedObjects:
+                    if is_spatial(child):
+                        child_node = self._node(child)
+                        child_node.parent = node.id
+                        node.children.append(child_node.id)
+                    else:
+                        aggregated.append((node, child))
+            else:
+                # Parts of stairs, roofs and assemblies are placed wherever their whole is contained
+                parts.setdefault(parent.id(), []).extend(rel.RelatedObjects)
+
+        for node, element in aggregated:
+            self._contain(node, element, parts)
+        for rel in self.ifc_file.by_type('IfcRelContainedInSpatialStructure'):
+            node = self._node(rel.RelatingStructure)
+            for element in rel.RelatedElements:
+                self._contain(node, element, parts)
+
+        self.roots = [node.id for node in self.nodes.values() if node.parent is None]
+        for root in self.roots:
+            self._count(self.nodes[root])
+
+    def _contain(self, node, element, parts):
+        pending = [element]
+        while pending:
+            element = pending.pop()
+            if element.id() in self.container_by_element:
+                continue
+            node.add(element)
+            self.container_by_element[element.id()] = node.id
+            pending.extend(parts.pop(element.id(), ()))
+
+    def _count(self, node):
+        histogram = Counter({element_type: len(ids) for element_type, ids in node.elements.items()})
+        for child in node.children:
+            histogram.update(self._count(self.nodes[child]))
+        node.histogram = histogram
+        return histogram
+
+    def walk(self, node_id=None):
+        stack = [(0, self.nodes[node_id])] if node_id is not None else [(0, self.nodes[r]) for r in reversed(self.roots)]
+        while stack:
+            depth, node = stack.pop()
+            yield depth, node
+            stack.extend((depth + 1, self.nodes[child]) for child in reversed(node.children))
+
+    def describe(self, node_id):
+        entity = self.ifc_file.by_id(node_id)
+        name = entity.Name or getattr(entity, 'LongName', None) or f"#{node_id}"
+        return f"{entity.is_a()} {name}"
+
+    def path(self, node_id):
+        names = []
+        while node_id is not None:
+            names.append(self.describe(node_id))
+            node_id = self.nodes[node_id].parent
+        return " / ".join(reversed(names))
+
+    def storeys(self):
+        return [node for _, node in self.walk() if node.type == 'IfcBuildingStorey']
+
+    def find_nodes(self, text):
+        text = text.strip().lower()
+        if text.isdigit() and int(text) in self.nodes:
+            return [self.nodes[int(text)]]
+        return [node for _, node in self.walk() if text in self.describe(node.id).lower()]
+
+    def matching_types(self, node_id, text):
+        types = sorted(self.nodes[node_id].histogram)
+        if text in types:
+            return [text]
+        return [t for t in types if text.lower() in t.lower()]
+
+    def element_ids(self, node_id, types=None, recursive=True):
+        nodes = (node for _, node in self.walk(node_id)) if recursive else [self.nodes[node_id]]
+        ids = array('I')
+        for node in nodes:
+            for element_type, element_ids in node.elements.items():
+                if types is None or element_type in types:
+                    ids.extend(element_ids)
+        return ids
+
+    def elements(self, node_id, types=None, recursive=True):
+        return [self.ifc_file.by_id(element_id) for element_id in self.element_ids(node_id, types, recursive)]
+
+    def count(self, node_id, types=None):
+        histogram = self.nodes[node_id].histogram
+        if types is None:
+            return sum(histogram.values())
+        return sum(histogram[t] for t in types)
+
+    def container_of(self, element):
+        return self.container_by_element.get(element.id())
@@ -0,0 +1,346 @@
+import os
+import sys
+import csv
+import json
+import math
+import time
+import argparse
+import functools
+from collections import Counter
+import ifcopenshell
+from ifc_spatial_index import SpatialIndex
+from ifc_relationship_index import RelationshipIndex
+from ifc_worker_pool import worker_model, worker_pool
+
+SEVERITIES = ('error', 'warning', 'info')
+CHUNKS_PER_WORKER = 4
+PARALLEL_THRESHOLD = 2000
+DEFAULT_RULES = [
+    {"id": "unique-global-id", "check": "unique_global_id", "severity": "error"},
+    {"id": "layer-thickness", "check": "layer_thickness", "min": 0, "severity": "error"},
+    {"id": "storey-containment", "check": "contained_in", "applies_to": "IfcElement",
+     "exclude": ["IfcFeatureElementSubtraction"], "container": "IfcBuildingStorey", "severity": "warning"},
+    {"id": "wall-fire-rating", "check": "required_property", "applies_to": "IfcWall",
+     "pset": "Pset_WallCommon", "property": "FireRating", "severity": "warning"},
+    {"id": "element-name", "check": "required_attribute", "applies_to": "IfcElement",
+     "exclude": ["IfcFeatureElementSubtraction"], "attribute": "Name", "severity": "info"},
+]
+
+class ValidationError(Exception):
+    pass
+
+def load_rules(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        rules = json.load(f)
+    if isinstance(rules, dict):
+        rules = rules.get('rules', [])
+    if not isinstance(rules, list):
+        raise ValidationError("Expected a list of rules, or an object with a 'rules' list")
+    return rules
+
+def _property_value(prop):
+    value = getattr(prop, 'NominalValue', None)
+    if value is not None:
+        return value.wrappedValue
+    # Quantities keep their value in the attribute after the unit
+    return prop[3] if prop.is_a('IfcPhysicalSimpleQuantity') else None
+
+class Check:
+    # One compiled rule. check_element returns an issue message or None; model-level rules
+    # override check_model instead and are run once, outside the element pass.
+    element_level = True
+    needs_properties = False
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.id = rule.get('id') or rule['check']
+        self.severity = rule.get('severity', 'error')
+        if self.severity not in SEVERITIES:
+            raise ValidationError(f"Rule {self.id}: severity must be one of {', '.join(SEVERITIES)}")
+        self.applies_to = rule.get('applies_to', 'IfcElement')
+        self.exclude = tuple(rule.get('exclude', ()))
+
+    def applies(self, element):
+        return element.is_a(self.applies_to) and not any(element.is_a(t) for t in self.exclude)
+
+    def prepare(self, validator):
+        pass
+
+class RequiredProperty(Check):
+    needs_properties = True
+
+    def __init__(self, rule):
+        super().__init__(rule)
+        if not rule.get('pset') or not rule.get('property'):
+            raise ValidationError(f"Rule {self.id}: 'pset' and 'property' are required")
+        self.pset = rule['pset']
+        self.property = rule['property']
+        self.values = rule.get('values')
+
+    def check_element(self, element, validator):
+        properties = validator.properties(element).get(self.pset, {})
+        if self.property not in properties or properties[self.property] in (None, ''):
+            return f"Missing {self.pset}.{self.property}"
+        if self.values is not None and properties[self.property] not in self.values:
+            return f"{self.pset}.{self.property} is {properties[self.property]!r}, expected one of {self.values}"
+        return None
+
+class RequiredAttribute(Check):
+    def __init__(self, rule):
+        super().__init__(rule)
+        if not rule.get('attribute'):
+            raise ValidationError(f"Rule {self.id}: 'attribute' is required")
+        self.attribute = rule['attribute']
+
+    def check_element(self, element, validator):
+        if getattr(element, self.attribute, None) in (None, ''):
+            return f"{self.attribute} is empty"
+        return None
+
+class LayerThickness(Check):
+    def __init__(self, rule):
+        super().__init__(rule)
+        self.minimum = rule.get('min', 0)
+
+    def check_element(self, element, validator):
+        thin = []
+        for layer_set_id in validator.relationships.assigned['layer set'].get(element.id(), ()):
+            thin.extend(validator.thin_layers(layer_set_id, self.minimum))
+        if thin:
+            return f"Layers no thicker than {self.minimum}: {', '.join(thin)}"
+        return None
+
+class ContainedIn(Check):
+    def __init__(self, rule):
+        super().__init__(rule)
+        self.container = rule.get('container', 'IfcBuildingStorey')
+        self.inside = set()
+
+    def prepare(self, validator):
+        # Spatial nodes that are, or are nested in, a container of the required type; worked
+        # out afresh for each run, since the same checks can validate another model or version
+        index = validator.spatial
+        self.inside = set()
+        for _, node in index.walk():
+            parent = index.nodes[node.parent] if node.parent is not None else None
+            if index.ifc_file.by_id(node.id).is_a(self.container) or (parent is not None and parent.id in self.inside):
+                self.inside.add(node.id)
+
+    def check_element(self, element, validator):
+        container = validator.spatial.container_of(element)
+        if container is None:
+            return "Not contained in the spatial structure"
+        if container not in self.inside:
+            return f"Not contained in any {self.container}"
+        return None
+
+class UniqueGlobalId(Check):
+    element_level = False
+
+    def check_model(self, validator):
+        counts = Counter(entity.GlobalId for entity in validator.ifc_file.by_type('IfcRoot'))
+        duplicates = {global_id for global_id, count in counts.items() if count > 1}
+        for entity in validator.ifc_file.by_type('IfcRoot'):
+            if entity.GlobalId in duplicates:
+                yield entity, f"GlobalId {entity.GlobalId} is used by {counts[entity.GlobalId]} entities"
+
+CHECKS = {
+    'required_property': RequiredProperty,
+    'required_attribute': RequiredAttribute,
+    'layer_thickness': LayerThickness,
+    'contained_in': ContainedIn,
+    'unique_global_id': UniqueGlobalId,
+}
+
+def compile_rules(rules):
+    checks = []
+    for rule in rules:
+        if not isinstance(rule, dict):
+            raise ValidationError(f"Each rule must be an object, not {rule!r}")
+        kind = CHECKS.get(rule.get('check'))
+        if kind is None:
+            raise ValidationError(f"Unknown check '{rule.get('check')}' in rule {rule.get('id')}; use one of {', '.join(CHECKS)}")
+        checks.append(kind(rule))
+    return checks
+
+class ValidationReport:
+    def __init__(self, source, rules, issues, elements, elapsed):
+        self.source = source
+        self.rules = rules
+        self.issues = issues
+        self.elements = elements
+        self.elapsed = elapsed
+
+    def counts(self):
+        return Counter(issue['Severity'] for issue in self.issues)
+
+    def by_rule(self):
+        return Counter(issue['Rule'] for issue in self.issues)
+
+    def passed(self):
+        return not self.counts()['error']
+
+    def to_dict(self):
+        return {'source': self.source, 'elements': self.elements, 'elapsed': round(self.elapsed, 3),
+                'counts': dict(self.counts()), 'rules': dict(self.by_rule()), 'issues': self.issues}
+
+class ModelValidator:
+    # Rules are compiled into checks grouped by entity class, then evaluated in a single pass
+    # over the elements. Property sets are read once each through the relationship index, and
+    # containment comes from the spatial index, so no check walks the model on its own.
+    def __init__(self, ifc_file, rules=None, spatial=None, relationships=None, processes=None):
+        self.ifc_file = ifc_file
+        self.checks = compile_rules(DEFAULT_RULES if rules is None else rules)
+        self.spatial = spatial or SpatialIndex(ifc_file)
+        self.relationships = relationships or RelationshipIndex(ifc_file)
+        self.processes = processes
+        self._checks_by_class = {}
+        self._psets = {}
+        self._layer_sets = {}
+        self._property_names = {c.pset for c in self.checks if c.needs_properties}
+
+    def checks_for(self, element):
+        # is_a depends only on the class, so applicability is worked out once per class
+        checks = self._checks_by_class.get(element.is_a())
+        if checks is None:
+            checks = self._checks_by_class[element.is_a()] = [c for c in self.checks if c.element_level and c.applies(element)]
+        return checks
+
+    def properties(self, element):
+        properties = {}
+        for pset_id in self.relationships.assigned['property set'].get(element.id(), ()):
+            values = self._psets.get(pset_id)
+            if values is None:
+                pset = self.ifc_file.by_id(pset_id)
+                values = self._psets[pset_id] = (pset.Name, self._pset_values(pset) if pset.Name in self._property_names else {})
+            properties[values[0]] = values[1]
+        return properties
+
+    @staticmethod
+    def _pset_values(pset):
+        if pset.is_a('IfcPropertySet'):
+            return {p.Name: _property_value(p) for p in pset.HasProperties}
+        if pset.is_a('IfcElementQuantity'):
+            return {q.Name: _property_value(q) for q in pset.Quantities}
+        return {}
+
+    def thin_layers(self, layer_set_id, minimum):
+        key = (layer_set_id, minimum)
+        if key not in self._layer_sets:
+            layer_set = self.ifc_file.by_id(layer_set_id)
+            self._layer_sets[key] = [f"{layer.Material.Name if layer.Material else '(no material)'} ({layer.LayerThickness})"
+                                     for layer in layer_set.MaterialLayers if (layer.LayerThickness or 0) <= minimum]
+        return self._layer_sets[key]
+
+    def validate_ids(self, ids):
+        issues = []
+        for element_id in ids:
+            element = self.ifc_file.by_id(element_id)
+            for check in self.checks_for(element):
+                message = check.check_element(element, self)
+                if message:
+                    issues.append((check.id, element_id, message))
+        return issues
+
+    def run(self, source=None):
+        start = time.perf_counter()
+        for check in self.checks:
+            check.prepare(self)
+        ids = [e.id() for e in self.ifc_file.by_type('IfcElement') if self.checks_for(e)]
+        processes = self.processes or os.cpu_count() or 1
+        if processes > 1 and len(ids) >= PARALLEL_THRESHOLD:
+            # Forked workers share the indexes built here; others build their own from the model
+            size = max(1, math.ceil(len(ids) / (processes * CHUNKS_PER_WORKER)))
+            setup = functools.partial(_worker_validator, [check.rule for check in self.checks])
+            with worker_pool(self.ifc_file, processes, self, setup) as pool:
+                chunks = pool.map(_validate_chunk, [ids[i:i + size] for i in range(0, len(ids), size)])
+        else:
+            chunks = [self.validate_ids(ids)]
+
+        severities = {check.id: check.severity for check in self.checks}
+        issues = []
+        for check in self.checks:
+            if not check.element_level:
+                issues.extend(self._issue(check.id, check.severity, entity, message) for entity, message in check.check_model(self))
+        for chunk in chunks:
+            for rule_id, element_id, message in chunk:
+                issues.append(self._issue(rule_id, severities[rule_id], self.ifc_file.by_id(element_id), message))
+        issues.sort(key=lambda issue: (SEVERITIES.index(issue['Severity']), issue['Rule'], issue['ID']))
+        return ValidationReport(source, [c.rule for c in self.checks], issues, len(ids), time.perf_counter() - start)
+
+    @staticmethod
+    def _issue(rule_id, severity, entity, message):
+        return {'Severity': severity, 'Rule': rule_id, 'ID': entity.id(), 'GlobalId': getattr(entity, 'GlobalId', None),
+                'Type': entity.is_a(), 'Name': getattr(entity, 'Name', None), 'Message': message}
+
+def _worker_validator(rules, ifc_file):
+    validator = ModelValidator(ifc_file, rules)
+    for check in validator.checks:
+        check.prepare(validator)
+    return validator
+
+def _validate_chunk(ids):
+    return worker_model().validate_ids(ids)
+
+def validate_file(path, rules=None, processes=None):
+    return ModelValidator(ifcopenshell.open(path), rules, processes=processes).run(source=path)
+
+def print_report(report, limit=50):
+    from tabulate import tabulate
+    counts = report.counts()
+    print(f"{report.source or 'Model'}: {counts['error']} errors, {counts['warning']} warnings, {counts['info']} notes "
+          f"in {report.elements} elements ({report.elapsed:.2f}s)")
+    for rule_id, count in sorted(report.by_rule().items()):
+        print(f"  {rule_id}: {count}")
+    rows = [[i['Severity'], i['Rule'], i['ID'], i['Type'], i['Name'], i['Message']] for i in report.issues[:limit]]
+    if rows:
+        print(tabulate(rows, headers=["Severity", "Rule", "ID", "Type", "Name", "Message"], tablefmt="grid"))
+    if limit and len(report.issues) > limit:
+        print(f"... and {len(report.issues) - limit} more")
+
+def write_report(reports, path):
+    if path.lower().endswith('.csv'):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=['File', 'Severity', 'Rule', 'ID', 'GlobalId', 'Type', 'Name', 'Message'])
+            writer.writeheader()
+            for report in reports:
+                for issue in report.issues:
+                    writer.writerow({'File': report.source, **issue})
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump([report.to_dict() for report in reports], f, indent=2, default=str)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check IFC files against a set of validation rules.")
+    parser.add_argument("files", nargs='+')
+    parser.add_argument("--rules", metavar="PATH", help="JSON list of rules (defaults to the built-in rule set)")
+    parser.add_argument("--output", metavar="PATH", help="Write all issues to PATH as JSON, or CSV for a .csv path")
+    parser.add_argument("--processes", type=int, help="Worker processes per file")
+    parser.add_argument("--quiet", action="store_true", help="Only print the summary line for each file")
+    args = parser.parse_args(argv)
+
+    rules = None
+    if args.rules:
+        try:
+            rules = load_rules(args.rules)
+            compile_rules(rules)
+        except (OSError, ValueError, ValidationError) as e:
+            print(f"Invalid rules file: {e}")
+            return 2
+    reports = []
+    for path in args.files:
+        try:
+            report = validate_file(path, rules, args.processes)
+        except (OSError, RuntimeError) as e:
+            print(f"Could not validate {path}: {e}")
+            continue
+        reports.append(report)
+        print_report(report, limit=0 if args.quiet else 50)
+    if args.output:
+        write_report(reports, args.output)
+        print(f"Report written to {args.output}")
+    # Non-zero when any file has errors or could not be read, for use in scripts and CI
+    return 0 if len(reports) == len(args.files) and all(r.passed() for r in reports) else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,231 @@
+import os
+import re
+import ifcopenshell
+from ifc_changeset import bytes_fingerprint
+from ifc_journal import encode_value, decode_value
+
+# One entity instance: '#12=IFCWALL(...);', possibly over several lines, ending at the first
+# ');' that closes a line
+INSTANCE = re.compile(rb"^[ \t]*#(\d+)[ \t]*=[ \t]*(\w+)[ \t]*\(.*?\)[ \t]*;[ \t\r]*$", re.M | re.S)
+REFERENCE = re.compile(rb"#(\d+)")
+SCHEMA = re.compile(rb"FILE_SCHEMA\s*\(\s*\(\s*'([^']*)'")
+# Past this share of changed instances, reading the whole file again and rebuilding every
+# index is quicker
+REPARSE_FRACTION = 0.25
+STRUCTURE_TYPES = ('IFCRELAGGREGATES', 'IFCRELCONTAINEDINSPATIALSTRUCTURE')
+
+def _find(ifc_file, entity_id):
+    try:
+        return ifc_file.by_id(entity_id)
+    except RuntimeError:
+        return None
+
+def _decode(data):
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('latin-1')
+
+class FileChanges:
+    # The instance lines of a new version of the file that differ from the snapshot (or that
+    # the caller asked for), and the ids that are gone from it
+    def __init__(self, stat, fingerprint, schema, hashes, header, statements, removed, full):
+        self.stat = stat
+        self.fingerprint = fingerprint
+        self.schema = schema
+        self.hashes = hashes
+        self.header = header
+        self.statements = statements
+        self.removed = removed
+        self.full = full
+        self.affected = set()
+        self.seconds = None
+
+    def summary(self):
+        if self.full:
+            return f"Reloaded the whole file in {self.seconds:.2f} s"
+        return (f"Re-read {len(self.statements)} changed and {len(self.removed)} removed entities "
+                f"affecting {len(self.affected)} elements in {self.seconds:.2f} s")
+
+class FileWatcher:
+    # Size, mtime and content hash of the file the model was read from, and a hash of each of
+    # its entity lines, so a new version can be compared line by line instead of reloaded
+    def __init__(self, path):
+        self.path = path
+        self.stat = None
+        self.fingerprint = None
+        self.schema = None
+        self.hashes = None
+        self.dismissed = None
+        self.rescan()
+
+    def _stat(self):
+        stat = os.stat(self.path)
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def rescan(self):
+        # After a save: the file on disk is the model again
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        self.stat = self._stat()
+        self.fingerprint = bytes_fingerprint(data)
+        self.schema = _schema(data)
+        self.hashes = {int(m.group(1)): hash(m.group(0)) for m in INSTANCE.finditer(data)}
+        self.dismissed = None
+
+    def modified(self):
+        # Only a stat call; poll compares contents
+        try:
+            stat = self._stat()
+        except OSError:
+            return False
+        return stat != self.stat and stat != self.dismissed
+
+    def dismiss(self):
+        # The user kept their edits: stay quiet until the file changes again
+        self.dismissed = self._stat()
+
+    def poll(self, local_ids=()):
+        # None if the contents are unchanged. local_ids are entities edited in memory since the
+        # snapshot; their lines are returned too so the model ends up equal to the file.
+        stat = self._stat()
+        if stat == self.stat:
+            return None
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        fingerprint = bytes_fingerprint(data)
+        if fingerprint == self.fingerprint:
+            self.stat = stat
+            return None
+        schema = _schema(data)
+        header = data[:data.find(b'DATA;')]
+        previous = self.hashes
+        hashes = {}
+        statements = {}
+        for match in INSTANCE.finditer(data):
+            entity_id = int(match.group(1))
+            line_hash = hashes[entity_id] = hash(match.group(0))
+            if previous is None or previous.get(entity_id) != line_hash or entity_id in local_ids:
+                statements[entity_id] = (match.group(2).decode('ascii'), match.group(0))
+        full = (previous is None or schema != self.schema or not hashes
+                or len(statements) > REPARSE_FRACTION * len(hashes))
+        if full:
+            return FileChanges(stat, fingerprint, schema, hashes, header, {}, set(), True)
+        removed = {entity_id for entity_id in previous if entity_id not in hashes}
+        removed.update(entity_id for entity_id in local_ids if entity_id not in hashes)
+        return FileChanges(stat, fingerprint, schema, hashes, header, statements, removed, False)
+
+    def accept(self, changes):
+        self.stat = changes.stat
+        self.fingerprint = changes.fingerprint
+        self.schema = changes.schema
+        self.hashes = changes.hashes
+        self.dismissed = None
+
+def _schema(data):
+    match = SCHEMA.search(data, 0, data.find(b'DATA;'))
+    return match.group(1).decode('ascii') if match else None
+
+def _references(statement):
+    # Splitting on quotes skips '#12' inside strings
+    parts = statement.split(b"'")
+    return {int(r) for part in parts[::2] for r in REFERENCE.findall(part)}
+
+def _placeholder(entity):
+    # Stands in for an unchanged entity so references to it survive parsing the fragment
+    return f"#{entity.id()}={entity.is_a().upper()}({','.join('$' * len(entity))});".encode('ascii')
+
+def dependent_products(ifc_file, entity_ids):
+    # Products whose properties, layers, placement or containment read any of the entities:
+    # found through inverse references, stopping at products and at relationships, whose
+    # related products are taken instead of walking on to everything else they touch. The
+    # second set holds those whose own line, placement or representation is involved.
+    products = set()
+    geometric = set()
+    seen = set()
+    pending = [(e, None) for e in (_find(ifc_file, i) for i in entity_ids) if e is not None]
+    while pending:
+        entity, via = pending.pop()
+        if entity.is_a('IfcProduct'):
+            products.add(entity.id())
+            if via is None or via == entity.ObjectPlacement or via == entity.Representation:
+                geometric.add(entity.id())
+            continue
+        if entity.id() in seen:
+            continue
+        seen.add(entity.id())
+        if entity.is_a('IfcRelationship'):
+            for value in entity:
+                for related in value if isinstance(value, tuple) else (value,):
+                    if isinstance(related, ifcopenshell.entity_instance) and related.id() and related.is_a('IfcProduct'):
+                        products.add(related.id())
+            if entity.is_a('IfcRelVoidsElement'):
+                geometric.add(entity.RelatingBuildingElement.id())
+        else:
+            pending.extend((inverse, entity) for inverse in ifc_file.get_inverse(entity))
+    return products, geometric
+
+def apply_file_changes(ifc_file, changes):
+    # Re-reads only the changed lines: they are parsed as a small file of their own, with
+    # placeholders for what they refer to, and their attribute values copied onto the model.
+    # Returns the products to re-index, those whose geometry may have changed and whether the
+    # spatial structure may have.
+    statements = changes.statements
+    existing = {entity_id: _find(ifc_file, entity_id) for entity_id in statements}
+    retyped = [entity_id for entity_id, entity in existing.items()
+               if entity is not None and entity.is_a().upper() != statements[entity_id][0].upper()]
+    removed = [entity_id for entity_id in sorted(changes.removed) if _find(ifc_file, entity_id) is not None]
+    # Containment only changes with its relationships or with products added, removed or retyped
+    structural = any(entity_type.upper() in STRUCTURE_TYPES for entity_type, _ in statements.values())
+    structural = structural or any(ifc_file.by_id(entity_id).is_a('IfcProduct') or ifc_file.by_id(entity_id).is_a().upper() in STRUCTURE_TYPES
+                                   for entity_id in [*retyped, *removed])
+
+    # Products that read the old values
+    affected, geometric = dependent_products(ifc_file, [*statements, *removed])
+
+    # An entity whose type changed is replaced; unchanged lines that refer to it get the reference back
+    restore = {}
+    for entity_id in retyped:
+        entity = ifc_file.by_id(entity_id)
+        for referrer in ifc_file.get_inverse(entity):
+            if referrer.id() not in statements:
+                restore[referrer.id()] = [encode_value(v) for v in referrer]
+        ifc_file.remove(entity)
+    for entity_id, (entity_type, _) in sorted(statements.items()):
+        if existing[entity_id] is None or entity_id in retyped:
+            structural = ifc_file.create_entity(entity_type, id=entity_id).is_a('IfcProduct') or structural
+
+    referenced = set()
+    for _, statement in statements.values():
+        referenced.update(_references(statement))
+    placeholders = [_placeholder(entity) for entity in (_find(ifc_file, entity_id) for entity_id in sorted(referenced - statements.keys()))
+                    if entity is not None]
+    lines = [statement for _, statement in statements.values()]
+    fragment = ifcopenshell.file.from_string(_decode(changes.header + b"DATA;\n" + b"\n".join(lines + placeholders)
+                                                     + b"\nENDSEC;\nEND-ISO-10303-21;\n"))
+
+    for entity_id in statements:
+        entity = ifc_file.by_id(entity_id)
+        for index, value in enumerate(fragment.by_id(entity_id)):
+            value = encode_value(value)
+            if value != encode_value(entity[index]):
+                setattr(entity, entity.attribute_name(index), decode_value(ifc_file, value))
+    for entity_id, values in restore.items():
+        entity = ifc_file.by_id(entity_id)
+        for index, value in enumerate(values):
+            if value is not None:
+                setattr(entity, entity.attribute_name(index), decode_value(ifc_file, value))
+
+    # Products that read the new values
+    for before, after in zip((affected, geometric), dependent_products(ifc_file, statements)):
+        before.update(after)
+    for entity_id in removed:
+        ifc_file.remove(ifc_file.by_id(entity_id))
+    changes.affected = affected
+    return affected, geometric, structural
+
+def edited_ids(changes, ifc_file):
+    # Entities changed or created in memory since the model was read, from its change tracker
+    ids = set(changes.modified_ids)
+    ids.update(range(changes.base_max_id + 1, ifc_file.get_max_id() + 1))
+    return ids
@@ -0,0 +1,59 @@
+import threading
+import contextlib
+import multiprocessing
+from multiprocessing import shared_memory
+import ifcopenshell
+
+# Imported once by the fork server, so the workers it starts do not import them again
+PRELOAD_MODULES = ['ifcopenshell', 'ifcopenshell.geom', 'numpy']
+
+# In a worker: what its tasks read the model through
+_worker_model = None
+
+def fork_safe():
+    # A forked child only has the thread that forked; locks held by any other thread stay held
+    return 'fork' in multiprocessing.get_all_start_methods() and threading.active_count() == 1
+
+def worker_model():
+    return _worker_model
+
+def _load_model(name, size, setup):
+    global _worker_model
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        data = bytes(block.buf[:size]).decode('utf-8')
+    finally:
+        block.close()
+    ifc_file = ifcopenshell.file.from_string(data)
+    _worker_model = setup(ifc_file) if setup is not None else ifc_file
+
+@contextlib.contextmanager
+def worker_pool(ifc_file, processes, shared=None, setup=None):
+    # A process pool whose tasks read the model through worker_model(). A process that has no
+    # other threads forks, and workers read shared (the file itself by default) copy-on-write.
+    # Otherwise workers start from a fork server and parse the model, unsaved edits included,
+    # from one shared memory block; setup, a picklable callable, then turns the parsed file
+    # into what the tasks read.
+    global _worker_model
+    if fork_safe():
+        _worker_model = ifc_file if shared is None else shared
+        try:
+            with multiprocessing.get_context('fork').Pool(processes) as pool:
+                yield pool
+        finally:
+            _worker_model = None
+        return
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(PRELOAD_MODULES)
+    else:
+        context = multiprocessing.get_context('spawn')
+    data = ifc_file.to_string().encode('utf-8')
+    block = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    try:
+        block.buf[:len(data)] = data
+        with context.Pool(processes, initializer=_load_model, initargs=(block.name, len(data), setup)) as pool:
+            yield pool
+    finally:
+        block.close()
+        block.unlink()
@@ -0,0 +1,318 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict
+from datetime import datetime, timezone
+from benchmark_ifc_viewer_editor import RESULTS_DIR, git_commit, peak_rss_mb
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit_ifc_viewer_editor_fine.py")
+DEFAULT_MODEL = "Duplex_A.ifc"
+DEFAULT_SESSIONS = [1, 10, 30]
+DEFAULT_ITERATIONS = 3
+DEFAULT_ELEMENT_TYPE = "IfcWallStandardCase"
+DEFAULT_SELECTION = 10
+PERCENTILES = [50, 90, 95, 99]
+# How often a session waiting for its export clicks Refresh, like a user would
+EXPORT_POLL_SECONDS = 0.2
+RUN_TIMEOUT = 600
+READY = "ready"
+
+def current_rss_mb():
+    # Resident set size right now; peak RSS never goes down, so it cannot separate phases
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+def percentile(values, p):
+    # Nearest-rank percentile of an unsorted list
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, -(-len(ordered) * p // 100) - 1))]
+
+def pin_to_cores(cores):
+    # All sessions share the same cores, so a session only runs while the others wait, as
+    # they would for the interpreter lock of the one server process that hosts them all
+    if cores and hasattr(os, "sched_getaffinity"):
+        os.sched_setaffinity(0, sorted(os.sched_getaffinity(0))[:cores])
+
+class SimulatedSession:
+    # One browser tab: AppTest script runs with their own session state and a copy of the model
+    # parsed from the bytes of the file, as the upload handler does. Each rerun a user would
+    # trigger is timed under the page function it exercises.
+    def __init__(self, number, model_path, workdir, args):
+        self.number = number
+        self.model_path = model_path
+        self.workdir = workdir
+        self.args = args
+        self.latencies = defaultdict(list)
+        self.errors = []
+        self.app = None
+
+    def open(self):
+        from streamlit.testing.v1 import AppTest
+        from streamlit_ifc_viewer_editor_fine import IFCViewerEditor
+        from ifc_async_executor import AsyncModelExecutor
+        from ifc_ingest import open_ifc_buffer
+
+        def upload():
+            with open(self.model_path, "rb") as f:
+                ifc_file = open_ifc_buffer(f)
+            workspace = os.path.join(self.workdir, f"session_{self.number}")
+            os.makedirs(workspace, exist_ok=True)
+            viewer_editor = IFCViewerEditor(os.path.join(workspace, os.path.basename(self.model_path)), ifc_file)
+            self.app = AppTest.from_file(APP_PATH, default_timeout=RUN_TIMEOUT)
+            self.app.session_state["viewer_editor"] = viewer_editor
+            self.app.session_state["executor"] = AsyncModelExecutor(viewer_editor)
+            self.app.session_state["selected_elements"] = []
+            self.app.run()
+        self.timed("upload", upload)
+
+    def timed(self, name, action):
+        started = time.perf_counter()
+        try:
+            action()
+        except Exception as e:
+            self.errors.append(f"{name}: {type(e).__name__}: {e}")
+            raise
+        self.latencies[name].append(time.perf_counter() - started)
+        if self.app is not None and self.app.exception:
+            self.errors.append(f"{name}: {self.app.exception[0].message}")
+            raise RuntimeError(self.app.exception[0].message)
+        if self.args.think:
+            time.sleep(self.args.think)
+
+    def rerun(self, name, widget=None):
+        self.timed(name, (widget or self.app).run)
+
+    def widget(self, kind, label):
+        # Looked up again after every rerun, by label, since positions change between pages
+        for widget in getattr(self.app, kind):
+            if widget.label == label:
+                return widget
+        raise RuntimeError(f"No '{label}' {kind} on the page")
+
+    def button(self, label):
+        return self.widget("button", label).click()
+
+    def page(self, name, command):
+        self.rerun(name, self.app.sidebar.selectbox[0].set_value(command))
+
+    def select_elements(self):
+        self.page("select_elements", "Select")
+        self.app.text_input[0].input(self.args.element_type)
+        self.rerun("select_elements", self.button("Next"))
+        # The app moves to the next step on the rerun after the click
+        self.rerun("select_elements")
+        if self.app.text_input:
+            matches = [m.value.split(". ", 1)[1] for m in self.app.markdown if ". " in m.value]
+            self.app.text_input[0].input(str(matches.index(self.args.element_type) + 1))
+            self.rerun("select_elements", self.button("Next"))
+            self.rerun("select_elements")
+        self.rerun("select_elements", self.widget("checkbox", "Select multiple elements?").check())
+        indices = self.widget("multiselect", "Select elements by index:")
+        self.rerun("select_elements", indices.set_value([int(o) for o in indices.options[:self.args.selection]]))
+        self.rerun("select_elements", self.button("Confirm Selection"))
+
+    def show_properties(self):
+        self.page("show_properties", "Properties")
+        self.page("show_properties", "Layers")
+
+    def update_property(self, iteration):
+        self.page("update_property", "Update")
+        element_box = self.widget("selectbox", "Select element to update")
+        self.rerun("update_property", element_box.set_value(element_box.options[iteration % len(element_box.options)]))
+        self.rerun("update_property", self.widget("selectbox", "Select property to update").set_value(self.args.property))
+        self.widget("text_input", "Enter new value").input(f"Load test {self.number}.{iteration}")
+        self.rerun("update_property", self.button("Update Property"))
+
+    def export_data(self):
+        self.page("export_data", "Export")
+        self.widget("radio", "Export mode").set_value("Collectively" if self.args.collective else "Separately")
+        self.rerun("export_data", self.button("Export"))
+        # Until the download appears, as seen by a user who keeps clicking Refresh
+        started = time.perf_counter()
+        while any(button.label == "Refresh" for button in self.app.button):
+            time.sleep(EXPORT_POLL_SECONDS)
+            self.rerun("export_data", self.button("Refresh"))
+        self.latencies["export_ready"].append(time.perf_counter() - started)
+        if not self.app.get("download_button"):
+            raise RuntimeError("The export finished without a download")
+
+    def run(self):
+        try:
+            for iteration in range(self.args.iterations):
+                self.select_elements()
+                self.show_properties()
+                self.update_property(iteration)
+                self.export_data()
+        except Exception as e:
+            if not self.errors:
+                self.errors.append(f"{type(e).__name__}: {e}")
+
+    def close(self):
+        if self.app is not None and "executor" in self.app.session_state:
+            self.app.session_state["executor"].shutdown()
+
+def session_worker(args):
+    # AppTest swaps process-wide runtime state on every run, so sessions cannot share a
+    # process; each one is a worker that uploads, reports ready and waits for the start signal
+    pin_to_cores(args.cores)
+    import streamlit.testing.v1
+    import streamlit_ifc_viewer_editor_fine
+    rss_start = current_rss_mb()
+    session = SimulatedSession(args.session, args.model, args.workdir, args)
+    try:
+        session.open()
+    except Exception:
+        # Already in session.errors; the session reports it without running
+        pass
+    rss_loaded = current_rss_mb()
+    print(READY, flush=True)
+    sys.stdin.readline()
+    started = time.perf_counter()
+    if not session.errors:
+        session.run()
+    seconds = time.perf_counter() - started
+    rss_end = current_rss_mb()
+    session.close()
+    print(json.dumps({"seconds": seconds, "latencies": session.latencies, "errors": session.errors,
+                      "rss_mb": {"start": rss_start, "loaded": rss_loaded, "end": rss_end, "peak": peak_rss_mb()}}))
+    return 0
+
+def run_load(sessions, argv, args):
+    workdir = tempfile.mkdtemp(prefix="ifc_load_test_")
+    workers = []
+    try:
+        for number in range(sessions):
+            log = open(os.path.join(workdir, f"session_{number}.log"), "w+")
+            process = subprocess.Popen([sys.executable, os.path.abspath(__file__), *argv, "--session", str(number), "--workdir", workdir],
+                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=log, text=True)
+            workers.append((process, log))
+        # Every tab uploads and renders its first page before the workload starts
+        for process, _ in workers:
+            for line in process.stdout:
+                if line.strip() == READY:
+                    break
+        started = time.perf_counter()
+        for process, _ in workers:
+            process.stdin.write("go\n")
+            process.stdin.flush()
+        results = []
+        for number, (process, log) in enumerate(workers):
+            output = process.stdout.read()
+            process.wait()
+            if process.returncode != 0 or not output.strip():
+                log.seek(0)
+                lines = log.read().strip().splitlines()
+                results.append({"errors": [f"session {number}: {lines[-1] if lines else f'exited with {process.returncode}'}"],
+                                "latencies": {}, "rss_mb": None})
+            else:
+                results.append(json.loads(output.strip().splitlines()[-1]))
+        seconds = time.perf_counter() - started
+    finally:
+        for process, log in workers:
+            if process.poll() is None:
+                process.kill()
+            log.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = defaultdict(list)
+    for result in results:
+        for name, values in result["latencies"].items():
+            latencies[name].extend(values)
+    upload = latencies.pop("upload", [])
+    interactions = sum(len(values) for name, values in latencies.items() if name != "export_ready")
+    memory = [result["rss_mb"] for result in results if result["rss_mb"]]
+    return {
+        "sessions": sessions,
+        "iterations": args.iterations,
+        "seconds": round(seconds, 3),
+        "upload_seconds": round(sum(upload) / len(upload), 3) if upload else None,
+        "interactions": interactions,
+        "interactions_per_second": round(interactions / seconds, 2) if seconds > 0 else None,
+        "scenarios_per_minute": round(60 * sessions * args.iterations / seconds, 2) if seconds > 0 else None,
+        # What each session adds to the server: its model, session state and caches
+        "mb_per_session": round(sum(m["end"] - m["start"] for m in memory) / len(memory), 1) if memory else None,
+        "peak_session_mb": round(max(m["peak"] - m["start"] for m in memory), 1) if memory else None,
+        "errors": [error for result in results for error in result["errors"]],
+        "latency": {name: {"count": len(values), "mean": round(sum(values) / len(values), 4),
+                           **{f"p{p}": round(percentile(values, p), 4) for p in PERCENTILES}, "max": round(max(values), 4)}
+                    for name, values in sorted(latencies.items())}
+    }
+
+def print_report(report):
+    from tabulate import tabulate
+    rows = [[run["sessions"], run["seconds"], run["interactions"], run["interactions_per_second"], run["scenarios_per_minute"],
+             run["upload_seconds"], run["mb_per_session"], run["peak_session_mb"], len(run["errors"])] for run in report["runs"]]
+    print(tabulate(rows, headers=["Sessions", "Seconds", "Interactions", "Interactions/s", "Scenarios/min", "Upload s", "MB/session",
+                                  "Peak MB/session", "Errors"],
+                   tablefmt="grid"))
+    latency_rows = []
+    for run in report["runs"]:
+        for name, entry in run["latency"].items():
+            latency_rows.append([run["sessions"], name, entry["count"], entry["mean"], *(entry[f"p{p}"] for p in PERCENTILES), entry["max"]])
+    print("\nLatency per interaction (seconds):")
+    print(tabulate(latency_rows, headers=["Sessions", "Interaction", "Count", "Mean", *(f"p{p}" for p in PERCENTILES), "Max"], tablefmt="grid"))
+    for run in report["runs"]:
+        for error in run["errors"]:
+            print(f"{run['sessions']} sessions: {error}")
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(description="Load test the Streamlit app with simulated concurrent sessions.")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="IFC file every session uploads")
+    parser.add_argument("--sessions", nargs="*", type=int, default=DEFAULT_SESSIONS, help="Concurrent session counts to measure")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS, help="Select, view, update and export rounds per session")
+    parser.add_argument("--think", type=float, default=0.0, help="Seconds a user waits between interactions")
+    parser.add_argument("--element-type", default=DEFAULT_ELEMENT_TYPE)
+    parser.add_argument("--selection", type=int, default=DEFAULT_SELECTION, help="Elements each session selects")
+    parser.add_argument("--property", default="Name", help="Property each session updates")
+    parser.add_argument("--collective", action="store_true", help="Export collectively instead of one file per element")
+    parser.add_argument("--cores", type=int, default=1,
+                        help="CPU cores shared by all sessions; 1 models a single server process, 0 lets them spread out")
+    parser.add_argument("--output", help="Where to store the JSON results (default: benchmark_results/load_<commit>.json)")
+    parser.add_argument("--session", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.session is not None:
+        return session_worker(args)
+    if not os.path.exists(args.model):
+        print(f"File not found: {args.model}")
+        return 1
+
+    runs = []
+    for sessions in args.sessions:
+        print(f"Running {sessions} concurrent session(s) on {args.model} ...")
+        runs.append(run_load(sessions, argv, args))
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "model": os.path.basename(args.model),
+        "cores": args.cores,
+        "think_seconds": args.think,
+        "runs": runs
+    }
+    print_report(report)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"load_{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    return 1 if any(run["errors"] for run in runs) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
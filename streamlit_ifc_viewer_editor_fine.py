@@ -2,15 +2,52 @@ import streamlit as st
 import os
 import csv
 import re
+from collections.abc import Mapping
 import ifcopenshell
 from ifcopenshell.util import element, placement
+from ifc_compact_records import PropertyTable
+from ifc_spatial_index import SpatialIndex
+from ifc_relationship_index import RelationshipIndex
+from ifc_compaction import compact_in_place
+from ifc_watch import FileWatcher, apply_file_changes, edited_ids
+from ifc_journal import Journal
+from ifc_export_bundle import csv_bytes, write_csv_bundle
+from ifc_page_cache import PageCache
+from ifc_changeset import ChangeTracker, ChangesetError, edit_targets, custom_property_targets, CHANGESET_FORMAT, bytes_fingerprint, add_custom_property, apply_edit, convert_value, set_property_value
 import tempfile
+import pathlib
 import base64
+import json
+import uuid
+import time
+from ifc_ingest import UPLOAD_TYPES, detect_format, open_ifc_buffer, strip_compression_suffix
+from ifc_async_executor import AsyncModelExecutor, BackgroundLoop
+from ifc_profiling import PROFILE_ENV, enable_from_environment, get_metrics, instrument_class, profiled
+
+# Seconds between checks of a file opened by path for changes made by other programs
+WATCH_INTERVAL = 2
 
 class IFCViewerEditor:
-    def __init__(self, ifc_file_path):
+    def __init__(self, ifc_file_path, ifc_file=None, fingerprint=None):
         self.ifc_file_path = ifc_file_path
-        self.ifc_file = ifcopenshell.open(ifc_file_path)
+        self.ifc_file = ifc_file if ifc_file is not None else ifcopenshell.open(ifc_file_path)
+        # Properties are kept column-wise once computed; get_element_properties returns read-only views
+        self.property_table = PropertyTable()
+        # Bumped on every edit; results derived from the model are cached against it
+        self.model_version = 0
+        self._spatial_index = None
+        self._relationship_index = None
+        self._geometry_index = None
+        self._quantity_engine = None
+        self._aggregation = None
+        self.changes = ChangeTracker(self.ifc_file, ifc_file_path if ifc_file is None else None, fingerprint)
+        # Undo and redo; persisted next to files opened from disk so a crashed session can be recovered
+        self.journal = Journal(self.ifc_file, self.changes, ifc_file_path if ifc_file is None else None)
+        # Set by watch(); refresh_from_disk then re-reads only what changed in the file
+        self.watcher = None
+        self.saved_version = 0
+        # Merge duplicate value entities and drop orphans whenever the model is saved
+        self.compact_on_save = False
 
     def find_close_matches(self, identifier):
         all_types = set(element.is_a() for element in self.ifc_file)
@@ -38,30 +75,53 @@ class IFCViewerEditor:
 
     def create_new_property(self, element, property_name, property_value):
         try:
-            # Create a new IfcPropertySingleValue
-            property_value = ifcopenshell.api.run("property.add_property", self.ifc_file,
-                property_set=None, name=property_name, value=property_value)
-            
-            # Create a new IfcPropertySet if it doesn't exist
-            property_set = ifcopenshell.api.run("property.add_pset", self.ifc_file,
-                product=element, name=f"Custom_Properties_{element.is_a()}")
-            
-            # Add the property to the property set
-            ifcopenshell.api.run("property.edit_property", self.ifc_file,
-                property=property_value, attributes={"Name": property_name})
-            
-            # Assign the property set to the element
-            ifcopenshell.api.run("property.assign_pset", self.ifc_file,
-                product=element, pset=property_set)
-            
+            # Added to the element's Custom_Properties set, which is created on first use
+            pset_name = f"Custom_Properties_{element.is_a()}"
+            with self.journal.transaction(f"Create {property_name} on {element.is_a()} #{element.id()}"):
+                self.journal.track(*custom_property_targets(element, pset_name))
+                property_set = add_custom_property(self.ifc_file, element, pset_name, property_name, property_value)
+                self.changes.record({'op': 'create_property', 'global_id': element.GlobalId, 'pset': pset_name,
+                                     'property': property_name, 'value': property_value}, property_set, property_set.OwnerHistory)
+                self.invalidate_properties([element])
             return True
         except Exception as e:
             print(f"Error creating new property: {e}")
             return False    
+
+    def apply_changeset(self, changeset):
+        skipped = []
+        with self.journal.transaction(f"Apply changeset of {len(changeset['edits'])} edit(s)"):
+            for edit in changeset['edits']:
+                try:
+                    self.journal.track(*edit_targets(self.ifc_file, edit))
+                    self.changes.record(edit, *apply_edit(self.ifc_file, edit))
+                except ChangesetError as e:
+                    skipped.append(str(e))
+        self.invalidate_properties()
+        return skipped
 ###################################################################################################3
     def get_element_properties(self, element):
         if element is None:
             return {}
+        properties = self.property_table.get(element.id())
+        if properties is None:
+            get_metrics().count("cache.properties.miss")
+            properties = self.property_table.add(element.id(), self._compute_element_properties(element))
+        else:
+            get_metrics().count("cache.properties.hit")
+        return properties
+
+    def invalidate_properties(self, elements=None):
+        self.model_version += 1
+        if elements is not None:
+            self.journal.touched(elements)
+        if elements is None:
+            self.property_table.clear()
+            return
+        for element in elements:
+            self.property_table.discard(element.id())
+
+    def _compute_element_properties(self, element):
         properties = {
             "Name": element.Name,
             "Type": element.is_a(),
@@ -89,6 +149,10 @@ class IFCViewerEditor:
         for qto_name, qto_data in quantities.items():
             for quantity_name, quantity_value in qto_data.items():
                 properties[f"{qto_name}.{quantity_name}"] = quantity_value
+        if not quantities and self._quantity_engine is not None:
+            # Derived from the geometry when the exporter wrote no quantity sets, for elements
+            # passed to derive_quantities first
+            properties.update(self._quantity_engine.quantities(element))
 
         # Add material information
         materials = ifcopenshell.util.element.get_materials(element)
@@ -107,19 +171,6 @@ class IFCViewerEditor:
                             'Thickness': layer.LayerThickness,
                             'IsVentilated': layer.IsVentilated if hasattr(layer, 'IsVentilated') else 'N/A'
                         }
-                        
-                        # Calculate area and volume if possible
-                        if element.is_a('IfcWall') or element.is_a('IfcSlab'):
-                            quantity_set = ifcopenshell.util.element.get_psets(element, qtos_only=True)
-                            if 'Qto_WallBaseQuantities' in quantity_set:
-                                area = quantity_set['Qto_WallBaseQuantities'].get('GrossFootprintArea', 0)
-                                layer_info['Area'] = area
-                                layer_info['Volume'] = area * layer.LayerThickness
-                            elif 'Qto_SlabBaseQuantities' in quantity_set:
-                                area = quantity_set['Qto_SlabBaseQuantities'].get('GrossArea', 0)
-                                layer_info['Area'] = area
-                                layer_info['Volume'] = area * layer.LayerThickness
-                        
                         properties['MaterialLayers'].append(layer_info)
                 elif materials.is_a('IfcMaterialList'):
                     properties['MaterialList'] = [m.Name for m in materials.Materials]
@@ -141,37 +192,220 @@ class IFCViewerEditor:
     def update_element_property(self, elements, property_name, new_value):
         if not elements:
             return False
+        with self.journal.transaction(f"Set {property_name} on {len(elements)} element(s)"):
+            return self._update_element_property(elements, property_name, new_value)
+
+    def _update_element_property(self, elements, property_name, new_value):
         success = False
         for element in elements:
             if property_name == "Name":
+                self.journal.track(element)
                 element.Name = new_value
+                self.changes.record({'op': 'set_attribute', 'global_id': element.GlobalId, 'attribute': 'Name', 'value': new_value}, element)
+                self.invalidate_properties([element])
                 success = True
             else:
                 for definition in element.IsDefinedBy:
                     if definition.is_a('IfcRelDefinesByProperties'):
                         property_set = definition.RelatingPropertyDefinition
+                        if not property_set.is_a('IfcPropertySet'):
+                            continue
                         for property in property_set.HasProperties:
                             if property.Name == property_name:
                                 if hasattr(property, 'NominalValue'):
-                                    property.NominalValue.wrappedValue = new_value
-                                    success = True
+                                    try:
+                                        value_type, value = convert_value(property.NominalValue, new_value)
+                                    except ValueError:
+                                        continue
                                 elif hasattr(property, 'Value'):
-                                    property.Value = new_value
-                                    success = True
+                                    value_type, value = None, new_value
+                                else:
+                                    continue
+                                self.journal.track(property)
+                                set_property_value(self.ifc_file, property, value, value_type)
+                                self.changes.record({'op': 'set_property', 'global_id': element.GlobalId, 'pset': property_set.Name,
+                                                     'property': property_name, 'value': value, 'value_type': value_type}, property)
+                                success = True
+                                # The property set may be shared by several elements
+                                self.invalidate_properties(definition.RelatedObjects)
         return success
 
-    def save_ifc_file(self):
+    def save_ifc_file(self, compact=None):
         try:
             backup_path = self.ifc_file_path + '.bak'
             self.ifc_file.write(backup_path)
             st.success(f"Backup created: {backup_path}")
             self.ifc_file.write(self.ifc_file_path)
+            compact = self.compact_on_save if compact is None else compact
+            if compact:
+                st.info(compact_in_place(self.ifc_file_path).summary())
+                self._reload_compacted()
+            else:
+                self.journal.rebase()
+            if self.watcher is not None:
+                self.watcher.rescan()
+            self.saved_version = self.model_version
             st.success("Changes saved successfully.")
             return True
         except Exception as e:
             st.error(f"Error saving file: {e}")
             return False
 
+    def undo(self):
+        transaction = self.journal.undo()
+        if transaction is not None:
+            self._invalidate_transaction(transaction)
+        return transaction
+
+    def redo(self):
+        transaction = self.journal.redo()
+        if transaction is not None:
+            self._invalidate_transaction(transaction)
+        return transaction
+
+    def _invalidate_transaction(self, transaction):
+        if transaction.elements:
+            self.invalidate_properties([self.ifc_file.by_id(element_id) for element_id in transaction.elements])
+        else:
+            self.invalidate_properties()
+
+    def recover_journal(self, replay=True):
+        # Reapplies the edits of a session that ended without saving; without replay only the
+        # undo history of the last save is restored
+        applied = self.journal.recover(replay)
+        if applied:
+            self.invalidate_properties()
+        return applied
+
+    def has_unsaved_changes(self):
+        return self.model_version != self.saved_version
+
+    def watch(self):
+        # Remembers the file as it is now; refresh_from_disk applies later versions of it
+        if self.watcher is None:
+            self.watcher = FileWatcher(self.ifc_file_path)
+        return self.watcher
+
+    def refresh_from_disk(self):
+        # Brings the model in line with a newer version of its file, re-reading only the entity
+        # lines that differ; unsaved edits give way to the file. None if the file is unchanged.
+        if self.watcher is None:
+            return None
+        started = time.perf_counter()
+        changes = self.watcher.poll(edited_ids(self.changes, self.ifc_file))
+        if changes is None:
+            return None
+        if changes.full:
+            self._reload_file()
+        else:
+            self._reindex(*apply_file_changes(self.ifc_file, changes))
+        self.watcher.accept(changes)
+        # The undo history and change log were relative to the old file
+        self.journal.discard()
+        self.changes = ChangeTracker(self.ifc_file, self.ifc_file_path)
+        self.journal = Journal(self.ifc_file, self.changes, self.ifc_file_path)
+        self.saved_version = self.model_version
+        changes.seconds = time.perf_counter() - started
+        return changes
+
+    def _reindex(self, element_ids, geometric_ids, structural):
+        # Types are indexed by ifcopenshell itself and relationships per model version; the rest
+        # only forget the elements that changed
+        self.model_version += 1
+        for element_id in element_ids:
+            self.property_table.discard(element_id)
+        if self._quantity_engine is not None:
+            for element_id in element_ids:
+                self._quantity_engine.values.pop(element_id, None)
+        if self._geometry_index is not None and geometric_ids:
+            self._geometry_index = self._geometry_index.refreshed(geometric_ids)
+        if structural:
+            self._spatial_index = None
+
+    def _reload_compacted(self):
+        # Compaction merged and dropped value entities the model in memory still has, so edits
+        # journaled against it could not be replayed onto the file. The model is read back and the
+        # journal restarts at the same path without the undo history; elements keep their ids.
+        self._reload_file()
+        self.changes.ifc_file = self.ifc_file
+        self.journal.discard()
+        self.journal = Journal(self.ifc_file, self.changes, self.journal.model_path)
+
+    def _reload_file(self):
+        self.ifc_file = ifcopenshell.open(self.ifc_file_path)
+        self.property_table = PropertyTable()
+        self._spatial_index = None
+        self._relationship_index = None
+        self._geometry_index = None
+        self._quantity_engine = None
+        self._aggregation = None
+        self.model_version += 1
+
+    def spatial_index(self):
+        # Built on first use; property edits do not change containment
+        if self._spatial_index is None:
+            self._spatial_index = SpatialIndex(self.ifc_file)
+        return self._spatial_index
+
+    def relationship_index(self):
+        # Rebuilt after edits, which can add property sets
+        if self._relationship_index is None or self._relationship_index[0] != self.model_version:
+            self._relationship_index = (self.model_version, RelationshipIndex(self.ifc_file))
+        return self._relationship_index[1]
+
+    def geometry_index(self):
+        # Tessellation is slow: boxes are built on first use and cached on disk per upload.
+        # The kernel's threads are used instead of forked workers inside the server process.
+        if self._geometry_index is None:
+            from ifc_geometry_index import GeometryIndex
+            self._geometry_index = GeometryIndex.for_model(self.ifc_file, fingerprint=self.changes.fingerprint, processes=1)
+        return self._geometry_index
+
+    def quantity_engine(self):
+        if self._quantity_engine is None:
+            # Kernel threads rather than forked workers inside the server process
+            from ifc_quantities import QuantityEngine
+            self._quantity_engine = QuantityEngine(self.ifc_file, processes=1)
+        return self._quantity_engine
+
+    def derive_quantities(self, elements):
+        # Opt-in geometry work for elements without quantity sets, batched before their properties
+        # are read; rows already cached without the derived values are dropped
+        engine = self.quantity_engine()
+        pending = [e for e in elements if e.id() not in engine.values]
+        engine.derive(pending)
+        for element in pending:
+            if engine.values.get(element.id()) is not None:
+                self.property_table.discard(element.id())
+
+    def get_layer_quantities(self, element, layer):
+        return self.quantity_engine().layer_quantities(element, layer, self.get_element_properties(element))
+
+    def aggregate_quantities(self, group_by, quantity='Volume', functions=None):
+        if self._aggregation is None:
+            from ifc_aggregation import AggregationEngine
+            self._aggregation = AggregationEngine(self)
+        return self._aggregation.aggregate(group_by, quantity, functions or ('sum', 'count', 'mean', 'min', 'max'))
+
+    def validate(self, rules=None):
+        from ifc_validation import ModelValidator
+        validator = ModelValidator(self.ifc_file, rules, self.spatial_index(), self.relationship_index(), processes=1)
+        return validator.run(self.ifc_file_path)
+
+    def extract_elements(self, elements, output_path):
+        from ifc_partition import build_partition
+        build_partition(self.ifc_file, [e.id() for e in elements], self.spatial_index()).write(output_path)
+        return output_path
+
+    def extract_partitions(self, scheme, output_dir):
+        from ifc_partition import partitions_by, write_partitions
+        return sorted(write_partitions(self.ifc_file, partitions_by(self.ifc_file, scheme, self.spatial_index()), output_dir, processes=1))
+
+    def export_graph(self, path, elements=None):
+        # JSON Lines or SQLite, chosen by the file extension
+        from ifc_graph_export import GraphExporter, export_graph
+        return export_graph(GraphExporter(self.ifc_file, self.spatial_index(), self.relationship_index()), path, elements)
+
     def count_elements_by_type(self, element_type):
         return len(self.ifc_file.by_type(element_type))
 
@@ -228,14 +462,14 @@ def sanitize_filename(filename):
     return re.sub(r'[\\/*?:"<>|]', "", filename).replace(" ", "_")
 
 def export_to_csv(filename, data):
-    if isinstance(data, dict):
+    if isinstance(data, Mapping):
         data = [data]
     if not data:
         st.warning(f"No data to export to {filename}")
         return None
     
     with tempfile.NamedTemporaryFile(mode='w+', newline='', delete=False, suffix='.csv') as temp_file:
-        fieldnames = list(data[0].keys())
+        fieldnames = list(dict.fromkeys(key for row in data for key in row))
         writer = csv.DictWriter(temp_file, fieldnames=fieldnames)
         writer.writeheader()
         for row in data:
@@ -257,7 +491,7 @@ def show_user_guide():
 
     ## Getting Started
     1. Launch the application using Streamlit.
-    2. Upload your IFC file using the file uploader on the main page.
+    2. Upload your IFC file using the file uploader on the main page. Plain `.ifc`, zipped `.ifczip` and gzip-compressed `.ifc.gz` files are accepted.
     3. Once uploaded, you'll see a sidebar with various commands to interact with the IFC file.
 
     ## Main Features
@@ -302,6 +536,7 @@ def show_user_guide():
     - **Purpose**: Save all changes made to the IFC file.
     - **How to use**:
       - Click this command and confirm to save all modifications to the file.
+      - Click "Validate" first to check the model against the built-in rules or an uploaded rules file.
 
     ### 7. Count
     - **Purpose**: Count the number of elements of a specific type in the IFC file.
@@ -309,17 +544,25 @@ def show_user_guide():
       - Select an element type from the dropdown.
       - Click "Count Elements" to see the total number.
 
-    ### 8. List
+    ### 8. Aggregate
+    - **Purpose**: Total element volumes or areas grouped by type, storey and/or material.
+    - **How to use**:
+      - Choose the grouping keys, the quantity and the functions to compute.
+      - The table updates straight away; use the download button to save it as CSV.
+
+    ### 9. List
     - **Purpose**: Display all element types present in the IFC file.
     - **How to use**:
       - Simply click this command to see a list of all element types.
 
-    ### 9. Export
+    ### 10. Export
     - **Purpose**: Export properties or layer information of selected elements to CSV files.
     - **How to use**:
       - Choose to export Properties, Layers, or Both.
       - Select between Separate or Collective export modes.
-      - Click "Export" and use the download buttons to save the CSV files.
+      - Click "Export" and use the download buttons to save the CSV files. Separate exports come as a single ZIP with one CSV per element.
+      - Under "Element graph", export every element with its property sets, quantities, layers, placement and relationships as JSON Lines or SQLite.
+      - Under "IFC sub-models", write the selected elements, or each storey, type or discipline, as standalone IFC files.
 
     ## Tips
     - Always select elements before trying to view, update, or export their information.
@@ -337,60 +580,255 @@ def show_user_guide():
 
 
 
+def page_profile_path(session_id, command):
+    profile_dir = os.environ.get(PROFILE_ENV)
+    if not profile_dir:
+        return None
+    os.makedirs(profile_dir, exist_ok=True)
+    return os.path.join(profile_dir, f"{session_id}_{sanitize_filename(command)}_{int(time.time() * 1000)}.prof")
+
 def main():
     st.set_page_config(page_title="IFC Viewer and Editor", layout="wide")
     st.title("IFC Viewer and Editor")
+    # Set IFC_VIEWER_METRICS and/or IFC_VIEWER_PROFILE before `streamlit run` to collect metrics
+    metrics = enable_from_environment()
+    if metrics.enabled:
+        instrument_class(IFCViewerEditor)
 
     if 'viewer_editor' not in st.session_state:
-        uploaded_file = st.file_uploader("Choose an IFC file", type="ifc")
+        uploaded_file = st.file_uploader("Choose an IFC file", type=UPLOAD_TYPES)
         if uploaded_file is not None:
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.ifc') as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
-                tmp_file_path = tmp_file.name
-            st.session_state.viewer_editor = IFCViewerEditor(tmp_file_path)
+            # Parse the upload from memory; the workspace only receives saved copies
+            # and is removed on Reset or when the session is dropped
+            workspace = tempfile.TemporaryDirectory(prefix="ifc_viewer_")
+            try:
+                ifc_file = open_ifc_buffer(uploaded_file)
+            except Exception as e:
+                workspace.cleanup()
+                st.error(f"Error reading IFC file: {e}")
+                return
+            save_name = sanitize_filename(strip_compression_suffix(uploaded_file.name)) + '.ifc'
+            # Changesets from plain uploads can be patched straight into identical copies
+            fingerprint = bytes_fingerprint(uploaded_file.getbuffer()) if detect_format(uploaded_file) == 'ifc' else None
+            st.session_state.workspace = workspace
+            st.session_state.viewer_editor = IFCViewerEditor(os.path.join(workspace.name, save_name), ifc_file, fingerprint)
+            st.session_state.executor = AsyncModelExecutor(st.session_state.viewer_editor)
+            st.session_state.selected_elements = []
+            st.rerun()
+        # A file on the server is edited in place and followed as other programs change it
+        server_path = st.text_input("Or open a file on the server by path")
+        if server_path and st.button("Open and watch"):
+            if not os.path.isfile(server_path):
+                st.error(f"File not found: {server_path}")
+                return
+            try:
+                viewer_editor = IFCViewerEditor(os.path.abspath(server_path))
+            except Exception as e:
+                st.error(f"Error reading IFC file: {e}")
+                return
+            viewer_editor.watch()
+            st.session_state.viewer_editor = viewer_editor
+            st.session_state.executor = AsyncModelExecutor(viewer_editor)
             st.session_state.selected_elements = []
             st.rerun()
     else:
+        if st.session_state.viewer_editor.watcher is not None:
+            # Fragments may only write inside their own container
+            with st.sidebar:
+                watch_file()
+        if 'watch_message' in st.session_state:
+            st.sidebar.info(st.session_state.pop('watch_message'))
         st.sidebar.header("Commands")
         command = st.sidebar.selectbox(
             "Select a command",
-            ["User Guide", "Select", "View", "Properties", "Layers", "Update", "Save", "Count", "List", "Export"]
+            ["User Guide", "Select", "View", "Properties", "Layers", "Update", "Save", "Count", "Aggregate", "List", "Export"]
         )
 
-        if command == "User Guide":
-            show_user_guide()
-        elif command == "Select":
-            select_elements()
-        elif command == "View":
-            view_elements()
-        elif command == "Properties":
-            show_properties()
-        elif command == "Layers":
-            show_layers()
-        elif command == "Update":
-            update_property()
-        elif command == "Save":
-            save_changes()
-        elif command == "Count":
-            count_elements()
-        elif command == "List":
-            list_element_types()
-        elif command == "Export":
-            export_data()
+        session_id = st.session_state.setdefault('metrics_session', uuid.uuid4().hex[:12])
+        with metrics.command('page', command, session=session_id), profiled(page_profile_path(session_id, command)):
+            if command == "User Guide":
+                show_user_guide()
+            elif command == "Select":
+                select_elements()
+            elif command == "View":
+                view_elements()
+            elif command == "Properties":
+                show_properties()
+            elif command == "Layers":
+                show_layers()
+            elif command == "Update":
+                update_property()
+            elif command == "Save":
+                save_changes()
+            elif command == "Count":
+                count_elements()
+            elif command == "Aggregate":
+                aggregate_quantities()
+            elif command == "List":
+                list_element_types()
+            elif command == "Export":
+                export_data()
 
         if st.sidebar.button("Reset"):
+            if 'export_job' in st.session_state:
+                st.session_state.export_job.cancel()
+            if 'executor' in st.session_state:
+                st.session_state.executor.shutdown()
+            if 'workspace' in st.session_state:
+                st.session_state.workspace.cleanup()
             for key in list(st.session_state.keys()):
                 del st.session_state[key]
             st.rerun()
 
+@st.fragment(run_every=WATCH_INTERVAL)
+def watch_file():
+    # Re-run on its own every few seconds; a stat call unless the file was written
+    viewer_editor = st.session_state.viewer_editor
+    if not viewer_editor.watcher.modified():
+        return
+    if viewer_editor.has_unsaved_changes():
+        st.warning("The file changed on disk. Reloading it discards your unsaved edits.")
+        if not st.button("Reload from disk"):
+            return
+    changes = get_background_loop().run(st.session_state.executor.refresh_from_disk())
+    if changes is None:
+        return
+    st.session_state.watch_message = f"The file changed on disk. {changes.summary()}."
+    reselect(viewer_editor)
+    st.rerun()
+
+def reselect(viewer_editor):
+    # After the model was read again: selections are kept by id, and lists of elements from
+    # before are dropped
+    selected_ids = [e.id() for e in st.session_state.get('selected_elements', [])]
+    st.session_state.selected_elements = [e for e in (find_element(viewer_editor, i) for i in selected_ids) if e is not None]
+    st.session_state.selected_element_ids = [e.id() for e in st.session_state.selected_elements]
+    for key in ('results', 'elements'):
+        st.session_state.pop(key, None)
+
+def find_element(viewer_editor, element_id):
+    try:
+        return viewer_editor.ifc_file.by_id(element_id)
+    except RuntimeError:
+        return None
+
+def page_cached(name, compute, *inputs):
+    # Reruns reuse what this model version already produced for the same inputs
+    cache = st.session_state.setdefault('page_cache', PageCache())
+    return cache.get(st.session_state.viewer_editor, name, compute, *inputs)
+
+def element_types():
+    return page_cached('element_types', st.session_state.viewer_editor.list_all_element_types)
+
+def spatial_node_options(index):
+    return {f"{'-- ' * depth}{index.describe(node.id)} ({index.count(node.id)})": node.id for depth, node in index.walk()}
+
+def histogram_rows(histogram):
+    return [{"Element Type": t, "Count": c} for t, c in sorted(histogram.items(), key=lambda item: (-item[1], item[0]))]
+
+def select_by_spatial_structure():
+    index = st.session_state.viewer_editor.spatial_index()
+    options = page_cached('spatial_options', lambda: spatial_node_options(index))
+    if not options:
+        st.warning("The IFC file has no spatial structure.")
+        return
+    node_id = options[st.selectbox("Select a site, building, storey or space", list(options))]
+    histogram = index.nodes[node_id].histogram
+    st.write(index.path(node_id))
+    if not histogram:
+        st.info("No elements are contained in this node.")
+        return
+    st.table(page_cached('histogram', lambda: histogram_rows(histogram), node_id))
+    types = st.multiselect("Element types to select (leave empty for all)", sorted(histogram))
+    if st.button("Select Elements"):
+        st.session_state.selected_elements = index.elements(node_id, types or None)
+        st.session_state.selected_element_ids = [elem.id() for elem in st.session_state.selected_elements]
+        st.success(f"Selected {len(st.session_state.selected_elements)} elements")
+
+def select_by_where_used():
+    from ifc_relationship_index import CATEGORIES
+    index = st.session_state.viewer_editor.relationship_index()
+    category = st.selectbox("Elements using a", CATEGORIES)
+    selected = st.session_state.get('selected_elements') or []
+    sources = ["Search", "Selected elements"] if selected else ["Search"]
+    source = st.radio("Find", sources, horizontal=True)
+    if source == "Selected elements":
+        keys = list(dict.fromkeys(key for e in selected for key in index.keys_of(category, e)))
+    else:
+        text = st.text_input(f"Part of a {category} name or its ID")
+        keys = index.find(category, text) if text else [key for key, _, _ in index.entries(category)]
+    if not keys:
+        st.info(f"No {category} in use matches.")
+        return
+    options = {f"#{key} {index.describe(category, key)} ({len(index.used_by[category][key])} elements)": key for key in keys}
+    chosen = st.multiselect(f"{category.capitalize()} (leave empty for all {len(options)} listed)", list(options))
+    keys = [options[label] for label in chosen] or keys
+    st.write(f"{index.count(category, keys)} elements")
+    if st.button("Select Elements"):
+        st.session_state.selected_elements = index.elements(category, keys)
+        st.session_state.selected_element_ids = [elem.id() for elem in st.session_state.selected_elements]
+        st.success(f"Selected {len(st.session_state.selected_elements)} elements")
+
+def point_input(label, default):
+    st.write(label)
+    columns = st.columns(3)
+    return [column.number_input(axis, value=float(value), format="%.3f", key=f"{label}_{axis}")
+            for column, axis, value in zip(columns, "xyz", default)]
+
+def select_by_region():
+    with st.spinner("Computing element bounding boxes. This is cached after the first run for each file..."):
+        index = st.session_state.viewer_editor.geometry_index()
+    bounds = index.bounds()
+    if bounds is None:
+        st.warning("No element geometry could be processed in this file.")
+        return
+    low, high = bounds
+    st.write(f"{len(index)} elements with geometry. Model extents: ({', '.join(f'{v:.3f}' for v in low)}) to ({', '.join(f'{v:.3f}' for v in high)})")
+    mode = st.radio("Query", ["Box", "Point", "Nearest"], horizontal=True)
+    distances = None
+    if mode == "Box":
+        box_low = point_input("Minimum corner", low)
+        box_high = point_input("Maximum corner", high)
+    else:
+        point = point_input("Point", (low + high) / 2)
+        if mode == "Point":
+            tolerance = st.number_input("Tolerance", min_value=0.0, value=0.0)
+        else:
+            count = st.number_input("Number of elements", min_value=1, value=5)
+    if st.button("Select Elements"):
+        if mode == "Box":
+            elements = index.elements_in_box(box_low, box_high)
+        elif mode == "Point":
+            elements = index.elements_at_point(point, tolerance)
+        else:
+            nearest = index.nearest_elements(point, int(count))
+            elements = [element for element, _ in nearest]
+            distances = [distance for _, distance in nearest]
+        st.session_state.selected_elements = elements
+        st.session_state.selected_element_ids = [elem.id() for elem in elements]
+        st.success(f"Selected {len(elements)} elements")
+        for i, element in enumerate(elements[:50]):
+            distance = f", Distance: {distances[i]:.3f}" if distances else ""
+            st.write(f"ID {element.id()}, Type: {element.is_a()}, Name: {element.Name}{distance}")
+
 def select_elements():
+    mode = st.radio("Select by", ["Type or ID", "Spatial structure", "Region", "Where used"], horizontal=True)
+    if mode == "Spatial structure":
+        select_by_spatial_structure()
+        return
+    if mode == "Where used":
+        select_by_where_used()
+        return
+    if mode == "Region":
+        select_by_region()
+        return
     st.session_state.step = st.session_state.get('step', 0)
     
     if st.session_state.step == 0:
         identifier = st.text_input("Enter element type, ID, or 'list' to see all types:")
         if st.button("Next"):
             if identifier.lower() == 'list':
-                st.session_state.element_types = st.session_state.viewer_editor.list_all_element_types()
+                st.session_state.element_types = element_types()
                 st.session_state.step = 1
             else:
                 st.session_state.results, error = st.session_state.viewer_editor.select_elements(identifier)
@@ -467,29 +905,53 @@ def view_elements():
     else:
         st.warning("No elements selected. Use 'Select' command first.")
 
+def selection_key():
+    return tuple(element.id() for element in st.session_state.selected_elements)
+
+def element_properties(elements):
+    st.session_state.viewer_editor.derive_quantities(elements)
+    return [(f"{element.is_a()} (ID: {element.id()})", dict(st.session_state.viewer_editor.get_element_properties(element)))
+            for element in elements]
+
+def element_layers(elements):
+    viewer_editor = st.session_state.viewer_editor
+    viewer_editor.derive_quantities(elements)
+    rows = []
+    for element in elements:
+        properties = viewer_editor.get_element_properties(element)
+        if not properties.get('HasLayers'):
+            rows.append((element.id(), None, []))
+            continue
+        layers = []
+        for i in range(properties['NumberOfLayers']):
+            layer = viewer_editor.select_layer(i, element)
+            if layer:
+                layer_props = viewer_editor.get_layer_properties(layer)
+                layer_props.update(viewer_editor.get_layer_quantities(element, layer))
+                layers.append((i, layer_props))
+        rows.append((element.id(), f"Layers for {element.is_a()} (ID: {element.id()})", layers))
+    return rows
+
 def show_properties():
     if st.session_state.selected_elements:
-        for element in st.session_state.selected_elements:
-            st.subheader(f"{element.is_a()} (ID: {element.id()})")
-            properties = st.session_state.viewer_editor.get_element_properties(element)
+        for header, properties in page_cached('properties', lambda: element_properties(st.session_state.selected_elements),
+                                              selection_key()):
+            st.subheader(header)
             st.json(properties)
     else:
         st.warning("No elements selected. Use 'Select' command first.")
 
 def show_layers():
     if st.session_state.selected_elements:
-        for element in st.session_state.selected_elements:
-            properties = st.session_state.viewer_editor.get_element_properties(element)
-            if 'HasLayers' in properties and properties['HasLayers']:
-                st.subheader(f"Layers for {element.is_a()} (ID: {element.id()})")
-                for i in range(properties['NumberOfLayers']):
-                    layer = st.session_state.viewer_editor.select_layer(i, element)
-                    if layer:
-                        st.write(f"Layer {i+1}")
-                        layer_props = st.session_state.viewer_editor.get_layer_properties(layer)
-                        st.json(layer_props)
-            else:
-                st.warning(f"Element {element.id()} does not have layers.")
+        for element_id, header, layers in page_cached('layers', lambda: element_layers(st.session_state.selected_elements),
+                                                      selection_key()):
+            if header is None:
+                st.warning(f"Element {element_id} does not have layers.")
+                continue
+            st.subheader(header)
+            for i, layer_props in layers:
+                st.write(f"Layer {i+1}")
+                st.json(layer_props)
     else:
         st.warning("No elements selected. Use 'Select' command first.")
 
@@ -497,8 +959,9 @@ def show_layers():
 def update_property():
     if 'selected_element_ids' in st.session_state and st.session_state.selected_element_ids:
         # Retrieve elements by their IDs
-        elements = [st.session_state.viewer_editor.ifc_file.by_id(id) for id in st.session_state.selected_element_ids]
-        element_options = [f"{elem.is_a()} (ID: {elem.id()})" for elem in elements]
+        element_ids = tuple(st.session_state.selected_element_ids)
+        element_options = page_cached('element_options', lambda: [f"{elem.is_a()} (ID: {elem.id()})" for elem in
+                                                                   map(st.session_state.viewer_editor.ifc_file.by_id, element_ids)], element_ids)
         selected_option = st.selectbox("Select element to update", element_options)
         
         if selected_option:
@@ -508,9 +971,8 @@ def update_property():
             # Get all properties of the selected element
             properties = st.session_state.viewer_editor.get_element_properties(element)
             
-            # Create a list of property names
-            property_names = list(properties.keys())
-            property_names.insert(0, "Create new property")  # Add option to create new property
+            # Create a list of property names, with an option to create a new property first
+            property_names = page_cached('property_names', lambda: ["Create new property", *properties.keys()], element_id)
             
             selected_property = st.selectbox("Select property to update", property_names)
             
@@ -519,7 +981,7 @@ def update_property():
                 new_property_value = st.text_input("Enter new property value")
                 if st.button("Create Property"):
                     # Logic to create a new property
-                    success = st.session_state.viewer_editor.create_new_property(element, new_property_name, new_property_value)
+                    success = get_background_loop().run(st.session_state.executor.create_new_property(element, new_property_name, new_property_value))
                     if success:
                         st.success(f"Created new property {new_property_name} with value {new_property_value}")
                     else:
@@ -531,118 +993,309 @@ def update_property():
                 new_value = st.text_input("Enter new value", value=str(current_value))
                 
                 if st.button("Update Property"):
-                    if st.session_state.viewer_editor.update_element_property(element, selected_property, new_value):
+                    if get_background_loop().run(st.session_state.executor.update_element_property([element], selected_property, new_value)):
                         st.success(f"Updated {selected_property} to {new_value} for selected element")
                     else:
                         st.error(f"Failed to update property {selected_property}. Make sure the property exists and is editable.")
 
-            if st.button("Save Changes"):
+            if st.button("Save Changes", disabled=export_job_running()):
                 if st.session_state.viewer_editor.save_ifc_file():
                     st.success("Changes saved successfully.")
                 else:
                     st.error("Failed to save changes.")
     else:
         st.warning("No elements selected. Use 'Select' command first.")
+    undo_redo()
+
+def undo_redo():
+    journal = st.session_state.viewer_editor.journal
+    col1, col2 = st.columns(2)
+    undo_label = f"Undo: {journal.undo_stack[-1].name}" if journal.undo_stack else "Undo"
+    redo_label = f"Redo: {journal.redo_stack[-1].name}" if journal.redo_stack else "Redo"
+    # Undo and redo are edits: they wait for running exports to finish reading the model
+    if col1.button(undo_label, disabled=not journal.undo_stack):
+        get_background_loop().run(st.session_state.executor.undo())
+        st.rerun()
+    if col2.button(redo_label, disabled=not journal.redo_stack):
+        get_background_loop().run(st.session_state.executor.redo())
+        st.rerun()
 
 
 
 
 def save_changes():
-    if st.button("Save Changes"):
-        if st.session_state.viewer_editor.save_ifc_file():
+    if export_job_running():
+        st.info("An export is still running. Saving is available once it finishes.")
+    compact = st.checkbox("Compact the saved file", help="Merge duplicate points, directions and property values, and drop unreferenced entities")
+    if st.button("Save Changes", disabled=export_job_running()):
+        if st.session_state.viewer_editor.save_ifc_file(compact):
+            if compact:
+                # The model was read back from the compacted file
+                reselect(st.session_state.viewer_editor)
             st.success("Changes saved successfully.")
         else:
             st.error("Failed to save changes.")
+    undo_redo()
+
+    st.subheader("Validation")
+    validate_model()
+
+    st.subheader("Changeset")
+    changes = st.session_state.viewer_editor.changes
+    if len(changes):
+        # Only the edited entities, for sending to collaborators who already have the model
+        base_name = os.path.splitext(os.path.basename(st.session_state.viewer_editor.ifc_file_path))[0]
+        st.download_button(label=f"Download changeset ({len(changes)} edits)",
+                           data=json.dumps(changes.to_changeset(), indent=2),
+                           file_name=f"{base_name}_changes.json", mime="application/json")
+    else:
+        st.write("No changes have been made since the model was opened.")
+
+    changeset_file = st.file_uploader("Apply a changeset", type=["json"])
+    if changeset_file is not None and st.button("Apply Changeset", disabled=export_job_running()):
+        try:
+            changeset = json.load(changeset_file)
+        except ValueError as e:
+            st.error(f"Error reading changeset: {e}")
+            return
+        if changeset.get('format') != CHANGESET_FORMAT:
+            st.error("The uploaded file is not an IFC changeset.")
+            return
+        executor = st.session_state.executor
+        skipped = get_background_loop().run(executor.run_write(st.session_state.viewer_editor.apply_changeset, changeset))
+        st.success(f"Applied {len(changeset['edits']) - len(skipped)} of {len(changeset['edits'])} edits. Save to keep them.")
+        for reason in skipped:
+            st.warning(f"Skipped: {reason}")
+
+def validate_model():
+    from ifc_validation import ValidationError
+    rules_file = st.file_uploader("Rules (JSON, optional; the built-in rules are used otherwise)", type=["json"])
+    if st.button("Validate"):
+        try:
+            rules = json.load(rules_file) if rules_file is not None else None
+            if isinstance(rules, dict):
+                rules = rules.get('rules', [])
+            report = st.session_state.viewer_editor.validate(rules)
+        except (ValueError, ValidationError) as e:
+            st.error(f"Error validating: {e}")
+            return
+        counts = report.counts()
+        summary = f"{counts['error']} errors, {counts['warning']} warnings, {counts['info']} notes in {report.elements} elements"
+        if not report.issues:
+            st.success(summary)
+        elif report.passed():
+            st.warning(summary)
+        else:
+            st.error(summary)
+        if report.issues:
+            st.table([{"Rule": rule, "Issues": count} for rule, count in sorted(report.by_rule().items())])
+            st.dataframe(report.issues)
+            base_name = os.path.splitext(os.path.basename(st.session_state.viewer_editor.ifc_file_path))[0]
+            st.download_button("Download issues (CSV)", export_to_csv("validation.csv", report.issues),
+                               file_name=f"{base_name}_validation.csv", mime="text/csv")
 
 def count_elements():
-    element_types = st.session_state.viewer_editor.list_all_element_types()
-    selected_type = st.selectbox("Select element type to count", element_types)
+    index = st.session_state.viewer_editor.spatial_index()
+    scopes = {"Whole model": None, **page_cached('spatial_options', lambda: spatial_node_options(index))}
+    node_id = scopes[st.selectbox("Scope", list(scopes))]
+    if node_id is not None:
+        # Per-node type counts are computed with the spatial index
+        st.write(index.path(node_id))
+        st.table(page_cached('histogram', lambda: histogram_rows(index.nodes[node_id].histogram), node_id))
+        return
+    selected_type = st.selectbox("Select element type to count", element_types())
     if st.button("Count Elements"):
-        count = st.session_state.viewer_editor.count_elements_by_type(selected_type)
+        count = page_cached('type_count', lambda: st.session_state.viewer_editor.count_elements_by_type(selected_type), selected_type)
         st.write(f"Number of {selected_type} elements: {count}")
 
+def aggregate_quantities():
+    from ifc_aggregation import GROUP_KEYS, QUANTITIES, FUNCTIONS
+    group_by = st.multiselect("Group by", GROUP_KEYS, default=['type'])
+    quantity = st.selectbox("Quantity", QUANTITIES)
+    functions = st.multiselect("Functions", FUNCTIONS, default=list(FUNCTIONS))
+    if not functions:
+        st.warning("Choose at least one function.")
+        return
+    # Quantities are gathered once per model version; each grouping after that is a quick reduction
+    with st.spinner("Aggregating quantities..."):
+        rows = st.session_state.viewer_editor.aggregate_quantities(group_by, quantity, functions)
+    if not rows:
+        st.write("No elements to aggregate.")
+        return
+    st.write(f"Quantities in {'cubic' if quantity == 'Volume' else 'square'} metres")
+    st.dataframe(rows)
+    csv_data = export_to_csv("aggregate.csv", rows)
+    file_name = sanitize_filename(f"{quantity.lower()}_by_{'_'.join(group_by) or 'model'}.csv")
+    st.download_button("Download CSV", csv_data, file_name=file_name, mime="text/csv")
+
 def list_element_types():
-    element_types = st.session_state.viewer_editor.list_all_element_types()
     st.subheader("All element types in the IFC file:")
-    for element_type in element_types:
+    for element_type in element_types():
         st.write(f"  {element_type}")
 
+@st.cache_resource
+def get_background_loop():
+    # One event loop thread shared by all sessions; each session has its own model executor
+    return BackgroundLoop()
+
+def export_job_running():
+    job = st.session_state.get('export_job')
+    return job is not None and not job.done()
+
+def separate_export_members(elements_to_export, export_type):
+    for element in elements_to_export:
+        base_name = f"{sanitize_filename(element['Element Name'])}_{element['Element GlobalId']}"
+        if export_type in ["Properties", "Both"]:
+            yield f"{base_name}_properties.csv", element['Properties']
+        if export_type in ["Layers", "Both"] and element['Layers']:
+            yield f"{base_name}_layers.csv", element['Layers']
+
+def build_export_files(elements_to_export, export_type, export_mode, bundle_path, token):
+    export_files = []
+    warnings = []
+    elements_to_export.sort(key=lambda x: (x['Element Name'], x['Element GlobalId'], x['Element Type']))
+
+    if export_mode == "Separately":
+        # One ZIP on disk instead of a download button (and a CSV in memory) per element
+        written, empty = write_csv_bundle(separate_export_members(elements_to_export, export_type), bundle_path, token=token)
+        if empty:
+            warnings.append(f"No data to export for {len(empty)} files")
+        if written:
+            export_files.append((f"Download {written} CSV files (ZIP)", pathlib.Path(bundle_path).read_bytes,
+                                 os.path.basename(bundle_path), "application/zip"))
+    else:  # Collective export
+        if export_type in ["Properties", "Both"]:
+            collective_properties = [{**{'Element Name': e['Element Name'], 'Element GlobalId': e['Element GlobalId'], 'Element Type': e['Element Type']}, **e['Properties']} for e in elements_to_export]
+            csv_data = csv_bytes(collective_properties)
+            if csv_data:
+                export_files.append(("Download Collective Properties", csv_data, "collective_properties.csv", "text/csv"))
+        if export_type in ["Layers", "Both"]:
+            collective_layers = []
+            for element in elements_to_export:
+                for layer in element['Layers']:
+                    collective_layers.append({**{'Element Name': element['Element Name'], 'Element GlobalId': element['Element GlobalId'], 'Element Type': element['Element Type']}, **layer})
+            if collective_layers:
+                csv_data = csv_bytes(collective_layers)
+                if csv_data:
+                    export_files.append(("Download Collective Layers", csv_data, "collective_layers.csv", "text/csv"))
+            else:
+                warnings.append("No layers found for any selected elements")
+    return export_files, warnings
+
+async def export_in_background(executor, elements, export_type, export_mode, bundle_path):
+    elements_to_export = await executor.get_element_data(elements)
+    return await executor.export(build_export_files, elements_to_export, export_type, export_mode, bundle_path, with_token=True)
+
+def session_workspace():
+    # Uploads are parsed into one already; a file opened from the server gets one here, so exports
+    # never land next to the user's model. Removed on Reset or when the session is dropped.
+    if 'workspace' not in st.session_state:
+        st.session_state.workspace = tempfile.TemporaryDirectory(prefix="ifc_viewer_")
+    return st.session_state.workspace.name
+
+def export_bundle_path(viewer_editor):
+    # One directory per session in its workspace; each export replaces the previous bundle
+    if 'export_dir' not in st.session_state:
+        st.session_state.export_dir = tempfile.mkdtemp(prefix="exports_", dir=session_workspace())
+    base_name = os.path.splitext(os.path.basename(viewer_editor.ifc_file_path))[0]
+    return os.path.join(st.session_state.export_dir, f"{base_name}_export.zip")
+
 def export_data():
+    export_properties_and_layers()
+    export_element_graph()
+    extract_submodels()
+
+def export_element_graph():
+    st.subheader("Element graph")
+    viewer_editor = st.session_state.viewer_editor
+    export_format = st.radio("Format", ("JSON Lines", "SQLite"), horizontal=True)
+    scope = st.radio("Elements", ("All products", "Selected elements"), horizontal=True, key="graph_scope")
+    if st.button("Build element graph"):
+        elements = None
+        if scope == "Selected elements":
+            if not st.session_state.selected_elements:
+                st.warning("No elements selected. Use 'Select' command first.")
+                return
+            elements = st.session_state.selected_elements
+        base_name = os.path.splitext(os.path.basename(viewer_editor.ifc_file_path))[0]
+        # In this session's workspace: beside a watched model it could replace the user's own files
+        path = os.path.join(session_workspace(), f"{base_name}.{'sqlite' if export_format == 'SQLite' else 'jsonl'}")
+        with st.spinner("Exporting elements..."):
+            count = viewer_editor.export_graph(path, elements)
+        st.session_state.element_graph = (path, count)
+    if 'element_graph' in st.session_state:
+        path, count = st.session_state.element_graph
+        with open(path, 'rb') as f:
+            st.download_button(f"Download {os.path.basename(path)} ({count} elements)", f.read(), file_name=os.path.basename(path),
+                               mime="application/vnd.sqlite3" if path.endswith('.sqlite') else "application/jsonl")
+
+def export_key(export_type, export_mode):
+    viewer_editor = st.session_state.viewer_editor
+    return (id(viewer_editor), viewer_editor.model_version, selection_key(), export_type, export_mode)
+
+def export_reusable(export_type, export_mode):
+    # The same export of an unchanged model is already on screen, or still running
+    job = st.session_state.get('export_job')
+    if job is None or st.session_state.get('export_key') != export_key(export_type, export_mode):
+        return False
+    return not job.done() or (not job.cancelled() and job.exception() is None)
+
+def export_properties_and_layers():
     export_type = st.radio("Export type", ("Properties", "Layers", "Both"))
     export_mode = st.radio("Export mode", ("Separately", "Collectively"))
 
-    if st.button("Export"):
+    if st.button("Export", disabled=export_job_running()):
         if not st.session_state.selected_elements:
             st.warning("No elements selected. Use 'Select' command first.")
-        else:
-            elements_to_export = []
-            for element in st.session_state.selected_elements:
-                element_data = {
-                    'Element Name': element.Name,
-                    'Element GlobalId': element.GlobalId,
-                    'Element Type': element.is_a(),
-                    'Element ID': element.id(),
-                    'Properties': st.session_state.viewer_editor.get_element_properties(element),
-                    'Layers': []
-                }
-                if 'HasLayers' in element_data['Properties'] and element_data['Properties']['HasLayers']:
-                    for i in range(element_data['Properties']['NumberOfLayers']):
-                        layer = st.session_state.viewer_editor.select_layer(i, element)
-                        if layer:
-                            layer_properties = st.session_state.viewer_editor.get_layer_properties(layer)
-                            layer_properties['Layer Number'] = i + 1
-                            element_data['Layers'].append(layer_properties)
-                elements_to_export.append(element_data)
-
-            elements_to_export.sort(key=lambda x: (x['Element Name'], x['Element GlobalId'], x['Element Type']))
-
-            if export_mode == "Separately":
-                for element in elements_to_export:
-                    if export_type in ["Properties", "Both"]:
-                        csv_data = export_to_csv(f"{sanitize_filename(element['Element Name'])}_{element['Element GlobalId']}_properties.csv", element['Properties'])
-                        if csv_data:
-                            st.download_button(
-                                label=f"Download {element['Element Name']} Properties",
-                                data=csv_data,
-                                file_name=f"{sanitize_filename(element['Element Name'])}_{element['Element GlobalId']}_properties.csv",
-                                mime="text/csv"
-                            )
-                    if export_type in ["Layers", "Both"] and element['Layers']:
-                        csv_data = export_to_csv(f"{sanitize_filename(element['Element Name'])}_{element['Element GlobalId']}_layers.csv", element['Layers'])
-                        if csv_data:
-                            st.download_button(
-                                label=f"Download {element['Element Name']} Layers",
-                                data=csv_data,
-                                file_name=f"{sanitize_filename(element['Element Name'])}_{element['Element GlobalId']}_layers.csv",
-                                mime="text/csv"
-                            )
-            else:  # Collective export
-                if export_type in ["Properties", "Both"]:
-                    collective_properties = [{**{'Element Name': e['Element Name'], 'Element GlobalId': e['Element GlobalId'], 'Element Type': e['Element Type']}, **e['Properties']} for e in elements_to_export]
-                    csv_data = export_to_csv("collective_properties.csv", collective_properties)
-                    if csv_data:
-                        st.download_button(
-                            label="Download Collective Properties",
-                            data=csv_data,
-                            file_name="collective_properties.csv",
-                            mime="text/csv"
-                        )
-                if export_type in ["Layers", "Both"]:
-                    collective_layers = []
-                    for element in elements_to_export:
-                        for layer in element['Layers']:
-                            collective_layers.append({**{'Element Name': element['Element Name'], 'Element GlobalId': element['Element GlobalId'], 'Element Type': element['Element Type']}, **layer})
-                    if collective_layers:
-                        csv_data = export_to_csv("collective_layers.csv", collective_layers)
-                        if csv_data:
-                            st.download_button(
-                                label="Download Collective Layers",
-                                data=csv_data,
-                                file_name="collective_layers.csv",
-                                mime="text/csv"
-                            )
-                    else:
-                        st.warning("No layers found for any selected elements")
+        elif not export_reusable(export_type, export_mode):
+            # The export runs on the background loop so the rest of the app stays usable; the loop is
+            # shared by every session, so only this session's state holds the job and its result
+            st.session_state.export_job = get_background_loop().schedule(
+                export_in_background(st.session_state.executor, list(st.session_state.selected_elements), export_type, export_mode,
+                                     export_bundle_path(st.session_state.viewer_editor)))
+            st.session_state.export_key = export_key(export_type, export_mode)
+
+    job = st.session_state.get('export_job')
+    if job is None:
+        return
+    if not job.done():
+        st.info("Export is running. You can keep using other commands and come back here.")
+        col1, col2 = st.columns(2)
+        if col1.button("Refresh"):
+            st.rerun()
+        if col2.button("Cancel Export"):
+            job.cancel()
+            st.rerun()
+    elif job.cancelled():
+        st.warning("Export cancelled.")
+    elif job.exception() is not None:
+        st.error(f"Export failed: {job.exception()}")
+    else:
+        export_files, warnings = job.result()
+        for warning in warnings:
+            st.warning(warning)
+        for label, data, file_name, mime in export_files:
+            st.download_button(label=label, data=data, file_name=file_name, mime=mime)
+
+def extract_submodels():
+    st.subheader("IFC sub-models")
+    viewer_editor = st.session_state.viewer_editor
+    scope = st.radio("Extract", ("Selected elements", "Each storey", "Each type", "Each discipline"), horizontal=True)
+    if st.button("Build IFC files"):
+        output_dir = tempfile.mkdtemp(prefix="partitions_", dir=session_workspace())
+        base_name = os.path.splitext(os.path.basename(viewer_editor.ifc_file_path))[0]
+        with st.spinner("Writing sub-models..."):
+            if scope == "Selected elements":
+                if not st.session_state.selected_elements:
+                    st.warning("No elements selected. Use 'Select' command first.")
+                    return
+                path = viewer_editor.extract_elements(st.session_state.selected_elements, os.path.join(output_dir, f"{base_name}_selection.ifc"))
+                st.session_state.submodels = [("selection", path, len(st.session_state.selected_elements))]
+            else:
+                st.session_state.submodels = viewer_editor.extract_partitions(scope.split()[-1], output_dir)
+    for name, path, count in st.session_state.get('submodels', []):
+        with open(path, 'rb') as f:
+            st.download_button(f"{name} ({count} elements)", f.read(), file_name=os.path.basename(path), mime="application/x-step", key=f"submodel_{path}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,41 @@
+import os
+import pytest
+import ifcopenshell
+import ifcopenshell.util.element
+from command_line_ifc_viewer_editor import IFCViewerEditor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv("IFC_VIEWER_CACHE_DIR", str(tmp_path))
+
+def exported(element, names):
+    for values in ifcopenshell.util.element.get_psets(element, qtos_only=True).values():
+        for name in names:
+            if values.get(name):
+                return values[name]
+    return None
+
+def test_exported_quantities_keep_their_own_units():
+    # MAD_SCIENTIST_21.ifc has lengths in millimetres but areas and volumes in square and cubic metres
+    viewer_editor = IFCViewerEditor(os.path.join(HERE, "MAD_SCIENTIST_21.ifc"))
+    viewer_editor.aggregate_quantities(['type'])
+    frame = viewer_editor._aggregation.frame()
+    rows = {int(element_id): row for row, element_id in enumerate(frame.ids)}
+    checked = 0
+    for wall in viewer_editor.ifc_file.by_type('IfcWall'):
+        volume = exported(wall, ('NetVolume', 'GrossVolume'))
+        area = exported(wall, ('NetSideArea', 'GrossSideArea'))
+        if volume and area:
+            assert frame.quantities['Volume'][rows[wall.id()]] == pytest.approx(volume)
+            assert frame.quantities['Area'][rows[wall.id()]] == pytest.approx(area)
+            checked += 1
+    assert checked > 100
+
+def test_model_without_elements_has_no_groups(tmp_path):
+    ifc_file = ifcopenshell.file(schema='IFC4')
+    ifc_file.createIfcProject(ifcopenshell.guid.new(), Name="Empty")
+    viewer_editor = IFCViewerEditor(str(tmp_path / "empty.ifc"), ifc_file)
+    assert viewer_editor.aggregate_quantities(['type', 'storey']) == []
+    assert viewer_editor.aggregate_quantities([]) == []
@@ -0,0 +1,64 @@
+import os
+import shutil
+import pytest
+from command_line_ifc_viewer_editor import IFCViewerEditor
+from streamlit_ifc_viewer_editor_fine import IFCViewerEditor as StreamlitViewerEditor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+@pytest.fixture(autouse=True)
+def cache_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv("IFC_VIEWER_CACHE_DIR", str(tmp_path / "cache"))
+
+@pytest.fixture
+def duplex(tmp_path):
+    path = tmp_path / "Duplex_A.ifc"
+    shutil.copy(os.path.join(HERE, "Duplex_A.ifc"), path)
+    return str(path)
+
+def test_streamlit_editor_saves_without_compaction(duplex):
+    viewer_editor = StreamlitViewerEditor(duplex)
+    wall = viewer_editor.ifc_file.by_type('IfcWall')[0]
+    assert viewer_editor.update_element_property([wall], 'Name', 'Saved')
+    assert viewer_editor.save_ifc_file()
+    assert StreamlitViewerEditor(duplex).ifc_file.by_id(wall.id()).Name == 'Saved'
+
+def rename_first_wall(viewer_editor, name):
+    wall = viewer_editor.ifc_file.by_type('IfcWall')[0]
+    assert viewer_editor.update_element_property([wall], 'Name', name)
+    return wall.id()
+
+def test_clean_save_leaves_no_pending_work_but_keeps_undo_history(duplex):
+    viewer_editor = IFCViewerEditor(duplex)
+    rename_first_wall(viewer_editor, 'Saved')
+    assert viewer_editor.save_ifc_file()
+    reopened = IFCViewerEditor(duplex)
+    assert reopened.journal.pending() == 0
+    assert reopened.recover_journal(replay=False) == 0
+    assert [t.name for t in reopened.journal.undo_stack] == [t.name for t in viewer_editor.journal.undo_stack]
+
+def test_declined_recovery_keeps_history_and_drops_unsaved_records(duplex):
+    viewer_editor = IFCViewerEditor(duplex)
+    wall_id = rename_first_wall(viewer_editor, 'Saved')
+    assert viewer_editor.save_ifc_file()
+    viewer_editor.undo()
+    reopened = IFCViewerEditor(duplex)
+    assert reopened.journal.pending() == 1
+    reopened.recover_journal(replay=False)
+    assert reopened.ifc_file.by_id(wall_id).Name == 'Saved'
+    assert len(reopened.journal.undo_stack) == 1
+    assert IFCViewerEditor(duplex).journal.pending() == 0
+
+def test_edits_after_a_compacted_save_are_journaled(duplex):
+    viewer_editor = IFCViewerEditor(duplex)
+    viewer_editor.watch()
+    wall_id = rename_first_wall(viewer_editor, 'Compacted')
+    viewer_editor.selected_elements = [viewer_editor.ifc_file.by_id(wall_id)]
+    assert viewer_editor.save_ifc_file(compact=True)
+    assert viewer_editor.selected_elements[0].Name == 'Compacted'
+    rename_first_wall(viewer_editor, 'After')
+    assert os.path.exists(duplex + '.journal')
+    reopened = IFCViewerEditor(duplex)
+    assert reopened.journal.pending() == 1
+    assert reopened.recover_journal() == 1
+    assert reopened.ifc_file.by_id(wall_id).Name == 'After'